@@ -0,0 +1,78 @@
+"""
+Build the JSONL archive of package metadata from the cache.
+
+Usage
+python django-backend/manage.py runscript archive_metadata [--script-args <keyword>...]
+
+The cached package metadata ('catalog.json' files, or
+'metadata.sqlite3' if exists) of each site is appended to
+the archive in the 'archive' directory of the site,
+unless the same version is already archived,
+and the index of the archive is compacted.
+Set the environment variable XCKAN_METADATA_ARCHIVE to append
+every fetched version to the archive while updating.
+
+If '--script-args' option is specified,
+only sites that contain all the specified keywords in their site ids
+(the directory names in the cache directory)
+will be processed.
+"""
+import glob
+import json
+import logging
+import os
+
+from xckan.model.archive import MetadataArchive
+from xckan.model.cache import CkanCache
+from xckan.model.cachefile import load_json
+from xckan.model.metastore import MetadataStore
+
+logger = logging.getLogger(__name__)
+
+
+def each_cached_metadata(site_dir: str):
+    store_path = os.path.join(site_dir, CkanCache.metadata_store_filename)
+    if os.path.isfile(store_path):
+        store = MetadataStore(store_path)
+        try:
+            for package_id, content in store.each():
+                yield package_id, content, None
+        finally:
+            store.close()
+
+    for path in sorted(glob.glob(
+            os.path.join(glob.escape(site_dir), '*/catalog.json'))):
+        package_id = os.path.basename(os.path.dirname(path))
+        try:
+            content = load_json(path)
+        except (OSError, ValueError) as e:
+            logger.error("{} (while reading '{}')".format(e, path))
+            continue
+
+        yield package_id, content, os.path.getmtime(path)
+
+
+def archive_site(site_dir: str, stats: dict):
+    archive = MetadataArchive(os.path.join(site_dir, 'archive'))
+    try:
+        for package_id, content, fetched_at in each_cached_metadata(
+                site_dir):
+            stats['packages'] += 1
+            if archive.append(package_id, content, fetched_at):
+                stats['appended'] += 1
+
+        archive.compact_index()
+    finally:
+        archive.close()
+
+
+def run(*args):
+    cache = CkanCache()
+    stats = {"sites": 0, "packages": 0, "appended": 0}
+
+    for site_id, site_dir in cache.get_site_dirs(args):
+        logger.info("Archiving {}".format(site_id))
+        archive_site(site_dir, stats)
+        stats['sites'] += 1
+
+    print("STATS ------\n" + json.dumps(stats, indent=2, ensure_ascii=False))
@@ -0,0 +1,41 @@
+"""
+Remove resource files to keep the cache within the quotas.
+
+Usage
+python django-backend/manage.py runscript collect_resources [--script-args [quota=<bytes>] [site-quota=<bytes>]]
+
+The resource files of the packages no longer recorded in the cache
+manifest are removed, and then the least recently used files are removed
+until the sites are within their quotas and all sites are within
+the global quota.
+The quotas are RESOURCE_CACHE_QUOTA, RESOURCE_SITE_QUOTA and
+RESOURCE_SITE_QUOTAS in siteconf.py unless specified by
+'quota=<bytes>' and 'site-quota=<bytes>'.
+The files read or downloaded within RESOURCE_PIN_PERIOD seconds
+are kept.
+The sites being updated by another process, or whose harvest
+was interrupted, are skipped.
+"""
+import json
+import logging
+
+from xckan.model.cache import CkanCache
+
+logger = logging.getLogger(__name__)
+
+
+def run(*args):
+    quota = None
+    site_quota = None
+    for arg in args:
+        if arg.startswith('quota='):
+            quota = int(arg[6:])
+        elif arg.startswith('site-quota='):
+            site_quota = int(arg[11:])
+        else:
+            raise RuntimeError(
+                "Invalid parameter '{}'".format(arg))
+
+    cache = CkanCache()
+    stats = cache.collect_resources(quota=quota, site_quota=site_quota)
+    print("STATS ------\n" + json.dumps(stats, indent=2, ensure_ascii=False))
@@ -0,0 +1,79 @@
+"""
+Convert the cached package metadata into the SQLite metadata store.
+
+Usage
+python django-backend/manage.py runscript convert_metadata_store [--script-args <keyword>... [remove]]
+
+The 'catalog.json' and 'validators.json' files in the package
+directories are imported into 'metadata.sqlite3' in each site
+directory, keeping their modified times as the fetched times.
+Set the environment variable XCKAN_CACHE_BACKEND to 'sqlite'
+to use the converted store.
+
+If '--script-args' option is specified,
+only sites that contain all the specified keywords in their site ids
+(the directory names in the cache directory)
+will be processed.
+If 'remove' is specified, the converted files are removed.
+"""
+import glob
+import json
+import logging
+import os
+
+from xckan.model.cache import CkanCache
+from xckan.model.cachefile import load_json
+from xckan.model.metastore import MetadataStore
+
+logger = logging.getLogger(__name__)
+
+
+def convert_site(site_dir: str, remove: bool, stats: dict):
+    store = MetadataStore(os.path.join(
+        site_dir, CkanCache.metadata_store_filename))
+    try:
+        for path in sorted(glob.glob(
+                os.path.join(glob.escape(site_dir), '*/catalog.json'))):
+            package_dir = os.path.dirname(path)
+            package_id = os.path.basename(package_dir)
+            validators_path = os.path.join(package_dir, 'validators.json')
+            try:
+                content = load_json(path)
+                validators = {}
+                if os.path.isfile(validators_path):
+                    with open(validators_path, 'r', encoding='utf-8') as f:
+                        validators = json.load(f)
+
+                store.put(package_id, content,
+                          fetched_at=os.path.getmtime(path),
+                          validators=validators)
+            except (OSError, ValueError) as e:
+                logger.error("{} (while converting '{}')".format(e, path))
+                stats['fail'] += 1
+                continue
+
+            stats['packages'] += 1
+            stats['bytes'] += os.path.getsize(path)
+            if remove:
+                os.remove(path)
+                if os.path.isfile(validators_path):
+                    os.remove(validators_path)
+
+                if len(os.listdir(package_dir)) == 0:
+                    os.rmdir(package_dir)
+    finally:
+        store.close()
+
+
+def run(*args):
+    cache = CkanCache()
+    remove = 'remove' in args
+    keywords = [arg for arg in args if arg != 'remove']
+    stats = {"sites": 0, "packages": 0, "fail": 0, "bytes": 0}
+
+    for site_id, site_dir in cache.get_site_dirs(keywords):
+        logger.info("Converting {}".format(site_id))
+        convert_site(site_dir, remove, stats)
+        stats['sites'] += 1
+
+    print("STATS ------\n" + json.dumps(stats, indent=2, ensure_ascii=False))
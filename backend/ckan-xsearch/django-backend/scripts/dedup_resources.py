@@ -0,0 +1,79 @@
+"""
+Move the cached resource files into the blob store.
+
+Usage
+python django-backend/manage.py runscript dedup_resources [--script-args <keyword>... [gc]]
+
+Resource files downloaded before the blob store was introduced
+are stored in the blob store by their SHA-256 hashes and
+replaced with hard links to the stored files,
+so that the files with the same content occupy the disk only once.
+
+If '--script-args' option is specified,
+only sites that contain all the specified keywords in their site ids
+(the directory names in the cache directory)
+will be processed.
+If 'gc' is specified, the stored files no longer linked from
+any resource file are removed.
+"""
+import glob
+import json
+import logging
+import os
+
+from xckan.model.cache import CkanCache
+
+logger = logging.getLogger(__name__)
+
+# Files in the resource directory which are not resource files.
+non_resource_files = ('resource_meta.json', 'validators.json')
+
+
+def dedup_site(cache: CkanCache, site_dir: str, stats: dict):
+    # <site_id>/<package_id>/<resource_id>/<file>
+    for path in glob.glob(os.path.join(glob.escape(site_dir), '*/*/*')):
+        filename = os.path.basename(path)
+        if filename in non_resource_files or '.part' in filename or \
+                filename.endswith('.link') or \
+                os.path.islink(path) or not os.path.isfile(path):
+            continue
+
+        stats['files'] += 1
+        try:
+            st = os.stat(path)
+            if st.st_nlink > 1:
+                # Already linked to the blob store.
+                stats['linked'] += 1
+                continue
+
+            sha256, duplicated = cache.blob_store.import_file(path)
+        except OSError as e:
+            logger.error("{} (while importing '{}')".format(e, path))
+            stats['fail'] += 1
+            continue
+
+        if duplicated:
+            stats['duplicated'] += 1
+            stats['saved_bytes'] += st.st_size
+        else:
+            stats['stored'] += 1
+
+
+def run(*args):
+    cache = CkanCache()
+    keywords = [arg for arg in args if arg != 'gc']
+    stats = {
+        "files": 0, "linked": 0, "stored": 0, "duplicated": 0,
+        "fail": 0, "saved_bytes": 0,
+    }
+
+    for site_id, site_dir in cache.get_site_dirs(keywords):
+        logger.info("Processing {}".format(site_id))
+        dedup_site(cache, site_dir, stats)
+
+    if 'gc' in args:
+        count, size = cache.blob_store.remove_unreferenced()
+        stats['removed'] = count
+        stats['removed_bytes'] = size
+
+    print("STATS ------\n" + json.dumps(stats, indent=2, ensure_ascii=False))
@@ -0,0 +1,98 @@
+"""
+Rewrite the cached JSON files in the configured encoding.
+
+Usage
+python django-backend/manage.py runscript recompress_cache [--script-args [json|gzip|zstd] <keyword>...]
+
+The 'catalog.json', 'package_list.json' and 'updated_package_list.json'
+files in the cache directory are rewritten in place
+in the encoding specified by the environment variable
+XCKAN_CACHE_ENCODING, or by the script argument.
+Legacy pretty-printed JSON files are also rewritten as compact JSON.
+The modified times of the files are kept, since they are used
+to decide the expiration.
+
+The script runs at a low priority, so that it can be run
+in the background while the cache is used.
+A file modified during its conversion is left as is.
+
+If keywords are specified, only sites that contain all
+the keywords in their site ids
+(the directory names in the cache directory)
+will be processed.
+"""
+import glob
+import json
+import logging
+import os
+
+from xckan.model.cache import CkanCache
+from xckan.model.cachefile import cache_encodings, dump_json, \
+    get_cache_encoding, is_encoded, load_json
+
+logger = logging.getLogger(__name__)
+
+# Cached JSON files relative to the site directory
+patterns = ('package_list.json', 'updated_package_list.json',
+            '*/catalog.json')
+
+
+def recompress_file(path: str, encoding: str, stats: dict):
+    stats['files'] += 1
+    try:
+        if is_encoded(path, encoding):
+            return
+
+        st = os.stat(path)
+        content = load_json(path)
+        tmp_path = path + '.recompress'
+        dump_json(content, tmp_path, encoding)
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        current = os.stat(path)
+        if (current.st_mtime_ns, current.st_size) != \
+                (st.st_mtime_ns, st.st_size):
+            # Updated by another process during the conversion.
+            os.remove(tmp_path)
+            stats['skipped'] += 1
+            return
+
+        os.replace(tmp_path, path)
+    except (OSError, ValueError) as e:
+        logger.error("{} (while recompressing '{}')".format(e, path))
+        stats['fail'] += 1
+        return
+
+    stats['converted'] += 1
+    stats['bytes_before'] += st.st_size
+    stats['bytes_after'] += os.path.getsize(path)
+
+
+def run(*args):
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+
+    cache = CkanCache()
+    encoding = get_cache_encoding()
+    keywords = []
+    for arg in args:
+        if arg in cache_encodings:
+            encoding = get_cache_encoding(arg)
+        else:
+            keywords.append(arg)
+
+    stats = {
+        "encoding": encoding, "files": 0, "converted": 0, "skipped": 0,
+        "fail": 0, "bytes_before": 0, "bytes_after": 0,
+    }
+
+    for site_id, site_dir in cache.get_site_dirs(keywords):
+        logger.info("Recompressing {}".format(site_id))
+        for pattern in patterns:
+            for path in glob.glob(
+                    os.path.join(glob.escape(site_dir), pattern)):
+                recompress_file(path, encoding, stats)
+
+    print("STATS ------\n" + json.dumps(stats, indent=2, ensure_ascii=False))
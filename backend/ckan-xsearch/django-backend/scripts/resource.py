@@ -7,13 +7,19 @@ python django-backend/manage.py runscript resource [--script-args <keyword>...]
 If '--script-args' option is specified,
 only sites that contain all the specified keywords in their URLs
 will be considered for harvesting.
+
+The sites are processed concurrently.
+If RESOURCE_CACHE_QUOTA or RESOURCE_SITE_QUOTA(S) in siteconf.py
+is set, the resource files over the quotas are removed after that.
 """
+import concurrent.futures
 import json
 import logging
 
 from sites.models import Site as AdminSite
 from xckan.model.cache import CkanCache
 from xckan.model.site import Site as XckanSite
+from xckan.siteconf import site_config
 
 logger = logging.getLogger(__name__)
 
@@ -23,24 +29,41 @@ def harvest_resource(site: XckanSite):
     cache = CkanCache()
     stats = cache.get_resources_from_site(site, formats)
     stats['site'] = site.get_name()
-    print("STATS ------")
-    print(json.dumps(stats, indent=2, ensure_ascii=False))
+    print("STATS ------\n" + json.dumps(stats, indent=2, ensure_ascii=False))
 
 
 def run(*args):
     # logging.basicConfig(level=logging.DEBUG)
 
     admin_sites = AdminSite.objects.filter(enable=True).all()
-    for admin_site in admin_sites:
-        xckan_site = admin_site.get_xckan_site()
-        do_harvest = True
-        for arg in args:
-            if arg not in xckan_site.url_top:
-                do_harvest = False
-                break
-
-        if do_harvest:
-            harvest_resource(xckan_site)
-        else:
-            logger.debug("Skip {}({})".format(
-                admin_site.title, xckan_site.url_top))
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=4) as executor:
+        futures = {}
+        for admin_site in admin_sites:
+            xckan_site = admin_site.get_xckan_site()
+            do_harvest = True
+            for arg in args:
+                if arg not in xckan_site.url_top:
+                    do_harvest = False
+                    break
+
+            if do_harvest:
+                futures[executor.submit(
+                    harvest_resource, xckan_site)] = xckan_site
+            else:
+                logger.debug("Skip {}({})".format(
+                    admin_site.title, xckan_site.url_top))
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error("[{}] {}".format(
+                    futures[future].get_site_id(), e))
+
+    if site_config.RESOURCE_CACHE_QUOTA > 0 or \
+            site_config.RESOURCE_SITE_QUOTA > 0 or \
+            site_config.RESOURCE_SITE_QUOTAS:
+        stats = CkanCache().collect_resources()
+        print("STATS ------\n" + json.dumps(
+            stats, indent=2, ensure_ascii=False))
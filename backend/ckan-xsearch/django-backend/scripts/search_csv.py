@@ -92,6 +92,7 @@ def run(*args):
                 resource_name,
                 resource_path))
 
+            cache.touch_resource(xckan_site, package_id, resource)
             toc.append([
                 len(toc) + 1,
                 xckan_site.get_name(),
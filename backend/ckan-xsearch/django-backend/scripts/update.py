@@ -4,7 +4,7 @@
 Update ckan sites.
 
 Usage
-python django-backend/manage.py runscript update [--script-args [force-full | force] <keyword>...]
+python django-backend/manage.py runscript update [--script-args [force-full | force] [serial | async | bulk] <keyword>...]
 
 If '--script-args' option is specified,
 only sites that contain all the specified keywords in their URLs
@@ -16,6 +16,12 @@ a full update even if it is not yet the scheduled time.
 If 'force' is specified, the sites will be forced to perform
 a update even if it is not yet the scheduled time.
 
+If 'async' is specified, package metadata will be fetched
+concurrently. 'serial' fetches them one by one.
+'bulk' fetches them in large batches using 'package_search' API
+if the site supports it, otherwise one by one.
+If neither is specified, HARVEST_MODE in siteconf.py will be used.
+
 Example:
 
 - Full update sites contains "aomori" it it is before the scheduled time.
@@ -33,16 +39,20 @@ from smtplib import SMTPAuthenticationError
 from sites.mail import Mail
 from sites.models import Site as SiteSetting
 from xckan.model.cache import CkanCache
+from xckan.model.circuit import CircuitOpenError
+from xckan.siteconf import site_config
 
 logger = logging.getLogger(__name__)
 
 
 class SiteUpdater:
 
-    def __init__(self, cache, settings, do_full_update, do_force_full_update):
+    def __init__(self, cache, settings, do_full_update, do_force_full_update,
+                 harvest_mode='serial'):
         self.cache = cache
         self.threads = {}
         self.settings = settings
+        self.harvest_mode = harvest_mode
         if do_full_update:
             self.update_site_settings = self.settings
         else:
@@ -123,13 +133,19 @@ class SiteUpdater:
         buffer = io.StringIO()
 
         try:
-            result = self.cache.update_site(xckan_site, log=buffer)
+            result = self.cache.update_site(
+                xckan_site, log=buffer, mode=self.harvest_mode)
             if result:
                 setting.result = 'OK:{}'.format(
                     datetime.datetime.now().isoformat(timespec='seconds'))
             else:
                 setting.result = 'NG:{}'.format(
                     datetime.datetime.now().isoformat(timespec='seconds'))
+        except CircuitOpenError as e:
+            logger.warning("[{}] {}".format(site_id, e))
+            setting.result = 'NG:{}({})'.format(
+                datetime.datetime.now().isoformat(timespec='seconds'),
+                str(e)[:200])
         except RuntimeError as e:
             logger.error(e)
             setting.result = 'ERR:{}({})'.format(
@@ -176,18 +192,33 @@ class SiteUpdater:
         setting.full_result = 'Processing'
         setting.save()
 
-        # full update
-        self.cache.solr_manager.delete_site(xckan_site)
-
         buffer = io.StringIO()
         try:
-            result = self.cache.update_site(xckan_site, log=buffer)
+            # Do not clear the site which is not available now.
+            self.cache.get_circuit_breaker(xckan_site).check()
+
+            # full update
+            if self.cache.is_full_update_interrupted(xckan_site):
+                # Continue the interrupted full update
+                # without clearing the packages already harvested.
+                logger.info("[{}] Resuming interrupted full update".format(
+                    site_id))
+            else:
+                self.cache.solr_manager.delete_site(xckan_site)
+
+            result = self.cache.update_site(
+                xckan_site, log=buffer, mode=self.harvest_mode, full=True)
             if result:
                 setting.full_result = 'OK:{}'.format(
                     datetime.datetime.now().isoformat(timespec='seconds'))
             else:
                 setting.full_result = 'NG:{}'.format(
                     datetime.datetime.now().isoformat(timespec='seconds'))
+        except CircuitOpenError as e:
+            logger.warning("[{}] {}".format(site_id, e))
+            setting.full_result = 'NG:{}({})'.format(
+                datetime.datetime.now().isoformat(timespec='seconds'),
+                str(e)[:200])
         except RuntimeError as e:
             logger.error(e)
             setting.full_result = 'ERR:{}({})'.format(
@@ -223,12 +254,15 @@ def run(*args):
 
     do_force_full_update = False
     do_force_update = False
+    harvest_mode = site_config.HARVEST_MODE
     sitenames = []
     for arg in args:
         if arg == 'force-full':
             do_force_full_update = True
         elif arg == 'force':
             do_force_update = True
+        elif arg in CkanCache.harvest_modes:
+            harvest_mode = arg
         else:
             sitenames.append(arg)
 
@@ -248,6 +282,7 @@ def run(*args):
         site_settings = filtered_settings
 
     updater = SiteUpdater(cache, site_settings,
-                          do_force_update, do_force_full_update)
+                          do_force_update, do_force_full_update,
+                          harvest_mode)
     updater.update_sites()
     updater.full_update_sites()
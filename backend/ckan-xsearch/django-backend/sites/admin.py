@@ -35,6 +35,7 @@ class SiteAdmin(VersionAdmin):
         'full_update_time', 'full_executed_at', 'full_result',
         'tag_vocabulary', 'tag_default', 'publisher', 'publisher_url',
         'contact', 'contact_email', 'notify_contact_email',
+        'rate_limit', 'rate_burst',
     ]
 
     readonly_fields = [
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.12 on 2026-10-18 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0010_alter_site_ckanapi_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='site',
+            name='rate_burst',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='連続リクエスト数上限'),
+        ),
+        migrations.AddField(
+            model_name='site',
+            name='rate_limit',
+            field=models.FloatField(blank=True, null=True, verbose_name='リクエスト数上限（回/秒）'),
+        ),
+    ]
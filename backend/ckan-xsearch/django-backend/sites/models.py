@@ -1,5 +1,4 @@
 from datetime import timedelta
-import re
 
 import aniso8601
 from django.core.exceptions import ValidationError
@@ -7,6 +6,7 @@ from django.urls import reverse
 from django.db import models
 
 from xckan.model.site import Site as XckanSite
+from xckan.model.vocabulary import get_vocabulary_matcher
 
 
 def validate_interval(value):
@@ -70,6 +70,11 @@ class Site(models.Model):
     tag_default = models.CharField(
         max_length=100, null=True, blank=True, verbose_name="デフォルトタグ")
 
+    rate_limit = models.FloatField(
+        null=True, blank=True, verbose_name="リクエスト数上限（回/秒）")
+    rate_burst = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name="連続リクエスト数上限")
+
     def __str__(self):
         return self.title
 
@@ -149,16 +154,16 @@ class Site(models.Model):
         """
         xckan_site = XckanSite(
             self.title, self.dataset_url,
-            self.ckanapi_url, self.proxy_url)
+            self.ckanapi_url, self.proxy_url,
+            rate_limit=self.rate_limit, rate_burst=self.rate_burst)
 
         # Set tag vocabulary
         xckan_site.tag_default = self.tag_default
         if self.tag_vocabulary not in (None, ''):
-            vocabs = self.tag_vocabulary.split(',')
-            xckan_site.re_vocab = re.compile(
-                '|'.join([f'({v})' for v in vocabs]))
+            xckan_site.vocabulary = get_vocabulary_matcher(
+                self.tag_vocabulary)
         else:
-            xckan_site.re_vocab = None
+            xckan_site.vocabulary = None
 
         return xckan_site
 
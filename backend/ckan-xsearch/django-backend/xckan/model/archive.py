@@ -0,0 +1,247 @@
+# coding: utf-8
+
+import hashlib
+import json
+from logging import getLogger
+import mmap
+import os
+import threading
+import time
+
+logger = getLogger(__name__)
+
+
+class MetadataArchive(object):
+    """
+    Append-only archive of every fetched version of package metadata.
+
+    Each version is written as a line of JSON to the segment files
+    'metadata_000.jsonl', 'metadata_001.jsonl', ... and
+    the position of the latest version of each package is recorded
+    in the index file 'index.tsv', whose lines are
+    "<package_id> TAB <segment> TAB <offset> TAB <length> TAB <hash>".
+    The index is also append-only; the last line of a package wins,
+    and a line with segment -1 means that the package was deleted.
+
+    The latest versions are read by mmap, and the segments can be
+    read sequentially without opening a file per package.
+    """
+
+    # Size of a segment file to start the next one
+    segment_bytes = 64 * 1024 * 1024
+    # Buffer size to read the segments sequentially
+    read_buffer_size = 1024 * 1024
+
+    index_filename = 'index.tsv'
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path: str
+            The directory of the archive, created if not exists.
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.index = {}
+        self.mmaps = {}
+        self.segment = 0
+        os.makedirs(path, 0o755, True)
+        self.__load_index()
+
+    def __get_segment_path(self, segment):
+        return os.path.join(
+            self.path, "metadata_{:0>3}.jsonl".format(segment))
+
+    def __load_index(self):
+        segments = [
+            int(name[9:-6]) for name in os.listdir(self.path)
+            if name.startswith('metadata_') and name.endswith('.jsonl')]
+        if segments:
+            self.segment = max(segments)
+
+        path = os.path.join(self.path, self.index_filename)
+        if not os.path.isfile(path):
+            return
+
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != 5:
+                    # Broken by an interrupted write.
+                    continue
+
+                package_id, segment, offset, length, sha256 = fields
+                if segment == '-1':
+                    self.index.pop(package_id, None)
+                else:
+                    self.index[package_id] = (
+                        int(segment), int(offset), int(length), sha256)
+
+    def __append_index(self, lines):
+        path = os.path.join(self.path, self.index_filename)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(''.join(lines))
+
+    def close(self):
+        with self.lock:
+            for m in self.mmaps.values():
+                m.close()
+
+            self.mmaps = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, package_id):
+        return package_id in self.index
+
+    def append(self, package_id, content, fetched_at=None):
+        """
+        Append a version of the package metadata.
+        Nothing is written if it is identical to the latest version.
+
+        Parameters
+        ----------
+        package_id: str
+            The target id.
+        content: dict
+            A dict object decoded from the JSON returned by
+            the package_show API.
+        fetched_at: float, optional
+            The time the content was fetched. Now if omitted.
+
+        Returns
+        -------
+        bool
+            True if the version is appended.
+        """
+        data = json.dumps(
+            content, ensure_ascii=False, separators=(',', ':'),
+            sort_keys=True)
+        sha256 = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        line = '{{"id":{},"fetched_at":{},"content":{}}}\n'.format(
+            json.dumps(package_id, ensure_ascii=False),
+            json.dumps(fetched_at or time.time()), data).encode('utf-8')
+
+        with self.lock:
+            latest = self.index.get(package_id)
+            if latest is not None and latest[3] == sha256:
+                return False
+
+            path = self.__get_segment_path(self.segment)
+            if os.path.isfile(path) and \
+                    os.path.getsize(path) >= self.segment_bytes:
+                self.segment += 1
+                path = self.__get_segment_path(self.segment)
+
+            with open(path, 'ab') as f:
+                offset = f.tell()
+                f.write(line)
+
+            self.index[package_id] = (
+                self.segment, offset, len(line), sha256)
+            self.__append_index(['{}\t{}\t{}\t{}\t{}\n'.format(
+                package_id, self.segment, offset, len(line), sha256)])
+
+        return True
+
+    def delete(self, package_ids):
+        """
+        Record that the packages were deleted.
+        Their versions are kept in the segments.
+        """
+        with self.lock:
+            lines = []
+            for package_id in package_ids:
+                if self.index.pop(package_id, None) is not None:
+                    lines.append('{}\t-1\t0\t0\t\n'.format(package_id))
+
+            if lines:
+                self.__append_index(lines)
+
+    def __get_mmap(self, segment, end):
+        m = self.mmaps.get(segment)
+        if m is None or len(m) < end:
+            # The segment has grown since it was mapped.
+            if m is not None:
+                m.close()
+
+            with open(self.__get_segment_path(segment), 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            self.mmaps[segment] = m
+
+        return m
+
+    def get(self, package_id):
+        """
+        Get the latest version of the package metadata.
+
+        Returns
+        -------
+        dict or None
+            'id', 'fetched_at' and 'content' of the version,
+            or None if not archived.
+        """
+        with self.lock:
+            entry = self.index.get(package_id)
+            if entry is None:
+                return None
+
+            segment, offset, length, _ = entry
+            m = self.__get_mmap(segment, offset + length)
+            return json.loads(m[offset:offset + length])
+
+    def each(self, latest_only=True):
+        """
+        Read the archived versions sequentially in the order written.
+
+        Parameters
+        ----------
+        latest_only: bool, optional
+            If True (default), only the latest versions of the packages
+            not deleted are returned. Otherwise, all versions.
+
+        Returns
+        -------
+        dict
+            'id', 'fetched_at' and 'content' of each version.
+        """
+        with self.lock:
+            last_segment = self.segment
+            positions = {
+                (entry[0], entry[1]) for entry in self.index.values()}
+
+        for segment in range(last_segment + 1):
+            path = self.__get_segment_path(segment)
+            if not os.path.isfile(path):
+                continue
+
+            with open(path, 'rb', buffering=self.read_buffer_size) as f:
+                offset = 0
+                for line in f:
+                    position = (segment, offset)
+                    offset += len(line)
+                    if latest_only and position not in positions:
+                        continue
+
+                    if not line.endswith(b'\n'):
+                        # Broken by an interrupted write.
+                        break
+
+                    yield json.loads(line)
+
+    def compact_index(self):
+        """
+        Rewrite the index file to keep only the latest entries.
+        """
+        with self.lock:
+            path = os.path.join(self.path, self.index_filename)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for package_id, entry in sorted(self.index.items()):
+                    f.write('{}\t{}\t{}\t{}\t{}\n'.format(
+                        package_id, *entry))
+
+            os.replace(tmp_path, path)
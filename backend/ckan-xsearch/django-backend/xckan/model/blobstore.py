@@ -0,0 +1,306 @@
+# coding: utf-8
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+from logging import getLogger
+import os
+import shutil
+import threading
+
+logger = getLogger(__name__)
+
+
+class BlobStore(object):
+    """
+    Content-addressed store of the resource files.
+
+    Each file is stored once as 'blobs/<aa>/<bb>/<sha256>',
+    and the resource files in the site directories are
+    hard links to it, so that the same file published
+    by multiple sites or packages occupies the disk only once.
+
+    The validators of the urls downloaded into the store are also
+    recorded, so that a resource published at the same url by
+    another site can be checked by a conditional request
+    instead of downloading it again.
+
+    A stored file is removed when no resource file links to it,
+    so linking and removing the stored files are serialized by
+    a lock file in the store, shared by the processes.
+    """
+
+    chunk_size = 65536
+
+    def __init__(self, base):
+        """
+        Parameters
+        ----------
+        base: str
+            The directory of the store.
+        """
+        self.base = base
+        self.thread_lock = threading.RLock()
+        self.lock_fd = None
+        self.lock_depth = 0
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        Lock the store exclusively between the threads and processes.
+        It can be nested in the same thread.
+        """
+        with self.thread_lock:
+            if self.lock_depth == 0:
+                os.makedirs(self.base, 0o755, True)
+                self.lock_fd = os.open(
+                    os.path.join(self.base, '.lock'),
+                    os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+
+            self.lock_depth += 1
+            try:
+                yield
+            finally:
+                self.lock_depth -= 1
+                if self.lock_depth == 0:
+                    fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+                    os.close(self.lock_fd)
+                    self.lock_fd = None
+
+    @staticmethod
+    def get_file_hash(path, chunk_size=65536):
+        """
+        Calculate the SHA-256 hash of the file.
+        """
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha256.update(chunk)
+
+        return sha256.hexdigest()
+
+    def get_blob_path(self, sha256):
+        return os.path.join(self.base, sha256[0:2], sha256[2:4], sha256)
+
+    def has(self, sha256):
+        return bool(sha256) and os.path.isfile(self.get_blob_path(sha256))
+
+    def add(self, path, sha256):
+        """
+        Move the file into the store.
+        If the same content is already stored, the file is removed.
+
+        Parameters
+        ----------
+        path: str
+            The file to be stored. It no longer exists after the call.
+        sha256: str
+            The SHA-256 hash of the file.
+
+        Returns
+        -------
+        bool
+            True if the file is added, False if it was a duplicate.
+        """
+        blob_path = self.get_blob_path(sha256)
+        with self.locked():
+            if os.path.isfile(blob_path):
+                os.remove(path)
+                return False
+
+            os.makedirs(os.path.dirname(blob_path), 0o755, True)
+            os.replace(path, blob_path)
+            return True
+
+    def add_and_link(self, path, sha256, dest_path):
+        """
+        Move the file into the store and make the dest_path
+        refer to the stored file, without letting the stored file
+        be removed between them.
+
+        Returns
+        -------
+        bool
+            True if the file is added, False if it was a duplicate.
+        """
+        with self.locked():
+            added = self.add(path, sha256)
+            self.link(sha256, dest_path)
+
+        return added
+
+    def link(self, sha256, dest_path):
+        """
+        Make the dest_path refer to the stored file.
+
+        A hard link is made if possible,
+        otherwise the file is copied.
+        """
+        blob_path = self.get_blob_path(sha256)
+        tmp_path = dest_path + '.link'
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+
+        with self.locked():
+            try:
+                os.link(blob_path, tmp_path)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                                   errno.ENOTSUP):
+                    raise
+
+                logger.debug(
+                    "Cannot make a hard link to '{}', copied.".format(
+                        blob_path))
+                shutil.copyfile(blob_path, tmp_path)
+
+            os.replace(tmp_path, dest_path)
+
+    def import_file(self, path, sha256=None):
+        """
+        Put an existing file into the store and
+        replace it with the link to the stored file.
+
+        Parameters
+        ----------
+        path: str
+            The file to be imported.
+        sha256: str, optional
+            The SHA-256 hash of the file, calculated if omitted.
+
+        Returns
+        -------
+        (str, bool)
+            The SHA-256 hash and whether the file was a duplicate.
+        """
+        if sha256 is None:
+            sha256 = self.get_file_hash(path, self.chunk_size)
+
+        blob_path = self.get_blob_path(sha256)
+        with self.locked():
+            if not os.path.isfile(blob_path):
+                os.makedirs(os.path.dirname(blob_path), 0o755, True)
+                try:
+                    os.link(path, blob_path)
+                except OSError:
+                    shutil.copyfile(path, blob_path)
+
+                return sha256, False
+
+            if not os.path.samefile(path, blob_path):
+                self.link(sha256, path)
+                return sha256, True
+
+        return sha256, False
+
+    def __get_url_record_path(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.base, 'urls', key[0:2], key + '.json')
+
+    def get_url_record(self, url):
+        """
+        Get the validators recorded when the url was downloaded.
+
+        Returns
+        -------
+        dict
+            'etag', 'last_modified', 'sha256' and 'content_length'.
+            Empty if the url is not recorded or its file is not stored.
+        """
+        path = self.__get_url_record_path(url)
+        if not os.path.isfile(path):
+            return {}
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except ValueError:
+            return {}
+
+        if not self.has(record.get('sha256')):
+            return {}
+
+        return record
+
+    def set_url_record(self, url, validators):
+        """
+        Record the validators of the url.
+        """
+        path = self.__get_url_record_path(url)
+        os.makedirs(os.path.dirname(path), 0o755, True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "url": url,
+                "etag": validators.get('etag'),
+                "last_modified": validators.get('last_modified'),
+                "sha256": validators.get('sha256'),
+                "content_length": validators.get('content_length'),
+            }, f, indent=2, ensure_ascii=False)
+
+        os.replace(tmp_path, path)
+
+    def each_blob(self):
+        """
+        Iterate over the paths of the stored files.
+        """
+        for root, dirs, files in os.walk(self.base):
+            if root == self.base:
+                dirs[:] = [d for d in dirs if d != 'urls']
+
+            for name in files:
+                if len(name) == 64:
+                    yield os.path.join(root, name)
+
+    def remove_unreferenced(self):
+        """
+        Remove the stored files which are no longer linked
+        from any resource file.
+
+        Returns
+        -------
+        (int, int)
+            The number of removed files and their total size.
+        """
+        count, size = 0, 0
+        for path in self.each_blob():
+            removed = self.__remove_if_unreferenced(path)
+            if removed is not None:
+                count += 1
+                size += removed
+
+        return count, size
+
+    def remove_if_unreferenced(self, sha256):
+        """
+        Remove the stored file if no resource file links to it.
+
+        Returns
+        -------
+        bool
+            True if removed.
+        """
+        return self.__remove_if_unreferenced(
+            self.get_blob_path(sha256)) is not None
+
+    def __remove_if_unreferenced(self, path):
+        """
+        Returns
+        -------
+        int or None
+            The size of the removed file, or None if not removed.
+        """
+        with self.locked():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return None
+
+            if st.st_nlink != 1:
+                return None
+
+            os.remove(path)
+            return st.st_size
@@ -1,24 +1,41 @@
 # coding: utf-8
 
+import collections
+import concurrent.futures
 import datetime
 import glob
-from http.client import InvalidURL
+import hashlib
+import heapq
 import json
 from json import JSONDecodeError
 from logging import getLogger
+import math
 import os
 import shutil
-import socket
+import threading
 import time
 import urllib.parse
-import urllib.request
+
+import urllib3
 
 from xckan.siteconf import site_config
+from .archive import MetadataArchive
+from .blobstore import BlobStore
+from .cachefile import decompress_errors, dump_json, load_json, \
+    open_cache_file, open_cache_file_for_write
+from .checkpoint import HarvestCheckpoint
+from .circuit import CircuitBreaker
+from .harvest import AsyncHarvester, get_host_semaphore
+from .httpclient import http_client, HttpError, NOT_MODIFIED, \
+    get_conditional_headers, update_validators
+from .jsonstream import JsonArrayStream
+from .manifest import SiteManifest, get_content_hash
+from .metastore import MetadataStore
+from .sitelock import SiteLock
 from .solr import SolrManager
 from .metadata import Metadata
 
 logger = getLogger(__name__)
-ctx = site_config.get_ssl_context()
 
 
 class CkanCache:
@@ -26,6 +43,25 @@ class CkanCache:
     list_expiration_days = 1
     metadata_expiration_days = 7
 
+    # Available modes to fetch package metadata.
+    # - serial: fetch packages one by one
+    # - async: fetch packages concurrently using asyncio
+    # - bulk: fetch packages in large batches using package_search
+    harvest_modes = ('serial', 'async', 'bulk')
+
+    # Number of packages fetched at once in the bulk mode
+    bulk_rows = 1000
+
+    # Name of the database file of MetadataStore in the site directory
+    metadata_store_filename = 'metadata.sqlite3'
+    # Name of the manifest file in the site directory
+    manifest_filename = 'manifest.sqlite3'
+
+    # Size of the chunks to write the resource files
+    resource_chunk_size = 65536
+    # Interval seconds to log the progress of resource downloads
+    resource_log_seconds = 60
+
     def __init__(self, cache_dir=None):
         """
         Create file cache manager object.
@@ -39,13 +75,27 @@ class CkanCache:
             will be used.
         """
 
-        # self.nmetadata = 0
-
         self.base = os.path.normpath(site_config.CACHEDIR)
         if self.base[-1:] != '/':
             self.base += '/'
 
         self.solr_manager = SolrManager()
+        self.blob_store = BlobStore(os.path.join(self.base, 'blobs'))
+        self.metadata_stores = {}
+        self.metadata_stores_lock = threading.Lock()
+        self.metadata_archives = {}
+        self.manifests = {}
+        self.site_locks = {}
+        # Parsed package metadata read from the cached files,
+        # kept in the least recently used order.
+        self.metadata_cache = collections.OrderedDict()
+        self.metadata_cache_lock = threading.Lock()
+        self.metadata_cache_stats = {"hits": 0, "misses": 0}
+        # Content hashes of the packages indexed in Solr and
+        # the numbers of changed and skipped packages,
+        # available while updating the site.
+        self.indexed_hashes = {}
+        self.index_stats = {}
 
     def compare_list(self, site, use_cache=False):
         """
@@ -81,13 +131,14 @@ class CkanCache:
             "package_list - id_list": add_idlist,
         }
 
-    def update_site(self, site, log=None):
+    def update_site(self, site, log=None, mode='serial', full=False):
         """
         Update package list and metadata of the site.
 
         To prevent multiple queries from being made to
         a single site at the same time, lock access to the site
-        using a lock file.
+        using a lock file, which is released automatically
+        if the process exits.
 
         The actual update process is implemented by the
         `__update_site` method.
@@ -98,12 +149,27 @@ class CkanCache:
             The target site.
         log: File-like object (optional)
             If set, output update log to here.
+        mode: str (optional)
+            The mode to fetch package metadata,
+            one of `harvest_modes`. (default: 'serial')
+        full: bool (optional)
+            True if the Solr index of the site has been cleared
+            for a full update. It is recorded in the checkpoint
+            so that an interrupted full update can be continued.
 
         Results
         -------
         bool
             Return True if updated successfully, otherwise False.
+
+        Raises
+        ------
+        xckan.model.circuit.CircuitOpenError
+            If the update is stopped by the circuit breaker of the site.
         """
+        if mode not in self.harvest_modes:
+            raise RuntimeError("Unknown harvest mode '{}'".format(mode))
+
         result = False
         logger.debug("[{}] Locking for updating".format(
             site.get_site_id()))
@@ -112,14 +178,15 @@ class CkanCache:
                 site.get_site_id()))
         else:
             try:
-                result = self.__update_site(site, log)
+                site.configure_rate_limit()
+                result = self.__update_site(site, log, mode, full)
             finally:
                 self.__unlock_site(site)
                 logger.debug("[{}] Unlocked".format(site.get_site_id()))
 
         return result
 
-    def __update_site(self, site, log=None):
+    def __update_site(self, site, log=None, mode='serial', full=False):
         """
         Performing the actual update processes of the site.
 
@@ -129,8 +196,32 @@ class CkanCache:
             The target site.
         log: File-like object (optional)
             If set, output update log to here.
+        mode: str (optional)
+            The mode to fetch package metadata.
+        full: bool (optional)
+            True if this is a full update.
         """
         site_id = site.get_site_id()
+        transfer = http_client.transfer_stats.get(site_id)
+        self.indexed_hashes[site_id] = {}
+        self.index_stats[site_id] = {"changed": 0, "skipped": 0}
+
+        # Give up if the site keeps failing
+        breaker = self.get_circuit_breaker(site)
+        breaker.check()
+
+        # Dispatch to the metadata format detected last time
+        self.__load_metadata_class(site)
+
+        # Continue the harvest if the last update was interrupted
+        checkpoint = self.get_harvest_checkpoint(site)
+        if checkpoint.load():
+            logger.info(
+                "[{}] Resuming harvest, {} packages remain.".format(
+                    site_id, len(checkpoint.get_remaining())))
+            if log:
+                print("Resuming harvest, {} packages remain.".format(
+                    len(checkpoint.get_remaining())), file=log)
 
         # Check last updated datetime
         last_updated = self.get_last_updated(site)
@@ -167,35 +258,46 @@ class CkanCache:
         else:
             logger.debug("[{}] - trying get_updated_package_list".format(
                 site_id))
-            updated = site.get_updated_package_list(elapsed_seconds)
+            updated = site.iter_updated_packages(elapsed_seconds)
 
         if updated is not False:
             logger.debug("[{}] - get_updated_package_list succeeded."
                          .format(site_id))
+            if not full:
+                # Skip reindexing the packages not changed actually.
+                # Not used in full update, since the documents
+                # may have been deleted but not yet committed.
+                self.indexed_hashes[site_id] = \
+                    self.get_content_hashes_from_solr(site)
+
             id_list = self.__update_by_updated_package_list(site, updated)
             self.solr_manager.flash_buffer()
 
         # Step 2: ID based syncronization
         # Get the package_list from the CKAN site,
         # compare it with the id registered in Solr, and syncronize it.
-        logger.debug("[{}] - trying get_package_list".format(site_id))
-        package_list = self.get_package_list(site, force=True)
-        if package_list is False:
+        logger.debug("[{}] - trying get_package_ids".format(site_id))
+        package_ids = self.get_package_ids(site)
+        if package_ids is False:
+            breaker.record_failure("Can't get package_list")
             return False
 
+        breaker.record_success()
+
         logger.debug("[{}] - package_list has {} id.".format(
-            site_id, len(package_list['result'])))
+            site_id, len(package_ids)))
 
         if updated is False and last_updated['list'] == 0:
             # Perform full update on the site
             del_idlist = []
-            add_idlist = [id for id in package_list['result']]
+            add_idlist = [id for id in package_ids]
         else:
             id_list = self.get_id_list_from_solr(site)
             del_idlist = [
-                id for id in id_list if id not in package_list['result']]
-            add_idlist = [id for id in package_list['result']
-                          if id not in id_list]
+                id for id in id_list if id not in package_ids]
+            add_idlist = [id for id in package_ids
+                          if id not in id_list or
+                          checkpoint.is_remaining(id)]
 
         logger.debug("[{}] added:{}".format(
             site_id,
@@ -214,22 +316,163 @@ class CkanCache:
                 print("No packages were added or removed.",
                       file=log)
 
-        if len(add_idlist) > 0:
-            logger.debug("[{}] Adding new datasets.".format(site_id))
-            self.add_new_metadata(site, add_idlist)
+        checkpoint.start(add_idlist, full)
+        try:
+            if len(add_idlist) > 0:
+                logger.debug("[{}] Adding new datasets.".format(site_id))
+                self.add_new_metadata(
+                    site, add_idlist, mode, checkpoint, breaker)
+
+            if len(del_idlist) > 0:
+                logger.debug("[{}] Deleting old datasets.".format(site_id))
+                self.delete_obsoleted_metadata(site, del_idlist)
+        finally:
+            # Keep the progress even if stopped by the circuit breaker.
+            checkpoint.save()
 
-        if len(del_idlist) > 0:
-            logger.debug("[{}] Deleting old datasets.".format(site_id))
-            self.delete_obsoleted_metadata(site, del_idlist)
+        checkpoint.finish()
+        breaker.finish()
 
-        self.solr_manager.flash_buffer()
+        if log and len(checkpoint.failed) > 0:
+            print("Failed (will be retried): {}".format(
+                json.dumps(checkpoint.failed, ensure_ascii=False)),
+                file=log)
+
+        transfer = http_client.transfer_stats.diff(site_id, transfer)
+        message = "Transferred {} bytes ({} bytes uncompressed)".format(
+            transfer['compressed'], transfer['uncompressed'])
+        logger.info("[{}] {} in {} requests.".format(
+            site_id, message, transfer['requests']))
+        if log:
+            print(message, file=log)
+
+        index_stats = self.index_stats.pop(site_id)
+        self.indexed_hashes.pop(site_id, None)
+        message = "Indexed {} changed packages, skipped {} unchanged" \
+            .format(index_stats['changed'], index_stats['skipped'])
+        logger.info("[{}] {}".format(site_id, message))
+        if log:
+            print(message, file=log)
+
+        stats = self.get_cache_stats(site)
+        message = "Cached {} packages ({} bytes), {} resources ({} bytes)" \
+            .format(stats['packages'], stats['package_bytes'],
+                    stats['resources'], stats['resource_bytes'])
+        logger.info("[{}] {}".format(site_id, message))
+        if log:
+            print(message, file=log)
+
+        for change, count in self.__save_metadata_class(site).items():
+            message = "Metadata format changed from {} in {} packages" \
+                .format(change.replace(' -> ', ' to '), count)
+            logger.warning("[{}] {}".format(site_id, message))
+            if log:
+                print(message, file=log)
 
         return True
 
+    def __load_metadata_class(self, site):
+        """
+        Set the Metadata subclass recorded in the manifest to the site,
+        unless the site already has one.
+        """
+        if site.metadata_class is not None:
+            return
+
+        name = self.get_manifest(site).get_property('metadata_class')
+        if name is None:
+            return
+
+        c = Metadata.get_class_by_name(name)
+        if c is False:
+            logger.warning("[{}] Unknown metadata class '{}'".format(
+                site.get_site_id(), name))
+            return
+
+        site.metadata_class = c
+
+    def __save_metadata_class(self, site):
+        """
+        Record the Metadata subclass detected for the site
+        in the manifest.
+
+        Returns
+        -------
+        dict
+            The numbers of packages whose formats differed from
+            the detected one, by "<old class> -> <new class>".
+            They are cleared after returned.
+        """
+        if site.metadata_class is not None:
+            self.get_manifest(site).set_property(
+                'metadata_class', site.metadata_class.__name__)
+
+        changes = site.metadata_class_changes
+        site.metadata_class_changes = {}
+        return changes
+
+    def get_harvest_checkpoint(self, site):
+        """
+        Get the harvest checkpoint of the site.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+
+        Returns
+        -------
+        xckan.model.checkpoint.HarvestCheckpoint
+            The checkpoint object, not loaded yet.
+        """
+        return HarvestCheckpoint(
+            self.__get_harvest_checkpoint_path(site.get_site_id()),
+            flush=self.solr_manager.flash_buffer)
+
+    def __get_harvest_checkpoint_path(self, site_id):
+        return os.path.join(
+            self.__get_cache_base(), site_id, 'harvest_checkpoint.json')
+
+    def get_circuit_breaker(self, site):
+        """
+        Get the circuit breaker of the site.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+
+        Returns
+        -------
+        xckan.model.circuit.CircuitBreaker
+            The circuit breaker with the state of the last run.
+        """
+        path = os.path.join(
+            self.__get_site_cache_base(site), 'circuit.json')
+        return CircuitBreaker(path, site.get_site_id())
+
+    def is_full_update_interrupted(self, site):
+        """
+        Check if the last full update of the site was interrupted.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+
+        Returns
+        -------
+        bool
+            True if the full update can be continued
+            without clearing the Solr index.
+        """
+        checkpoint = self.get_harvest_checkpoint(site)
+        return checkpoint.load() and checkpoint.full
+
     def get_last_updated(self, site):
         """
         Get the last updated timestamp of the site
-        from the modified time of the cached files.
+        from the manifest, or the modified time of the cached files.
 
         Parameters
         ----------
@@ -244,16 +487,10 @@ class CkanCache:
             update: timestamp
                 The timestamp of `updated_package_list.json` file.
         """
-        mtime_list = 0
-        mtime_update = 0
-
-        path = self.__get_package_list_path(site)
-        if os.path.isfile(path):
-            mtime_list = os.path.getmtime(path)
-
-        path = self.__get_updated_package_list_path(site)
-        if os.path.isfile(path):
-            mtime_update = os.path.getmtime(path)
+        mtime_list = self.__get_file_time(
+            site, self.__get_package_list_path(site)) or 0
+        mtime_update = self.__get_file_time(
+            site, self.__get_updated_package_list_path(site)) or 0
 
         return {
             "list": mtime_list,
@@ -290,21 +527,122 @@ class CkanCache:
                     site_id))
                 return cached
 
-        content = site.get_package_list()
+        # Send a conditional request if the list is in the cache.
+        path = self.__get_package_list_path(site)
+        validators_path = self.__get_package_list_validators_path(site)
+        validators = {}
+        if os.path.isfile(path):
+            validators = self.__read_validators(validators_path)
+
+        content = site.get_package_list(validators)
+        if content is NOT_MODIFIED:
+            cached = self.__get_cached_package_list(site, expire_timestamp=0)
+            if cached is not False:
+                logger.debug("[{}] package_list is not modified.".format(
+                    site_id))
+                os.utime(path)
+                self.__record_file_time(site, path)
+                return cached
+
+            content = site.get_package_list(validators={})
+
         if content is False or content['success'] is False:
             logger.error("[{}] Can't get the latest package_list.".format(
                 site_id))
             return False
 
-        time.sleep(1.0)
-
         self.__update_cached_package_list(site, content)
+        self.__write_validators(validators_path, validators)
         logger.debug(
             "[{}] Update cached package_list.".format(site_id))
 
         return content
 
-    def get_package_metadata(self, site, package_id, ignore_expiration=False):
+    def get_package_ids(self, site):
+        """
+        Get the set of package ids from the CKAN site.
+
+        Unlike `get_package_list`, the response is parsed and
+        written to the cache incrementally, so that the whole
+        response is not kept in memory.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target CKAN site.
+
+        Returns
+        -------
+        set or False
+            The set of package ids.
+            If the site returns an error, False will be returned.
+        """
+        site_id = site.get_site_id()
+
+        # Send a conditional request if the list is in the cache.
+        path = self.__get_package_list_path(site)
+        validators_path = self.__get_package_list_validators_path(site)
+        validators = {}
+        if os.path.isfile(path):
+            validators = self.__read_validators(validators_path)
+
+        ids = site.iter_package_list(validators)
+        if ids is NOT_MODIFIED:
+            try:
+                with open_cache_file(path) as f:
+                    package_ids = set(JsonArrayStream(f, ('result',)))
+            except (OSError, ValueError) + decompress_errors as e:
+                logger.warning(
+                    "[{}] Can't read cached package_list, {}".format(
+                        site_id, e))
+                validators = {}
+                ids = site.iter_package_list(validators)
+            else:
+                logger.debug("[{}] package_list is not modified.".format(
+                    site_id))
+                os.utime(path)
+                self.__record_file_time(site, path)
+                return package_ids
+
+        if ids is False:
+            logger.error("[{}] Can't get the latest package_list.".format(
+                site_id))
+            return False
+
+        os.makedirs(os.path.dirname(path), 0o755, True)
+        tmp_path = path + '.tmp'
+        package_ids = set()
+        try:
+            with open_cache_file_for_write(tmp_path) as f:
+                f.write('{"success":true,"result":[')
+                for package_id in ids:
+                    if package_id in package_ids:
+                        continue
+
+                    if package_ids:
+                        f.write(',')
+
+                    f.write(json.dumps(package_id, ensure_ascii=False))
+                    package_ids.add(package_id)
+
+                f.write(']}')
+        except (HttpError, ValueError) as e:
+            logger.error(
+                "[{}] Can't get the latest package_list, {}".format(
+                    site_id, e))
+            os.remove(tmp_path)
+            return False
+
+        os.replace(tmp_path, path)
+        self.__record_file_time(site, path)
+        self.__write_validators(validators_path, validators)
+        logger.debug(
+            "[{}] Update cached package_list.".format(site_id))
+
+        return package_ids
+
+    def get_package_metadata(self, site, package_id, ignore_expiration=False,
+                             result=None):
         """
         Get package metadata with id = package_id from the site.
         If the cached file is fresh enough, return the cached content.
@@ -318,12 +656,16 @@ class CkanCache:
             The id of the metadata.
         ignore_expiration: bool, optional
             If set to True, do not check expiration.
+        result: dict, optional
+            If set, 'not_found' is stored as True when the site
+            answered that the package is not available.
 
         Returns
         -------
         dict
             A dict object decoded from the JSON returned by
             the package_show API.
+            False if the metadata is not available.
         """
         site_id = site.get_site_id()
         if ignore_expiration:
@@ -337,19 +679,135 @@ class CkanCache:
                 site_id, package_id))
             return cached
 
-        content = site.get_package_metadata(package_id)
+        # The cached file is missing or expired.
+        # If expired, send a conditional request with the validators
+        # recorded at the last download.
+        stale = self.__get_cached_package_metadata(
+            site, package_id, expire_timestamp=0)
+        validators = {}
+        if stale is not False:
+            validators = self.__read_package_validators(site, package_id)
+
+        old_hash = validators.get('sha256')
+        content = site.get_package_metadata(package_id, validators)
+        if content is NOT_MODIFIED:
+            if stale is not False:
+                return self.__refresh_cached_package_metadata(
+                    site, package_id, stale)
+
+            content = site.get_package_metadata(package_id)
+
         if content is False or content['success'] is False:
             logger.error("[{}] Can't get the latest metadata of {}".format(
                 site_id, package_id))
+            if content is not False and result is not None:
+                result['not_found'] = True
+
             return False
 
-        time.sleep(1.0)
+        self.__set_package_hash(validators, content)
+        if stale is not False and old_hash is not None and \
+                validators['sha256'] == old_hash:
+            # The server does not support conditional requests,
+            # but the content is identical.
+            self.__write_package_validators(site, package_id, validators)
+            return self.__refresh_cached_package_metadata(
+                site, package_id, stale)
 
         logger.debug("Updating metadata in 'get_package_metadata'")
         self.__update_cached_package_metadata(site, package_id, content)
+        self.__write_package_validators(site, package_id, validators)
+
+        return content
+
+    @staticmethod
+    def __set_package_hash(validators, content):
+        """
+        Record the hash of the package metadata in the validators
+        as 'sha256', instead of the hash of the response body,
+        so that the same metadata has the same hash whether it was
+        fetched by 'package_show' or in a page of 'package_search'.
+        """
+        validators['sha256'] = get_content_hash(
+            content.get('result', content))
+
+    def __refresh_cached_package_metadata(self, site, package_id, content):
+        """
+        Mark the cached package_metadata as fresh without rewriting it.
+        The content is not registered to Solr again.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+        package_id: str
+            The target id.
+        content: dict
+            The cached content.
+
+        Returns
+        -------
+        dict
+            The content.
+        """
+        logger.debug("[{}] Metadata of {} is not modified.".format(
+            site.get_site_id(), package_id))
+        now = time.time()
+        store = self.get_metadata_store(site)
+        if store is not None:
+            store.touch(package_id, now)
+        else:
+            os.utime(self.__get_package_metadata_path(site, package_id))
+            self.__memoize_package_metadata(site, package_id, now, content)
+
+        self.get_manifest(site).touch_package(package_id, now)
+
+        # Archive the package cached before the archive was enabled.
+        archive = self.get_metadata_archive(site)
+        if archive is not None and package_id not in archive:
+            archive.append(package_id, content, now)
 
         return content
 
+    def __read_validators(self, path):
+        """
+        Read HTTP validators (ETag, Last-Modified and content hash)
+        recorded at the last download.
+
+        Parameters
+        ----------
+        path: str
+            The path to the validators file.
+
+        Returns
+        -------
+        dict
+            The validators. Empty if not recorded.
+        """
+        if not os.path.isfile(path):
+            return {}
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except JSONDecodeError:
+            return {}
+
+    def __write_validators(self, path, validators):
+        """
+        Record HTTP validators next to the cached file.
+
+        Parameters
+        ----------
+        path: str
+            The path to the validators file.
+        validators: dict
+            The validators.
+        """
+        os.makedirs(os.path.dirname(path), 0o755, True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(validators, f, ensure_ascii=False)
+
     def __get_cache_base(self):
         """
         Get the cache base directory.
@@ -379,16 +837,69 @@ class CkanCache:
         return os.path.join(
             self.__get_cache_base(), site_id + '/')
 
-    def __get_jsonl_path(self, n=None):
+    def get_metadata_archive(self, site, create=False):
+        """
+        Get the MetadataArchive of the site, which keeps every fetched
+        version of the package metadata in JSONL segment files
+        under the 'archive' directory of the site.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+        create: bool, optional
+            If True, return the archive even if METADATA_ARCHIVE
+            in siteconf.py is not set.
+
+        Returns
+        -------
+        xckan.model.archive.MetadataArchive or None
+            The archive, or None if archiving is not enabled.
+        """
+        if not (site_config.METADATA_ARCHIVE or create):
+            return None
+
+        site_id = site.get_site_id()
+        with self.metadata_stores_lock:
+            if site_id not in self.metadata_archives:
+                self.metadata_archives[site_id] = MetadataArchive(
+                    os.path.join(self.__get_site_cache_base(site), 'archive'))
+
+            return self.metadata_archives[site_id]
+
+    def each_archived_metadata(self, site, latest_only=True):
+        """
+        Read the archived package metadata of the site sequentially.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+        latest_only: bool, optional
+            If True (default), only the latest versions of the packages
+            not deleted are returned. Otherwise, all versions.
+
+        Returns
+        -------
+        dict
+            'id', 'fetched_at' and 'content' of each version,
+            where 'content' is a dict object decoded from the JSON
+            returned by the package_show API.
+        """
+        archive = self.get_metadata_archive(site, create=True)
+        yield from archive.each(latest_only)
+
+    def __is_archive_complete(self, site):
         """
-        Get the path to the JSONL file.
+        Check if the metadata archive of the site is enabled
+        and has all the packages recorded in the manifest.
         """
-        if n is None:
-            n = self.nmetadata
+        archive = self.get_metadata_archive(site)
+        if archive is None or len(archive) == 0:
+            return False
 
-        i = int(self.n / 1000)
-        filename = "metadata_{:0>3}.jsonl".format(i)
-        return self.__get_cache_base() + 'jsonl/' + filename
+        return all(package_id in archive for package_id
+                   in self.get_manifest(site).get_fetched_times())
 
     def get_id_list_from_solr(self, site):
         """
@@ -420,6 +931,36 @@ class CkanCache:
 
         return stored_id_list
 
+    def get_content_hashes_from_solr(self, site):
+        """
+        Get the content hashes of the metadata of the specified site
+        indexed in the Solr server.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+
+        Returns
+        -------
+        dict
+            A dict object whose keys are package_id without site_id
+            and whose values are the hashes stored in
+            'xckan_content_hash' field.
+        """
+        site_id = site.get_site_id()
+        stored = self.solr_manager.search(
+            q="*:*", fl="id,xckan_content_hash", start=0, rows=999999,
+            fq="id:{}*".format(site_id.replace(':', r'\:')))
+
+        hashes = {}
+        for solr_meta in stored or []:
+            if 'xckan_content_hash' in solr_meta:
+                hashes[solr_meta['id'][len(site_id) + 1:]] = \
+                    solr_meta['xckan_content_hash']
+
+        return hashes
+
     def delete_site(self, site):
         """
         Remove all cached files of the site.
@@ -433,6 +974,17 @@ class CkanCache:
         self.remove_package_list(site)
         self.remove_updated_package_list(site)
 
+        stats = {"orphans": 0, "orphan_bytes": 0, "removed_blobs": 0}
+        manifest = self.get_manifest(site)
+        for entry in manifest.get_package_resources(
+                sorted(manifest.get_resource_package_ids())):
+            stats['orphans'] += 1
+            stats['orphan_bytes'] += self.__remove_resource_file(
+                site.get_site_id(), entry, stats)
+
+        logger.info("Removed {} resource files ({} bytes).".format(
+            stats['orphans'], stats['orphan_bytes']))
+
         path = self.__get_site_cache_base(site)
         logger.info("Delete directory {} if you don't need it.".format(
             path))
@@ -457,6 +1009,23 @@ class CkanCache:
         return os.path.join(
             self.__get_site_cache_base(site), 'package_list.json')
 
+    def __get_package_list_validators_path(self, site):
+        """
+        Get full path to the validators file of the package_list.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+
+        Returns
+        -------
+        str
+            The path to the `package_list_validators.json` file.
+        """
+        return os.path.join(
+            self.__get_site_cache_base(site), 'package_list_validators.json')
+
     def remove_package_list(self, site):
         """
         Remove cached package_list file.
@@ -466,9 +1035,13 @@ class CkanCache:
         site: xckan.site.Site
             The target site.
         """
-        path = self.__get_package_list_path(site)
-        if os.path.isfile(path):
-            os.remove(path)
+        for path in (self.__get_package_list_path(site),
+                     self.__get_package_list_validators_path(site)):
+            if os.path.isfile(path):
+                os.remove(path)
+
+        self.get_manifest(site).delete_file(
+            os.path.basename(self.__get_package_list_path(site)))
 
     def __get_updated_package_list_path(self, site):
         """
@@ -501,51 +1074,79 @@ class CkanCache:
         if os.path.isfile(path):
             os.remove(path)
 
+        self.get_manifest(site).delete_file(os.path.basename(path))
+
     def __update_by_updated_package_list(self, site, updated):
         """
-        Update cached data by the result of `get_updated_package_list`.
+        Update cached data by the result of `iter_updated_packages`.
+
+        Each package is saved as soon as it is parsed, and
+        the full result is written to the log file at the same time.
 
         Parameters
         ----------
         site: xckan.site.Site
             The target site.
-        updated: dict
-            A dict object decoded from the JSON returned by
-            the package_search API.
+        updated: iterable
+            The metadata of updated packages.
 
         Returns
         -------
-        list
+        list or False
             A list of updated metadata IDs.
+            Returns False if the result could not be read to the end.
         """
+        site_id = site.get_site_id()
+        help_url = site.get_api() + 'help_show?name=package_search'
 
         # Save full result to the log file as JSON
         path = self.__get_updated_package_list_path(site)
+        tmp_path = path + '.tmp'
 
         os.makedirs(os.path.dirname(path), 0o755, True)
-        with open(path, 'w', encoding='utf-8') as f:
-            logger.debug("[{}] Update updated_package_list.".format(
-                site.get_site_id()))
-            json.dump(updated, f, indent=2, ensure_ascii=False)
-
-        # Save each package_metadata
         updated_id_list = []
-        for result in updated['result']['results']:
-            metadata = {
-                "help": updated['help'],
-                "success": updated['success'],
-                "result": result
-            }
-            m = Metadata.get_instance(result)
-            package_id = m.get_id()
-            updated_id_list.append(package_id)
-            logger.debug(
-                "Updating metadata in '__update_by_updated_package_list'")
-            self.__update_cached_package_metadata(site, package_id, metadata)
+        try:
+            with open_cache_file_for_write(tmp_path) as f:
+                logger.debug("[{}] Update updated_package_list.".format(
+                    site_id))
+                f.write('{{"help":{},"success":true,'
+                        '"result":{{"results":['.format(
+                            json.dumps(help_url)))
+
+                # Save each package_metadata
+                for result in updated:
+                    if updated_id_list:
+                        f.write(',')
+
+                    f.write(json.dumps(
+                        result, ensure_ascii=False, separators=(',', ':')))
+
+                    metadata = {
+                        "help": help_url,
+                        "success": True,
+                        "result": result
+                    }
+                    m = Metadata.get_instance(result, site)
+                    package_id = m.get_id()
+                    updated_id_list.append(package_id)
+                    logger.debug(
+                        "Updating metadata in "
+                        "'__update_by_updated_package_list'")
+                    self.__update_cached_package_metadata(
+                        site, package_id, metadata)
+
+                f.write('],"count":{}}}}}'.format(len(updated_id_list)))
+        except (HttpError, ValueError) as e:
+            logger.error(
+                "[{}] Can't read updated packages, {}".format(site_id, e))
+            os.remove(tmp_path)
+            return False
 
+        os.replace(tmp_path, path)
+        self.__record_file_time(site, path)
         return updated_id_list
 
-    def __get_cached_package_list(self, site):
+    def __get_cached_package_list(self, site, expire_timestamp=None):
         """
         Get cached package_list content.
         The expiration period of the cached file is determined by
@@ -555,6 +1156,9 @@ class CkanCache:
         ----------
         site: xckan.site.Site
             The target CKAN site.
+        expire_timestamp: int or None
+            If set, the cached file will be expired if its timestamp is
+            less than this value.
 
         Returns
         -------
@@ -562,19 +1166,23 @@ class CkanCache:
             A dict object decoded from the JSON returned by the package_list API.
             Returns False if the cache does not exist or is too old.
         """
-        expiration_seconds = self.list_expiration_days * 86400
-
+        if expire_timestamp is None:
+            expire_timestamp = time.time() - \
+                self.list_expiration_days * 86400
+
         path = self.__get_package_list_path(site)
-        if not os.path.isfile(path):
+        mtime = self.__get_file_time(site, path)
+        if mtime is None:
             return False   # Not in the cache
 
-        if os.path.getmtime(path) < time.time() - expiration_seconds:
+        if mtime < expire_timestamp:
             return False   # Too old
 
-        with open(path, 'r', encoding='utf-8') as f:
-            content = json.load(f)
-
-        return content
+        try:
+            return load_json(path)
+        except FileNotFoundError:
+            self.get_manifest(site).delete_file(os.path.basename(path))
+            return False
 
     def __update_cached_package_list(self, site, content):
         """
@@ -591,11 +1199,11 @@ class CkanCache:
         path = self.__get_package_list_path(site)
 
         os.makedirs(os.path.dirname(path), 0o755, True)
-        with open(path, 'w', encoding='utf-8') as f:
-            logger.debug(
-                "[{}] Update cached package list.".format(
-                    site.get_site_id()))
-            json.dump(content, f, indent=2, ensure_ascii=False)
+        logger.debug(
+            "[{}] Update cached package list.".format(
+                site.get_site_id()))
+        dump_json(content, path)
+        self.__record_file_time(site, path)
 
         return True
 
@@ -638,6 +1246,169 @@ class CkanCache:
         return os.path.join(
             self.__get_package_path(site, package_id), 'catalog.json')
 
+    def __get_package_validators_path(self, site, package_id):
+        """
+        Get full path to the validators file of the package_metadata.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+        package_id: str
+            The target id.
+
+        Returns
+        -------
+        str
+            The path to the `validators.json` file.
+        """
+        return os.path.join(
+            self.__get_package_path(site, package_id), 'validators.json')
+
+    def get_metadata_store(self, site):
+        """
+        Get the MetadataStore of the site.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+
+        Returns
+        -------
+        xckan.model.metastore.MetadataStore or None
+            The store, or None if CACHE_BACKEND in siteconf.py is not
+            'sqlite' and the metadata is stored in 'catalog.json' files.
+        """
+        if site_config.CACHE_BACKEND != 'sqlite':
+            return None
+
+        site_id = site.get_site_id()
+        with self.metadata_stores_lock:
+            if site_id not in self.metadata_stores:
+                path = self.__get_site_cache_base(site)
+                os.makedirs(path, 0o755, True)
+                self.metadata_stores[site_id] = MetadataStore(
+                    os.path.join(path, self.metadata_store_filename))
+
+            return self.metadata_stores[site_id]
+
+    def get_manifest(self, site):
+        """
+        Get the SiteManifest of the site, which records the cached files.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+
+        Returns
+        -------
+        xckan.model.manifest.SiteManifest
+        """
+        return self.__get_manifest_by_site_id(site.get_site_id())
+
+    def __get_manifest_by_site_id(self, site_id):
+        with self.metadata_stores_lock:
+            if site_id not in self.manifests:
+                path = os.path.join(self.__get_cache_base(), site_id)
+                os.makedirs(path, 0o755, True)
+                self.manifests[site_id] = SiteManifest(
+                    os.path.join(path, self.manifest_filename))
+
+            return self.manifests[site_id]
+
+    def get_cache_stats(self, site):
+        """
+        Get the statistics of the cache of the site from the manifest.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+
+        Returns
+        -------
+        dict
+            See `SiteManifest.get_stats`.
+        """
+        return self.get_manifest(site).get_stats()
+
+    def __get_file_time(self, site, path):
+        """
+        Get the updated time of the cached file of the site.
+        If it is not recorded in the manifest,
+        the modified time of the file is used.
+
+        Returns
+        -------
+        float or None
+            The updated time, or None if the file is not cached.
+        """
+        mtime = self.get_manifest(site).get_file_time(os.path.basename(path))
+        if mtime is None and os.path.isfile(path):
+            mtime = os.path.getmtime(path)
+
+        return mtime
+
+    def __record_file_time(self, site, path, mtime=None):
+        """
+        Record the updated time of the cached file to the manifest.
+        """
+        self.get_manifest(site).set_file_time(
+            os.path.basename(path), mtime or time.time())
+
+    def __read_package_validators(self, site, package_id):
+        """
+        Read HTTP validators of the package_metadata.
+        """
+        store = self.get_metadata_store(site)
+        if store is not None:
+            return store.get_validators(package_id)
+
+        return self.__read_validators(
+            self.__get_package_validators_path(site, package_id))
+
+    def __write_package_validators(self, site, package_id, validators):
+        """
+        Record HTTP validators of the package_metadata.
+        """
+        store = self.get_metadata_store(site)
+        if store is not None:
+            store.set_validators(package_id, validators)
+            return
+
+        self.__write_validators(
+            self.__get_package_validators_path(site, package_id),
+            validators)
+
+    def __has_cached_package_metadata(self, site, package_id):
+        """
+        Check whether the package_metadata is in the cache.
+        """
+        store = self.get_metadata_store(site)
+        if store is not None:
+            return store.has(package_id)
+
+        return os.path.isfile(
+            self.__get_package_metadata_path(site, package_id))
+
+    def __remove_cached_package_metadata(self, site, package_id):
+        """
+        Remove the cached package_metadata not to use it.
+        """
+        self.get_manifest(site).delete_packages(
+            [package_id], with_resources=False)
+        self.__forget_package_metadata(site, package_id)
+        store = self.get_metadata_store(site)
+        if store is not None:
+            store.delete([package_id])
+            return
+
+        package_path = self.__get_package_metadata_path(site, package_id)
+        if os.path.exists(package_path):
+            os.remove(package_path)
+
     def __get_cached_package_metadata(
             self, site, package_id, expire_timestamp=None):
         """
@@ -665,30 +1436,128 @@ class CkanCache:
             expire_timestamp = time.time() - \
                 self.metadata_expiration_days * 86400
 
-        path = self.__get_package_metadata_path(site, package_id)
+        store = self.get_metadata_store(site)
+        if store is not None:
+            cached = store.get(package_id)
+            if cached is None or cached[1] < expire_timestamp:
+                return False
 
-        if not os.path.isfile(path):
+            return cached[0]
+
+        path = self.__get_package_metadata_path(site, package_id)
+        manifest = self.get_manifest(site)
+        entry = manifest.get_package(package_id)
+        if entry is not None:
+            fetched_at = entry['fetched_at']
+        elif os.path.isfile(path):
+            # Cached before the manifest was introduced.
+            fetched_at = os.path.getmtime(path)
+            manifest.set_package(
+                package_id, fetched_at, size=os.path.getsize(path))
+        else:
             return False   # Not in the cache
 
-        if os.path.getmtime(path) < expire_timestamp:
+        if fetched_at < expire_timestamp:
             return False   # Too old
 
+        content = self.__get_memoized_package_metadata(
+            site, package_id, fetched_at)
+        if content is not None:
+            return content
+
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                content = json.load(f)
-        except JSONDecodeError:
+            content = load_json(path)
+        except FileNotFoundError:
+            manifest.delete_packages([package_id], with_resources=False)
+            return False
+        except ValueError:
             logger.debug(
                 "[{}] The cached file is invalid json format. (path: {})"
                 .format(site.get_site_id(), path))
             return False
 
+        self.__memoize_package_metadata(site, package_id, fetched_at, content)
         return content
 
+    def __get_memoized_package_metadata(self, site, package_id, fetched_at):
+        """
+        Get the parsed package_metadata kept in memory.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+        package_id: str
+            The id of the metadata.
+        fetched_at: float
+            The time the cached file was written.
+            The kept content is not used if it was read at another time.
+
+        Returns
+        -------
+        dict or None
+            The content, or None if not kept.
+        """
+        key = (site.get_site_id(), package_id)
+        with self.metadata_cache_lock:
+            entry = self.metadata_cache.get(key)
+            if entry is None or entry[0] != fetched_at:
+                self.metadata_cache_stats['misses'] += 1
+                return None
+
+            self.metadata_cache.move_to_end(key)
+            self.metadata_cache_stats['hits'] += 1
+            return entry[1]
+
+    def __memoize_package_metadata(
+            self, site, package_id, fetched_at, content):
+        """
+        Keep the parsed package_metadata in memory, discarding
+        the least recently used ones over METADATA_CACHE_SIZE.
+        The content is shared by the callers, so do not modify it.
+        """
+        if site_config.METADATA_CACHE_SIZE <= 0:
+            return
+
+        key = (site.get_site_id(), package_id)
+        with self.metadata_cache_lock:
+            self.metadata_cache[key] = (fetched_at, content)
+            self.metadata_cache.move_to_end(key)
+            while len(self.metadata_cache) > site_config.METADATA_CACHE_SIZE:
+                self.metadata_cache.popitem(last=False)
+
+    def __forget_package_metadata(self, site, package_id):
+        with self.metadata_cache_lock:
+            self.metadata_cache.pop((site.get_site_id(), package_id), None)
+
+    def get_metadata_cache_stats(self):
+        """
+        Get the statistics of the parsed package_metadata kept in memory.
+
+        Returns
+        -------
+        dict
+            - hits: Number of reads without parsing the cached files
+            - misses: Number of reads parsing the cached files
+            - size: Number of the kept metadata
+        """
+        with self.metadata_cache_lock:
+            return dict(self.metadata_cache_stats,
+                        size=len(self.metadata_cache))
+
     def __update_cached_package_metadata(self, site, package_id, content):
         """
         Update cached package_metadata with new content.
         This method also registers the content in Solr.
 
+        The hash of the package metadata is recorded in the manifest,
+        and the cache is not rewritten if the hash is not changed.
+        The hash combined with the converter version and the settings
+        of the site (see `Metadata.get_index_hash`) is recorded in the
+        'xckan_content_hash' field of the Solr document, and the
+        document is not registered again while updating the site
+        if the same hash is already indexed.
+
         Parameters
         ----------
         site: xckan.site.Site
@@ -705,26 +1574,66 @@ class CkanCache:
             If the content is valid metadata, return True,
             otherwise False.
         """
-        path = self.__get_package_metadata_path(site, package_id)
-
-        os.makedirs(os.path.dirname(path), 0o755, True)
-        with open(path, 'w', encoding='utf-8') as f:
+        site_id = site.get_site_id()
+        content_hash = get_content_hash(content.get('result', content))
+        manifest = self.get_manifest(site)
+        entry = manifest.get_package(package_id)
+        if entry is not None and entry['hash'] == content_hash and \
+                self.__has_cached_package_metadata(site, package_id):
+            self.__refresh_cached_package_metadata(
+                site, package_id, content)
+        else:
             logger.debug(
                 "[{}] Update cached package metadata of {}".format(
-                    site.get_site_id(), package_id))
-            json.dump(content, f, indent=2, ensure_ascii=False)
+                    site_id, package_id))
+            self.__forget_package_metadata(site, package_id)
+            archive = self.get_metadata_archive(site)
+            if archive is not None:
+                archive.append(package_id, content)
+
+            now = time.time()
+            store = self.get_metadata_store(site)
+            if store is not None:
+                store.put(package_id, content, now)
+                size = None
+            else:
+                path = self.__get_package_metadata_path(site, package_id)
+                os.makedirs(os.path.dirname(path), 0o755, True)
+                dump_json(content, path)
+                size = os.path.getsize(path)
+
+            modified = None
+            if isinstance(content.get('result'), dict):
+                modified = content['result'].get('metadata_modified')
+
+            manifest.set_package(
+                package_id, now, modified, content_hash, size)
 
         if 'result' not in content:
             return False
 
+        index_hash = Metadata.get_index_hash(content_hash, site)
+        indexed = self.indexed_hashes.get(site_id)
+        stats = self.index_stats.get(site_id, {})
+        if indexed is not None and indexed.get(package_id) == index_hash:
+            logger.debug("[{}] Metadata of {} is already indexed.".format(
+                site_id, package_id))
+            stats['skipped'] = stats.get('skipped', 0) + 1
+            return True
+
         ckan_metadata = content['result']
-        m = Metadata.get_instance(ckan_metadata)
+        m = Metadata.get_instance(ckan_metadata, site)
         solr_metadata = m.get_solr_metadata(site)
+        solr_metadata['xckan_content_hash'] = index_hash
         self.solr_manager.add_document(solr_metadata)
+        stats['changed'] = stats.get('changed', 0) + 1
+        if indexed is not None:
+            indexed[package_id] = index_hash
 
         return True
 
-    def add_new_metadata(self, site, add_idlist):
+    def add_new_metadata(self, site, add_idlist, mode='serial',
+                         checkpoint=None, breaker=None):
         """
         Retrieve the newly added metadata contained in the ID list,
         and add them to the cache and Solr.
@@ -735,26 +1644,218 @@ class CkanCache:
             The target site.
         add_idlist: list
             The list of package_ids.
-        """
-        for package_id in add_idlist:
-            package_path = self.__get_package_metadata_path(site, package_id)
-            if os.path.exists(package_path):
-                # Delete metadata file not to use cache.
-                os.remove(package_path)
+        mode: str (optional)
+            If 'async', fetch the metadata concurrently.
+            If 'bulk', fetch them in large batches, and the packages
+            which cannot be fetched in that way one by one.
+            Otherwise, fetch them one by one. (default: 'serial')
+        checkpoint: xckan.model.checkpoint.HarvestCheckpoint (optional)
+            If set, record the progress to it.
+        breaker: xckan.model.circuit.CircuitBreaker (optional)
+            If set, record the results of the requests to it.
+            CircuitOpenError is raised when it is opened.
+        """
+        def done(package_id):
+            if checkpoint is not None:
+                checkpoint.mark_done(package_id)
+
+            if breaker is not None:
+                breaker.record_success()
+
+        def fail(package_id, reason):
+            if checkpoint is not None:
+                checkpoint.mark_failed(package_id, reason)
+
+            if breaker is not None:
+                breaker.record_failure("{} ('{}')".format(reason, package_id))
+
+        def missing(package_id):
+            # The package may have been deleted after 'package_list',
+            # which is not a failure of the site.
+            if checkpoint is not None:
+                checkpoint.mark_failed(package_id, "Not found")
+
+        if mode == 'async':
+            return self.__add_new_metadata_async(
+                site, add_idlist, done, fail, missing)
+
+        if mode == 'bulk':
+            add_idlist = self.__add_new_metadata_bulk(
+                site, add_idlist, done)
 
-            content = self.get_package_metadata(site, package_id)
+        for package_id in add_idlist:
+            # Delete metadata file not to use cache.
+            self.__remove_cached_package_metadata(site, package_id)
+            result = {}
+            content = self.get_package_metadata(
+                site, package_id, result=result)
             if not isinstance(content, dict):
                 logger.error(
                     "[{}] Can't get metadata of '{}' (Skipped)".format(
                         site.get_site_id(), package_id))
+                if result.get('not_found'):
+                    missing(package_id)
+                else:
+                    fail(package_id, "Can't get metadata")
+
                 continue
 
+            # The content has been cached and registered to Solr
+            # by `get_package_metadata`.
+            done(package_id)
+
+    def __add_new_metadata_async(self, site, add_idlist, done, fail,
+                                 missing):
+        """
+        Retrieve the newly added metadata concurrently
+        using `AsyncHarvester`.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+        add_idlist: list
+            The list of package_ids.
+        done: callable
+            done(package_id) is called when the package is stored.
+        fail: callable
+            fail(package_id, reason) is called when the package
+            could not be fetched.
+        missing: callable
+            missing(package_id) is called instead of `fail`
+            when the site answered that the package is not available.
+        """
+        # The validators of the fetched packages until stored.
+        validators_by_id = {}
+        not_found = set()
+
+        def fetch(package_id):
+            # Delete metadata file not to use cache.
+            self.__remove_cached_package_metadata(site, package_id)
+            validators = {}
+            content = site.get_package_metadata(package_id, validators)
+            validators_by_id[package_id] = validators
+            if isinstance(content, dict) and content.get('success') is False:
+                not_found.add(package_id)
+
+            return content
+
+        def store(package_id, content):
             logger.debug("Updating metadata in 'add_new_metadata'")
+            validators = validators_by_id.pop(package_id)
+            self.__set_package_hash(validators, content)
             self.__update_cached_package_metadata(site, package_id, content)
+            self.__write_package_validators(site, package_id, validators)
+            done(package_id)
+
+        def failed(package_id, reason):
+            validators_by_id.pop(package_id, None)
+            if package_id in not_found:
+                missing(package_id)
+            else:
+                fail(package_id, reason)
+
+        harvester = AsyncHarvester(fetch, store, fail=failed)
+        stats = harvester.run(site, add_idlist)
+        logger.info("[{}] Fetched {} packages, {} failed.".format(
+            site.get_site_id(), stats['success'], stats['fail']))
+
+    def __add_new_metadata_bulk(self, site, add_idlist, done):
+        """
+        Retrieve the newly added metadata in large batches
+        using the 'package_search' API.
+
+        Bulk fetching is given up if the site is accessed via proxy,
+        if the metadata returned by 'package_search' is not complete
+        (see `Metadata.support_bulk`), or if fetching the rest of
+        the pages requires more requests than fetching the remaining
+        packages one by one.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+        add_idlist: list
+            The list of package_ids.
+        done: callable
+            done(package_id) is called when the package is stored.
+
+        Returns
+        -------
+        list
+            The list of package_ids which were not retrieved.
+        """
+        site_id = site.get_site_id()
+        if site.get_proxy() is not None:
+            logger.debug("[{}] Bulk harvest is not available via proxy."
+                         .format(site_id))
+            return add_idlist
+
+        remaining = set(add_idlist)
+        start = 0
+        count = None
+        while len(remaining) > 0 and (count is None or start < count):
+            if count is not None and \
+                    math.ceil((count - start) / self.bulk_rows) \
+                    >= len(remaining):
+                logger.debug(
+                    "[{}] Fetching the rest {} packages one by one.".format(
+                        site_id, len(remaining)))
+                break
+
+            page = site.search_packages(start, self.bulk_rows)
+            if page is False:
+                break
+
+            results = page['result']['results']
+            count = page['result']['count']
+            if len(results) == 0:
+                break
+
+            m = Metadata.get_instance(results[0], site)
+            if m is False or not m.support_bulk():
+                logger.debug(
+                    "[{}] Bulk harvest is not supported by the site."
+                    .format(site_id))
+                break
+
+            for result in results:
+                m = Metadata.get_instance(result, site)
+                if m is False:
+                    continue
+
+                package_id = m.get_id()
+                if package_id not in remaining:
+                    continue
+
+                metadata = {
+                    "help": page.get('help'),
+                    "success": page['success'],
+                    "result": result
+                }
+                logger.debug("Updating metadata in 'add_new_metadata'")
+                self.__update_cached_package_metadata(
+                    site, package_id, metadata)
+                # No ETag or Last-Modified for each package in the page,
+                # but the hash tells the next fetch whether it changed.
+                validators = {}
+                self.__set_package_hash(validators, metadata)
+                self.__write_package_validators(
+                    site, package_id, validators)
+                remaining.discard(package_id)
+                done(package_id)
+
+            start += len(results)
+
+        logger.info("[{}] Fetched {} packages in bulk.".format(
+            site_id, len(add_idlist) - len(remaining)))
+
+        return [id for id in add_idlist if id in remaining]
 
     def delete_obsoleted_metadata(self, site, del_idlist):
         """
         Delete obsoleted metadata from both cache and Solr.
+        The resource files of the packages are also removed.
 
         Parameters
         ----------
@@ -768,10 +1869,34 @@ class CkanCache:
         for package_id in del_idlist:
             xckan_id_list.append(id_list[package_id])
             del id_list[package_id]
+            self.__forget_package_metadata(site, package_id)
             path = self.__get_package_path(site, package_id)
             if os.path.isdir(path):
                 shutil.rmtree(path)
 
+        store = self.get_metadata_store(site)
+        if store is not None:
+            store.delete(del_idlist)
+
+        archive = self.get_metadata_archive(site)
+        if archive is not None:
+            archive.delete(del_idlist)
+
+        # Remove the stored files no longer linked from any resource
+        # before their records are deleted with the packages.
+        stats = {"orphans": 0, "orphan_bytes": 0, "removed_blobs": 0}
+        manifest = self.get_manifest(site)
+        for entry in manifest.get_package_resources(del_idlist):
+            stats['orphans'] += 1
+            stats['orphan_bytes'] += self.__remove_resource_file(
+                site.get_site_id(), entry, stats)
+
+        if stats['orphans'] > 0:
+            logger.debug("[{}] Removed {} resource files ({} bytes).".format(
+                site.get_site_id(), stats['orphans'], stats['orphan_bytes']))
+
+        manifest.delete_packages(del_idlist)
+
         self.solr_manager.delete_document(xckan_id_list)
 
     def reindex_site(self, site):
@@ -780,7 +1905,8 @@ class CkanCache:
 
         To prevent the cache file from being modified
         during index rebuilding, lock access to the site
-        using a lock file.
+        using a lock file, which is released automatically
+        if the process exits.
 
         The actual reindex process is implemented by the
         `__reindes_site` method.
@@ -797,15 +1923,16 @@ class CkanCache:
             and whose values are xckan_id with site_id.
         """
         site_id = site.get_site_id()
-        try:
-            logger.debug("[{}] Locking for reindexing".format(
+        logger.debug("[{}] Locking for reindexing".format(
+            site_id))
+        if self.__lock_site(site) is False:
+            # Do not unlock the site locked by another.
+            logger.warning("[{}] Cannot lock the site, skipped".format(
                 site_id))
-            if self.__lock_site(site) is False:
-                logger.warning("[{}] Cannot lock the site, skipped".format(
-                    site_id))
-                id_list = False
-            else:
-                id_list = self.__reindex_site(site)
+            return False
+
+        try:
+            id_list = self.__reindex_site(site)
         finally:
             self.__unlock_site(site)
             logger.debug("[{}] Unlocked".format(site_id))
@@ -816,24 +1943,40 @@ class CkanCache:
         """
         Performing the actual re-index processes of the site.
 
+        If the metadata archive is enabled and has all the cached
+        packages, the metadata is read sequentially from the archive
+        instead of the cache file of each package.
+
         Parameters
         ----------
         site: xckan.site.Site
             The target site.
         """
         self.solr_manager.delete_site(site)
+        self.__load_metadata_class(site)
         id_list = {}
 
-        cache_iterator = self.each_metadata(site, '2000-01-01T00:00:00')
+        if self.__is_archive_complete(site):
+            cache_iterator = (
+                version['content']['result']
+                for version in self.each_archived_metadata(site)
+                if 'result' in version['content'])
+        else:
+            cache_iterator = self.each_metadata(
+                site, '2000-01-01T00:00:00')
+
         for metadata in cache_iterator:
-            m = Metadata.get_instance(metadata)
+            m = Metadata.get_instance(metadata, site)
             solr_metadata = m.get_solr_metadata(site)
+            solr_metadata['xckan_content_hash'] = Metadata.get_index_hash(
+                get_content_hash(metadata), site)
             self.solr_manager.add_document(solr_metadata)
 
             id_list[solr_metadata['xckan_original_id']] = \
                 solr_metadata['id']
 
         self.solr_manager.flash_buffer()
+        self.__save_metadata_class(site)
 
         return id_list
 
@@ -847,12 +1990,9 @@ class CkanCache:
             The list of site_ids.
         """
         sites = []
-        pattern = self.__get_cache_base() + '*/id_list.json'
-        for id_list in glob.glob(pattern):
-            if not os.path.isfile(id_list):
-                continue
-
-            dirname = os.path.dirname(id_list)
+        pattern = self.__get_cache_base() + '*/' + self.manifest_filename
+        for manifest in glob.glob(pattern):
+            dirname = os.path.dirname(manifest)
             pos = dirname.rfind('/')
             if pos < 0:
                 continue
@@ -862,6 +2002,36 @@ class CkanCache:
 
         return sites
 
+    def get_site_dirs(self, keywords=()):
+        """
+        Get the cache directories of the sites,
+        including the ones created before the manifest was introduced.
+
+        Parameters
+        ----------
+        keywords: list of str, optional
+            If specified, only the sites whose ids contain
+            all the keywords are returned.
+
+        Returns
+        -------
+        list
+            The list of (site_id, path) sorted by site_id.
+        """
+        blob_dir = os.path.normpath(self.blob_store.base)
+        site_dirs = []
+        for entry in os.scandir(self.__get_cache_base()):
+            if not entry.is_dir() or os.path.normpath(entry.path) == blob_dir:
+                continue
+
+            if not all(keyword in entry.name for keyword in keywords):
+                logger.debug("Skip {}".format(entry.name))
+                continue
+
+            site_dirs.append((entry.name, entry.path))
+
+        return sorted(site_dirs)
+
     def each_metadata(self, site, since=None):
         """
         Get list of id in the site which was updated
@@ -890,17 +2060,59 @@ class CkanCache:
             expiration = time.time() - datetime.datetime.fromisoformat(
                 since).timestamp()
 
-        for package_id in self.get_id_list_from_solr(site):
-            metadata = self.__get_cached_package_metadata(
-                site, package_id, expiration)
-            if metadata is False or 'result' not in metadata:
+        id_list = self.get_id_list_from_solr(site)
+        for package_id, metadata in self.__each_cached_package_metadata(
+                site, id_list, expiration):
+            if 'result' not in metadata:
                 continue
 
             yield metadata['result']
 
+    def __each_cached_package_metadata(self, site, id_list, expire_timestamp):
+        """
+        Iterate over the cached package_metadata in the id_list.
+
+        With MetadataStore, the metadata is read in bulk
+        in the order of the package_id.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+        id_list: collection of str
+            The target package_ids.
+        expire_timestamp: float
+            Skip the metadata cached before this time.
+
+        Returns
+        -------
+        (str, dict)
+            The package_id and the cached content.
+        """
+        store = self.get_metadata_store(site)
+        if store is not None:
+            for package_id, metadata in store.each(expire_timestamp):
+                if package_id in id_list:
+                    yield package_id, metadata
+
+            return
+
+        # Skip the expired metadata without accessing the files.
+        fetched_times = self.get_manifest(site).get_fetched_times()
+        for package_id in id_list:
+            fetched_at = fetched_times.get(package_id)
+            if fetched_at is not None and fetched_at < expire_timestamp:
+                continue
+
+            metadata = self.__get_cached_package_metadata(
+                site, package_id, expire_timestamp)
+            if metadata is not False:
+                yield package_id, metadata
+
     def __lock_site(self, site):
         """
-        Lock site by creating a lock file.
+        Lock site by locking the lock file.
+        See `xckan.model.sitelock.SiteLock`.
 
         Parameters
         ----------
@@ -912,23 +2124,26 @@ class CkanCache:
         bool
             True if the lock succeeds, False if it fails.
         """
-        site_id = site.get_site_id()
-        lockfile = os.path.join(site_config.LOCKDIR, site_id + '.lock')
-        if os.path.exists(lockfile):
-            with open(lockfile, 'r') as f:
-                pid = f.read()
-                logger.debug("[{}] Locked by pid={}".format(site_id, pid))
+        return self.__lock_site_by_id(site.get_site_id())
 
+    def __lock_site_by_id(self, site_id):
+        lock = SiteLock(
+            os.path.join(site_config.LOCKDIR, site_id + '.lock'),
+            site_config.SITE_LOCK_EXPIRE)
+        if not lock.acquire():
+            holder = lock.get_holder() or {}
+            logger.debug("[{}] Locked by pid={} on {}".format(
+                site_id, holder.get('pid'), holder.get('hostname')))
             return False
 
-        with open(lockfile, 'w') as f:
-            print("{}".format(os.getpid()), file=f)
+        with self.metadata_stores_lock:
+            self.site_locks[site_id] = lock
 
         return True
 
     def __unlock_site(self, site):
         """
-        Unlock site by deleting the lock file.
+        Unlock site by releasing the lock file.
 
         Parameters
         ----------
@@ -940,10 +2155,13 @@ class CkanCache:
         bool
             True if the unlock succeeds, False if it fails.
         """
-        site_id = site.get_site_id()
-        lockfile = os.path.join(site_config.LOCKDIR, site_id + '.lock')
-        if os.path.exists(lockfile):
-            os.remove(lockfile)
+        return self.__unlock_site_by_id(site.get_site_id())
+
+    def __unlock_site_by_id(self, site_id):
+        with self.metadata_stores_lock:
+            lock = self.site_locks.pop(site_id, None)
+
+        if lock is not None and lock.release():
             return True
 
         logger.warning("[{}] Try to unlock but not locked".format(site_id))
@@ -955,6 +2173,10 @@ class CkanCache:
         Download resource files from the site and
         store in the cache directory.
 
+        The files are downloaded concurrently by RESOURCE_WORKERS
+        threads, limiting the concurrent downloads from each host
+        to RESOURCE_HOST_CONCURRENCY.
+
         Parameters
         ----------
         site: xckan.site.Site
@@ -982,6 +2204,27 @@ class CkanCache:
               Number of incorrect date/time expressions
             - fail
               Number of failed downloads
+            - not_modified
+              Number of resources not modified since the last download
+            - resumed
+              Number of downloads resumed from the partial files
+            - duplicated
+              Number of downloaded files already in the blob store
+            - probed
+              Number of HEAD requests sent to check the freshness
+            - downloaded_bytes
+              Number of bytes written to the resource files
+            - elapsed_seconds
+              Seconds taken to download the resources
+            - throughput
+              Downloaded bytes per second
+            - metadata_cache_hits, metadata_cache_misses
+              Number of package metadata read with and without
+              parsing the cached files
+            - compressed_bytes
+              Number of bytes received
+            - uncompressed_bytes
+              Number of bytes after decompression
 
         Note
         ----
@@ -992,21 +2235,98 @@ class CkanCache:
         else:
             formats = [x.lower() for x in formats]
 
+        site_id = site.get_site_id()
         stats = {
             "success": 0, "not_target": 0, "no_url": 0,
             "invalid_datetime": 0, "fail": 0,
+            "not_modified": 0, "resumed": 0, "duplicated": 0, "probed": 0,
+            "downloaded_bytes": 0,
         }
+        site.configure_rate_limit()
+        transfer = http_client.transfer_stats.get(site_id)
+        memoized = self.get_metadata_cache_stats()
+        started_at = time.monotonic()
+        lock = threading.Lock()
+        progress = {"done": 0, "logged_at": started_at}
+
+        def download(package_id, resource, probe):
+            url = resource.get('download_url', resource.get('url'))
+            result = {}
+            with get_host_semaphore(
+                    url, site_config.RESOURCE_HOST_CONCURRENCY, 'resource'):
+                if probe and self.probe_resource(
+                        site, package_id, resource, result):
+                    succeeded = None
+                else:
+                    succeeded = self.save_resource(
+                        site, package_id, resource, result)
 
-        for package_id in self.get_id_list_from_solr(site):
-            content = self.get_package_metadata(
-                site, package_id, ignore_expiration=True)
+            with lock:
+                progress['done'] += 1
+                if succeeded is None:
+                    stats['success'] += 1
+                    logger.debug("Resource {} is up to date (probed)".format(
+                        resource['id']))
+                elif succeeded:
+                    stats['success'] += 1
+                    msg = "Resource {} has been downloaded to {}"
+                    logger.debug(msg.format(
+                        resource['id'], self.get_resource_file_path(
+                            site, package_id, resource)))
+                else:
+                    stats['fail'] += 1
+                    package_path = self.__get_package_path(site, package_id)
+                    msg = "Resource {} is not available. (package path: {})"
+                    logger.warning(msg.format(resource['id'], package_path))
+
+                for key in ('not_modified', 'resumed', 'duplicated',
+                            'probed', 'downloaded_bytes'):
+                    stats[key] += result.get(key, 0)
+
+                now = time.monotonic()
+                if now - progress['logged_at'] >= self.resource_log_seconds:
+                    progress['logged_at'] = now
+                    logger.info((
+                        "[{}] Downloaded {}/{} resources, {} bytes "
+                        "({:.0f} bytes/sec)").format(
+                            site_id, progress['done'], len(targets),
+                            stats['downloaded_bytes'],
+                            stats['downloaded_bytes'] / (now - started_at)))
+
+        def each_package():
+            # Read the cached metadata in bulk first,
+            # then the archived or latest metadata not in the cache.
+            id_list = self.get_id_list_from_solr(site)
+            missing = set(id_list)
+            for package_id, content in self.__each_cached_package_metadata(
+                    site, id_list, 0):
+                missing.discard(package_id)
+                yield package_id, content
+
+            archive = self.get_metadata_archive(site)
+            for package_id in id_list:
+                if package_id not in missing:
+                    continue
+
+                version = None
+                if archive is not None:
+                    version = archive.get(package_id)
+
+                if version is not None:
+                    yield package_id, version['content']
+                else:
+                    yield package_id, self.get_package_metadata(
+                        site, package_id, ignore_expiration=True)
+
+        targets = []
+        for package_id, content in each_package():
             if content is False:
                 logger.debug(
                     "The metadata of package {} is not available.".format(
                         package_id))
                 continue
 
-            m = Metadata.get_instance(content['result'])
+            m = Metadata.get_instance(content['result'], site)
             for resource in m.get_resources():
                 if ('url' not in resource and 'download_url' not in resource) \
                         or resource['id'] is None:
@@ -1023,8 +2343,10 @@ class CkanCache:
                 resource_file_path = self.get_resource_file_path(
                     site, package_id, resource)
 
-                if os.path.exists(resource_file_path):
-                    mtime = os.path.getmtime(resource_file_path)
+                probe = False
+                mtime = self.__get_resource_time(
+                    site, package_id, resource, resource_file_path)
+                if mtime is not None:
                     try:
                         if 'updated' in resource:
                             updated = datetime.datetime.fromisoformat(
@@ -1036,33 +2358,55 @@ class CkanCache:
                             updated = datetime.datetime.fromisoformat(
                                 resource['created'])
                         else:
-                            updated = datetime.datetime(2000, 1, 1)
+                            updated = None
 
                     except ValueError as e:
                         msg = 'In {}, {} ({})'
                         logger.warning(msg.format(
                             package_id, resource['id'], e))
                         stats['invalid_datetime'] += 1
-                        updated = datetime.datetime(2000, 1, 1)
+                        updated = None
 
-                    if mtime >= updated.timestamp() and force is False:
+                    if updated is None:
+                        # Ask the server whether the file has changed.
+                        probe = force is False
+                    elif mtime >= updated.timestamp() and force is False:
                         logger.debug("Resource {} is up to date".format(
                             resource['id']))
                         stats['success'] += 1
                         continue
 
-                if self.save_resource(site, package_id, resource):
-                    stats['success'] += 1
-                    msg = "Resource {} has been downloaded to {}"
-                    logger.debug(msg.format(
-                        resource['id'], resource_file_path))
-                else:
-                    stats['fail'] += 1
-                    package_path = self.__get_package_path(site, package_id)
-                    msg = "Resource {} is not available. (package path: {})"
-                    logger.warning(msg.format(resource['id'], package_path))
-
-                time.sleep(1.0)
+                targets.append((package_id, resource, probe))
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=site_config.RESOURCE_WORKERS) as executor:
+            futures = {executor.submit(download, *target): target
+                       for target in targets}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    # Do not abort the other resources of the site.
+                    package_id, resource, _ = futures[future]
+                    logger.error((
+                        "[{}] {} (while downloading resource {} "
+                        "of package {})").format(
+                            site_id, e, resource.get('id'), package_id))
+                    with lock:
+                        stats['fail'] += 1
+
+        elapsed = time.monotonic() - started_at
+        stats['elapsed_seconds'] = round(elapsed, 3)
+        stats['throughput'] = round(
+            stats['downloaded_bytes'] / elapsed, 1) if elapsed > 0 else 0
+
+        for key in ('hits', 'misses'):
+            stats['metadata_cache_' + key] = \
+                self.get_metadata_cache_stats()[key] - memoized[key]
+
+        transfer = http_client.transfer_stats.diff(site_id, transfer)
+        stats['compressed_bytes'] = transfer['compressed']
+        stats['uncompressed_bytes'] = transfer['uncompressed']
 
         return stats
 
@@ -1119,6 +2463,30 @@ class CkanCache:
 
         return resource_meta_path
 
+    def get_resource_validators_path(
+            self, site, package_id: str, resource: dict):
+        """
+        Get the path to the HTTP validators of the resource file
+        recorded at the last download.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+        package_id: str
+            The id of the package containing the resource.
+        resource: dict
+            The target resource
+
+        Returns
+        -------
+        os.PathLike
+            The path to the resource validators file.
+        """
+        return os.path.join(
+            self.get_resource_dir(site, package_id, resource),
+            'validators.json')
+
     def get_resource_file_path(
             self, site, package_id: str, resource: dict):
         """
@@ -1159,8 +2527,93 @@ class CkanCache:
 
         return os.path.join(dir_path, filename)
 
+    def probe_resource(
+            self, site, package_id: str, resource: dict, result=None):
+        """
+        Check whether the cached resource file is up to date
+        by a HEAD request, comparing ETag, Last-Modified and
+        Content-Length with those recorded at the last download.
+
+        The result is recorded in the validators as 'probed_at',
+        and the HEAD request is not sent again for
+        RESOURCE_PROBE_INTERVAL seconds.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+        package_id: str
+            The id of the package containing the resource.
+        resource: dict
+            The target resource
+        result: dict, optional
+            If set, 'probed' and 'not_modified' are stored.
+
+        Returns
+        -------
+        bool
+            True if the file is up to date, False if it may be changed
+            or the freshness could not be determined.
+        """
+        if result is None:
+            result = {}
+
+        url = resource.get('download_url',
+                           resource.get('url'))
+        validators_path = self.get_resource_validators_path(
+            site, package_id, resource)
+        validators = self.__read_validators(validators_path)
+        if not (validators.get('etag') or validators.get('last_modified') or
+                validators.get('content_length') is not None):
+            return False
+
+        probed_at = validators.get('probed_at', 0)
+        if time.time() - probed_at < site_config.RESOURCE_PROBE_INTERVAL:
+            result['not_modified'] = 1
+            return True
+
+        try:
+            response = http_client.head(
+                url, headers={'Accept-Encoding': 'identity'}, timeout=10,
+                stats_key=site.get_site_id())
+        except HttpError as e:
+            logger.debug("Can't probe '{}', {}".format(url, e))
+            return False
+
+        result['probed'] = 1
+        compared = False
+        for key, header in (('etag', 'ETag'),
+                            ('last_modified', 'Last-Modified')):
+            value = response.headers.get(header)
+            if value and validators.get(key):
+                if value != validators[key]:
+                    return False
+
+                compared = True
+
+        content_length = response.headers.get('Content-Length')
+        if content_length is not None and \
+                validators.get('content_length') is not None and \
+                response.headers.get('Content-Encoding') in (
+                    None, 'identity'):
+            try:
+                if int(content_length) != validators['content_length']:
+                    return False
+            except ValueError:
+                return False
+
+            compared = True
+
+        if not compared:
+            return False
+
+        result['not_modified'] = 1
+        validators['probed_at'] = time.time()
+        self.__write_validators(validators_path, validators)
+        return True
+
     def save_resource(
-            self, site, package_id: str, resource: dict):
+            self, site, package_id: str, resource: dict, result=None):
         """
         Download a resource data to the resource directory.
 
@@ -1168,6 +2621,15 @@ class CkanCache:
         stores the resource metadata and the data file.
         Download the resource file.
 
+        The data is written to a temporary '.part' file chunk by chunk,
+        which is moved into the blob store when the download is completed,
+        and the data file is a hard link to the stored file.
+        If the download is interrupted, the next call resumes it
+        by a Range request.
+        If the same url has already been downloaded for another
+        resource, a conditional request is sent and the stored file
+        is linked when it is not modified.
+
         Parameters
         ----------
         site: xckan.site.Site
@@ -1176,48 +2638,484 @@ class CkanCache:
             The id of the package containing the resource.
         resource: dict
             The target resource
+        result: dict, optional
+            If set, 'downloaded_bytes', 'resumed', 'duplicated'
+            and 'not_modified' of this download are stored.
 
         Returns
         -------
         bool
             Return True if succeed, otherwise False.
         """
-        data = None
+        if result is None:
+            result = {}
+
         url = resource.get('download_url',
                            resource.get('url'))
-        try:
-            response = urllib.request.urlopen(url, context=ctx, timeout=10)
-            if response.status >= 200 and response.status < 300:
-                data = response.read()
-
-        except (urllib.error.HTTPError, urllib.error.URLError,
-                socket.timeout, InvalidURL, Exception) as e:
-            logger.error(
-                str(e) + "(while downloading resource from '{}')".format(url))
-            return False
-
-        if data is None or len(data) == 0:
-            logger.warning(
-                "Empty resource content '{}'".format(url))
-            return False
 
         file_path = self.get_resource_file_path(
             site, package_id, resource)
-
         if file_path is False:
             return False
 
+        # Send a conditional request if the file is in the cache.
+        validators_path = self.get_resource_validators_path(
+            site, package_id, resource)
+        validators = {}
+        if os.path.isfile(file_path):
+            validators = self.__read_validators(validators_path)
+        else:
+            # The same url may have been downloaded for another resource.
+            record = self.blob_store.get_url_record(url)
+            if record and self.blob_store.has(record.get('sha256')):
+                validators = {
+                    key: record[key] for key in (
+                        'etag', 'last_modified', 'sha256', 'content_length')
+                    if record.get(key) is not None}
+
         os.makedirs(self.get_resource_dir(
             site, package_id, resource), mode=0o755,
             exist_ok=True)
 
+        try:
+            status = self.__download_file(
+                site, url, file_path, validators, result)
+        except (HttpError, OSError) as e:
+            logger.error(
+                str(e) + "(while downloading resource from '{}')".format(url))
+            return False
+
+        if status == 304:
+            logger.debug("Resource '{}' is not modified.".format(url))
+            result['not_modified'] = 1
+            if os.path.isfile(file_path):
+                os.utime(file_path)
+                validators['probed_at'] = time.time()
+                self.__write_validators(validators_path, validators)
+                self.__record_resource(
+                    site, package_id, resource, file_path, validators)
+                return True
+
+            # Refer to the stored file instead of downloading it.
+            try:
+                self.blob_store.link(validators['sha256'], file_path)
+            except FileNotFoundError:
+                # Removed after the request, download it next time.
+                logger.warning(
+                    "Stored file of '{}' is removed.".format(url))
+                return False
+
+        if status is False:
+            logger.warning(
+                "Empty resource content '{}'".format(url))
+            return False
+
         meta_path = self.get_resource_metadata_path(
             site, package_id, resource)
         with open(meta_path, 'w', encoding='utf-8') as meta:
             content = json.dumps(resource, indent=2, ensure_ascii=False)
             meta.write(content)
 
-        with open(file_path, 'wb') as fb:
-            fb.write(data)
+        validators['probed_at'] = time.time()
+        self.__write_validators(validators_path, validators)
+        self.__record_resource(
+            site, package_id, resource, file_path, validators)
 
         return True
+
+    def __record_resource(
+            self, site, package_id, resource, file_path, validators):
+        """
+        Record the downloaded resource file to the manifest.
+        """
+        self.get_manifest(site).set_resource(
+            package_id, str(resource['id']),
+            os.path.relpath(file_path, self.__get_site_cache_base(site)),
+            time.time(), os.path.getsize(file_path),
+            validators.get('sha256'))
+
+    def __get_resource_time(self, site, package_id, resource, file_path):
+        """
+        Get the time the resource file was downloaded from the manifest.
+        If it is not recorded, the modified time of the file is used.
+
+        Returns
+        -------
+        float or None
+            The time, or None if the file is not downloaded.
+        """
+        if file_path is False:
+            return None
+
+        entry = self.get_manifest(site).get_resource(
+            package_id, str(resource['id']))
+        if entry is not None and entry['path'] == os.path.relpath(
+                file_path, self.__get_site_cache_base(site)):
+            return entry['downloaded_at']
+
+        if os.path.isfile(file_path):
+            # Downloaded before the manifest was introduced.
+            st = os.stat(file_path)
+            self.get_manifest(site).set_resource(
+                package_id, str(resource['id']),
+                os.path.relpath(file_path, self.__get_site_cache_base(site)),
+                st.st_mtime, st.st_size)
+            return st.st_mtime
+
+        return None
+
+    def touch_resource(self, site, package_id: str, resource: dict):
+        """
+        Record that the resource file was read.
+        The readers of the resource files should call this,
+        so that the files in use are kept in the cache
+        longer than the others by `collect_resources`.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+        package_id: str
+            The id of the package containing the resource.
+        resource: dict
+            The target resource
+        """
+        self.get_manifest(site).touch_resource(
+            package_id, str(resource['id']), time.time())
+
+    def collect_resources(self, quota=None, site_quota=None,
+                          site_quotas=None):
+        """
+        Remove resource files to keep the cache within the quotas.
+
+        The files of the packages no longer recorded in the manifest
+        are removed first. Then the least recently used files are removed
+        from each site over its quota, and from all sites until
+        the total size is within the global quota.
+        The files read or downloaded within RESOURCE_PIN_PERIOD
+        seconds are kept even if the quota is exceeded.
+
+        Each site is locked while its files are collected.
+        The sites locked by another process or whose harvest
+        has not been finished are skipped, since their packages
+        may be being fetched again.
+        The stored files in the blob store no longer linked from
+        any resource file are also removed.
+
+        The sizes and the access times are read from the manifests
+        of the sites in the order of the access time,
+        so the cache directory is not walked and only the records
+        of the removed files and a few more are read.
+        The files with the same content are counted for each resource,
+        so the actual disk usage may be smaller than the total size.
+
+        Parameters
+        ----------
+        quota: int, optional
+            The total bytes of the resource files, 0 for unlimited.
+            If omitted, RESOURCE_CACHE_QUOTA in siteconf.py will be used.
+        site_quota: int, optional
+            The bytes of the resource files per site, 0 for unlimited.
+            If omitted, RESOURCE_SITE_QUOTA in siteconf.py will be used.
+        site_quotas: dict, optional
+            The bytes by site_id which override site_quota.
+            If omitted, RESOURCE_SITE_QUOTAS in siteconf.py will be used.
+
+        Returns
+        -------
+        dict
+            - orphans, orphan_bytes: Removed files of deleted packages
+            - evicted, evicted_bytes: Removed files over the quotas
+            - pinned: Files kept because they are used recently
+            - removed_blobs: Removed files in the blob store
+            - skipped_sites: Sites not collected because they are busy
+            - resource_bytes: Total size of the resource files
+              of the collected sites
+        """
+        if quota is None:
+            quota = site_config.RESOURCE_CACHE_QUOTA
+
+        if site_quota is None:
+            site_quota = site_config.RESOURCE_SITE_QUOTA
+
+        if site_quotas is None:
+            site_quotas = site_config.RESOURCE_SITE_QUOTAS
+
+        pin_timestamp = time.time() - site_config.RESOURCE_PIN_PERIOD
+        stats = {
+            "orphans": 0, "orphan_bytes": 0,
+            "evicted": 0, "evicted_bytes": 0,
+            "pinned": 0, "removed_blobs": 0, "skipped_sites": 0,
+        }
+
+        usage = {}
+        locked = []
+        try:
+            for site_id in sorted(self.get_sites()):
+                if not self.__lock_site_by_id(site_id):
+                    logger.info(
+                        "[{}] Locked by another, skipped.".format(site_id))
+                    stats['skipped_sites'] += 1
+                    continue
+
+                locked.append(site_id)
+                checkpoint = HarvestCheckpoint(
+                    self.__get_harvest_checkpoint_path(site_id))
+                if checkpoint.load() and checkpoint.started_at is not None:
+                    # Interrupted, not only keeping the failed packages.
+                    logger.info(
+                        "[{}] Harvest is not finished, skipped.".format(
+                            site_id))
+                    stats['skipped_sites'] += 1
+                    continue
+
+                self.__remove_orphaned_resources(
+                    site_id, pin_timestamp, stats)
+                usage[site_id] = self.__get_manifest_by_site_id(
+                    site_id).get_stats()['resource_bytes']
+                limit = site_quotas.get(site_id, site_quota)
+                if limit > 0 and usage[site_id] > limit:
+                    logger.info("[{}] {} bytes over the quota.".format(
+                        site_id, usage[site_id] - limit))
+                    usage[site_id] -= self.__evict_resources(
+                        [site_id], usage[site_id] - limit,
+                        pin_timestamp, stats)
+
+            total = sum(usage.values())
+            if quota > 0 and total > quota:
+                logger.info("{} bytes over the quota.".format(total - quota))
+                total -= self.__evict_resources(
+                    sorted(usage), total - quota, pin_timestamp, stats)
+        finally:
+            for site_id in locked:
+                self.__unlock_site_by_id(site_id)
+
+        stats['resource_bytes'] = total
+        logger.info((
+            "Removed {} orphaned and {} evicted resource files, "
+            "{} bytes remain.").format(
+                stats['orphans'], stats['evicted'], total))
+
+        return stats
+
+    def __remove_orphaned_resources(self, site_id, pin_timestamp, stats):
+        """
+        Remove the resource files of the packages
+        no longer recorded in the manifest.
+
+        The manifest is used instead of Solr, since the documents
+        of the site are removed from Solr during a full update
+        or a reindex.
+        """
+        manifest = self.__get_manifest_by_site_id(site_id)
+        package_ids = manifest.get_resource_package_ids()
+        if len(package_ids) == 0:
+            return
+
+        package_ids -= set(manifest.get_fetched_times())
+        for entry in manifest.get_package_resources(sorted(package_ids)):
+            if max(entry['accessed_at'] or 0,
+                   entry['downloaded_at'] or 0) >= pin_timestamp:
+                stats['pinned'] += 1
+                continue
+
+            stats['orphans'] += 1
+            stats['orphan_bytes'] += self.__remove_resource_file(
+                site_id, entry, stats)
+
+    def __evict_resources(self, site_ids, nbytes, pin_timestamp, stats):
+        """
+        Remove the least recently used resource files of the sites
+        until nbytes are freed.
+
+        Returns
+        -------
+        int
+            The freed bytes.
+        """
+        def each_entry(site_id):
+            manifest = self.__get_manifest_by_site_id(site_id)
+            for entry in manifest.each_resource_by_access():
+                yield site_id, entry
+
+        freed = 0
+        for site_id, entry in heapq.merge(
+                *[each_entry(site_id) for site_id in site_ids],
+                key=lambda x: x[1]['accessed_at'] or 0):
+            if freed >= nbytes:
+                break
+
+            if (entry['accessed_at'] or 0) >= pin_timestamp:
+                # The rest are also used recently.
+                stats['pinned'] += 1
+                break
+
+            if (entry['downloaded_at'] or 0) >= pin_timestamp:
+                stats['pinned'] += 1
+                continue
+
+            size = self.__remove_resource_file(site_id, entry, stats)
+            stats['evicted'] += 1
+            stats['evicted_bytes'] += size
+            freed += size
+
+        return freed
+
+    def __remove_resource_file(self, site_id, entry, stats):
+        """
+        Remove the resource directory and its record in the manifest.
+        The stored file in the blob store is also removed
+        if it is no longer linked from any resource file.
+
+        Returns
+        -------
+        int
+            The recorded size of the resource file.
+        """
+        package_path = os.path.join(
+            self.__get_cache_base(), site_id, entry['package_id'])
+        shutil.rmtree(
+            os.path.join(package_path, entry['id']), ignore_errors=True)
+        try:
+            # Remove the package directory if it is empty.
+            os.rmdir(package_path)
+        except OSError:
+            pass
+
+        if entry['sha256'] and \
+                self.blob_store.remove_if_unreferenced(entry['sha256']):
+            stats['removed_blobs'] += 1
+
+        self.__get_manifest_by_site_id(site_id).delete_resources(
+            [(entry['package_id'], entry['id'])])
+
+        return entry['size'] or 0
+
+    def __download_file(self, site, url, file_path, validators, result):
+        """
+        Download the url to the file_path through a '.part' file.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The site of the resource.
+        url: str
+            The url of the resource.
+        file_path: str
+            The path to the resource file.
+        validators: dict
+            The validators of the cached file, updated by the response.
+        result: dict
+            'downloaded_bytes', 'resumed' and 'duplicated' are stored.
+
+        Returns
+        -------
+        int or False
+            The status code, or False if the content is empty.
+        """
+        part_path = file_path + '.part'
+        part_validators_path = part_path + '.json'
+        headers = get_conditional_headers(validators)
+        # Store the content as served, since the file name may imply
+        # its encoding like '.csv.gz', and the byte ranges and
+        # the hash must point to the original content.
+        headers['Accept-Encoding'] = 'identity'
+        sha256 = hashlib.sha256()
+        offset = 0
+
+        # Resume the partial download if the validators are available.
+        part_validators = self.__read_validators(part_validators_path)
+        if os.path.isfile(part_path) and (
+                part_validators.get('etag') or
+                part_validators.get('last_modified')):
+            offset = os.path.getsize(part_path)
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = part_validators.get('etag') or \
+                part_validators['last_modified']
+
+        try:
+            response = http_client.get(
+                url, headers=headers, timeout=10, stream=True,
+                stats_key=site.get_site_id())
+        except HttpError as e:
+            if e.status != 416:
+                raise
+
+            # The partial file is broken, download from the beginning.
+            os.remove(part_path)
+            return self.__download_file(
+                site, url, file_path, validators, result)
+
+        try:
+            if response.status == 304:
+                # The cached file is up to date.
+                for path in (part_path, part_validators_path):
+                    if os.path.isfile(path):
+                        os.remove(path)
+
+                return 304
+
+            if response.status < 200 or response.status >= 300:
+                raise HttpError(
+                    "Unexpected status {}".format(response.status),
+                    url=url, status=response.status)
+
+            if response.status == 206 and offset > 0:
+                logger.debug("Resuming '{}' from {} bytes.".format(
+                    url, offset))
+                result['resumed'] = 1
+                with open(part_path, 'rb') as f:
+                    for chunk in iter(
+                            lambda: f.read(self.resource_chunk_size), b''):
+                        sha256.update(chunk)
+
+                mode = 'ab'
+            else:
+                offset = 0
+                mode = 'wb'
+
+            # Keep the partial file for resuming only if its byte range
+            # can be requested in the next time.
+            part_validators = {}
+            if response.headers.get('Accept-Ranges') == 'bytes' and \
+                    response.headers.get('Content-Encoding') in (
+                        None, 'identity'):
+                update_validators(part_validators, response)
+
+            self.__write_validators(part_validators_path, part_validators)
+
+            size = offset
+            with open(part_path, mode) as f:
+                try:
+                    for chunk in response.stream(
+                            self.resource_chunk_size, decode_content=False):
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        size += len(chunk)
+                        result['downloaded_bytes'] = \
+                            result.get('downloaded_bytes', 0) + len(chunk)
+                except urllib3.exceptions.HTTPError as e:
+                    raise HttpError(
+                        "Download interrupted at {} bytes, {}".format(
+                            size, e), url=url) from e
+        finally:
+            response.release_conn()
+
+        os.remove(part_validators_path)
+        if size == 0:
+            os.remove(part_path)
+            return False
+
+        # Store the content once and link it from the resource directory.
+        digest = sha256.hexdigest()
+        if not self.blob_store.add_and_link(part_path, digest, file_path):
+            logger.debug("Resource '{}' is a duplicate of {}.".format(
+                url, digest))
+            result['duplicated'] = 1
+
+        update_validators(validators, response)
+        validators['sha256'] = digest
+        validators['content_length'] = size
+        self.blob_store.set_url_record(url, validators)
+
+        return response.status
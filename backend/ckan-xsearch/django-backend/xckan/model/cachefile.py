@@ -0,0 +1,205 @@
+# coding: utf-8
+
+import gzip
+import io
+import json
+from logging import getLogger
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from xckan.siteconf import site_config
+
+logger = getLogger(__name__)
+
+# Available encodings of the cached JSON files.
+# - json: compact JSON
+# - gzip: gzip-compressed compact JSON
+# - zstd: zstd-compressed compact JSON (requires 'zstandard')
+cache_encodings = ('json', 'gzip', 'zstd')
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Errors raised while decompressing the cached files
+decompress_errors = (EOFError, zlib.error, gzip.BadGzipFile)
+if zstandard is not None:
+    decompress_errors += (zstandard.ZstdError,)
+
+_zstd_warned = False
+
+
+class CacheFileError(ValueError):
+    """
+    Raised when the cached file cannot be decompressed.
+    """
+    pass
+
+
+def get_cache_encoding(encoding=None):
+    """
+    Get the encoding to write the cached files.
+
+    Parameters
+    ----------
+    encoding: str, optional
+        The encoding. If omitted, CACHE_ENCODING in siteconf.py
+        will be used.
+
+    Returns
+    -------
+    str
+        One of `cache_encodings`. 'zstd' falls back to 'gzip'
+        if the zstandard module is not installed.
+    """
+    encoding = encoding or site_config.CACHE_ENCODING
+    if encoding not in cache_encodings:
+        raise ValueError("Unknown cache encoding '{}'".format(encoding))
+
+    if encoding == 'zstd' and zstandard is None:
+        global _zstd_warned
+        if not _zstd_warned:
+            logger.warning("'zstandard' is not installed, use gzip instead.")
+            _zstd_warned = True
+
+        return 'gzip'
+
+    return encoding
+
+
+def detect_encoding(path):
+    """
+    Detect the encoding of the cached file from its magic number.
+
+    Returns
+    -------
+    str
+        'gzip', 'zstd' or 'json' (including the legacy
+        pretty-printed JSON).
+    """
+    with open(path, 'rb') as f:
+        head = f.read(4)
+
+    if head[:2] == GZIP_MAGIC:
+        return 'gzip'
+
+    if head == ZSTD_MAGIC:
+        return 'zstd'
+
+    return 'json'
+
+
+def open_cache_file(path):
+    """
+    Open the cached file for reading, decompressing if necessary.
+
+    Parameters
+    ----------
+    path: str
+        The path to the cached file.
+
+    Returns
+    -------
+    file object
+        A binary file object returning the JSON.
+    """
+    encoding = detect_encoding(path)
+    if encoding == 'gzip':
+        return gzip.open(path, 'rb')
+
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise CacheFileError(
+                "'zstandard' is required to read '{}'".format(path))
+
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, 'rb'), closefd=True)
+
+    return open(path, 'rb')
+
+
+def open_cache_file_for_write(path, encoding=None):
+    """
+    Open the file to write the cached JSON in the encoding.
+
+    Parameters
+    ----------
+    path: str
+        The path to the file.
+    encoding: str, optional
+        See `get_cache_encoding`.
+
+    Returns
+    -------
+    file object
+        A text file object. The data is compressed when written.
+    """
+    encoding = get_cache_encoding(encoding)
+    if encoding == 'gzip':
+        return io.TextIOWrapper(
+            gzip.open(path, 'wb', compresslevel=6), encoding='utf-8')
+
+    if encoding == 'zstd':
+        return io.TextIOWrapper(
+            zstandard.ZstdCompressor().stream_writer(
+                open(path, 'wb'), closefd=True), encoding='utf-8')
+
+    return open(path, 'w', encoding='utf-8')
+
+
+def load_json(path):
+    """
+    Read the cached JSON file in any encoding.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a valid JSON or cannot be decompressed.
+    """
+    try:
+        with open_cache_file(path) as f:
+            return json.loads(f.read())
+    except decompress_errors as e:
+        raise CacheFileError("{} ({})".format(e, path)) from e
+
+
+def dump_json(content, path, encoding=None):
+    """
+    Write the content to the cached JSON file in the encoding.
+    The file is replaced atomically.
+
+    Parameters
+    ----------
+    content: object
+        The content to be written.
+    path: str
+        The path to the file.
+    encoding: str, optional
+        See `get_cache_encoding`.
+    """
+    tmp_path = path + '.tmp'
+    with open_cache_file_for_write(tmp_path, encoding) as f:
+        json.dump(content, f, ensure_ascii=False, separators=(',', ':'))
+
+    os.replace(tmp_path, path)
+
+
+def is_encoded(path, encoding=None):
+    """
+    Check whether the cached file is already written in the encoding.
+    Pretty-printed JSON files are not regarded as 'json'.
+    """
+    encoding = get_cache_encoding(encoding)
+    current = detect_encoding(path)
+    if current != encoding:
+        return False
+
+    if current == 'json':
+        with open(path, 'rb') as f:
+            return b'\n ' not in f.read(256)
+
+    return True
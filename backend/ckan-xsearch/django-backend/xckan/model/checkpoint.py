@@ -0,0 +1,170 @@
+# coding: utf-8
+
+import json
+from logging import getLogger
+import os
+import time
+
+logger = getLogger(__name__)
+
+
+class HarvestCheckpoint(object):
+    """
+    Progress of harvesting the package metadata of a site,
+    persisted in a JSON file so that an interrupted update
+    can be continued by the next run.
+
+    The file contains:
+
+    - pending: The package_ids to be harvested in this run
+    - done: The package_ids already stored in the cache and Solr
+    - failed: The package_ids which could not be fetched,
+      with the reasons
+    - full: True if the run is a full update
+    """
+
+    # Save the progress every this number of packages ...
+    save_interval = 100
+    # ... or every this seconds.
+    save_seconds = 30.0
+
+    def __init__(self, path, flush=None):
+        """
+        Parameters
+        ----------
+        path: str
+            The path to the checkpoint file.
+        flush: callable, optional
+            Called before saving the progress, to make sure that
+            the packages marked as done are actually stored.
+        """
+        self.path = path
+        self.flush = flush
+        self.full = False
+        self.pending = []
+        self.done = set()
+        self.failed = {}
+        self.started_at = None
+        self.unsaved = 0
+        self.saved_at = 0.0
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self):
+        """
+        Load the checkpoint file.
+
+        Returns
+        -------
+        bool
+            True if the checkpoint is loaded,
+            False if it does not exist or is broken.
+        """
+        if not self.exists():
+            return False
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                content = json.load(f)
+
+            self.full = content.get('full', False)
+            self.pending = content['pending']
+            self.done = set(content['done'])
+            self.failed = content['failed']
+            self.started_at = content.get('started_at')
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Checkpoint '{}' is broken, ignored. ({})".format(
+                self.path, e))
+            return False
+
+        return True
+
+    def start(self, id_list, full=False):
+        """
+        Start a new harvest of the packages in the id_list.
+        The id_list must contain the package_ids failed in
+        the previous run if they are still to be retried;
+        the failure reasons are kept until they are fetched successfully.
+        """
+        self.full = full or self.full
+        self.pending = list(id_list)
+        pending = set(self.pending)
+        self.failed = {id: reason for id, reason in self.failed.items()
+                       if id in pending}
+        self.done = set()
+        self.started_at = self.started_at or time.time()
+        self.save()
+
+    def get_remaining(self):
+        """
+        Get the package_ids which are not harvested yet,
+        including the failed ones.
+        """
+        remaining = [id for id in self.pending if id not in self.done]
+        pending = set(self.pending)
+        remaining += [id for id in self.failed
+                      if id not in pending and id not in self.done]
+        return remaining
+
+    def is_remaining(self, package_id):
+        return package_id not in self.done and \
+            (package_id in self.failed or package_id in self.pending)
+
+    def mark_done(self, package_id):
+        self.done.add(package_id)
+        self.failed.pop(package_id, None)
+        self.__updated()
+
+    def mark_failed(self, package_id, reason):
+        self.failed[package_id] = reason
+        self.__updated()
+
+    def __updated(self):
+        self.unsaved += 1
+        if self.unsaved >= self.save_interval or \
+                time.monotonic() - self.saved_at >= self.save_seconds:
+            self.save()
+
+    def save(self):
+        """
+        Write the progress to the checkpoint file atomically.
+        """
+        if self.flush is not None:
+            self.flush()
+
+        os.makedirs(os.path.dirname(self.path), 0o755, True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "full": self.full,
+                "started_at": self.started_at,
+                "pending": self.pending,
+                "done": list(self.done),
+                "failed": self.failed,
+            }, f, ensure_ascii=False)
+
+        os.replace(tmp_path, self.path)
+        self.unsaved = 0
+        self.saved_at = time.monotonic()
+
+    def finish(self):
+        """
+        Finish the harvest.
+
+        If some packages failed, keep only them in the checkpoint
+        so that they will be retried in the next run.
+        Otherwise, remove the checkpoint file.
+        """
+        if len(self.failed) > 0:
+            self.full = False
+            self.pending = []
+            self.done = set()
+            self.started_at = None
+            self.save()
+        else:
+            self.remove()
+
+    def remove(self):
+        if self.exists():
+            os.remove(self.path)
@@ -0,0 +1,212 @@
+# coding: utf-8
+
+import collections
+import datetime
+import json
+from logging import getLogger
+import os
+import threading
+import time
+
+from xckan.siteconf import site_config
+
+logger = getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when the requests to the site are stopped
+    by the circuit breaker.
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Per-site circuit breaker to give up harvesting a site
+    which keeps failing, instead of occupying a worker for hours.
+
+    The state is persisted in a JSON file and shared across runs.
+
+    - closed: Requests are sent normally. The circuit is opened
+      after CIRCUIT_FAILURES consecutive failures, or when
+      the error rate of the last CIRCUIT_WINDOW requests
+      reaches CIRCUIT_ERROR_RATE.
+    - open: Requests are not sent until the backoff period
+      has elapsed. The period starts from CIRCUIT_BACKOFF seconds
+      and is doubled every time the probe fails,
+      up to CIRCUIT_MAX_BACKOFF seconds.
+    - half_open: After the backoff period, the next run sends
+      `probe_requests` requests as a probe. If all of them succeed,
+      the circuit is closed, otherwise it is opened again.
+    """
+
+    # Number of successful requests to close the circuit
+    probe_requests = 3
+
+    def __init__(self, path, site_id='', failures=None, error_rate=None,
+                 window=None, backoff=None, max_backoff=None):
+        """
+        Parameters
+        ----------
+        path: str
+            The path to the state file.
+        site_id: str, optional
+            The site_id used in log messages.
+        failures, error_rate, window, backoff, max_backoff: optional
+            If not specified, CIRCUIT_* in siteconf.py will be used.
+        """
+        self.path = path
+        self.site_id = site_id
+        self.failures = failures or site_config.CIRCUIT_FAILURES
+        self.error_rate = error_rate or site_config.CIRCUIT_ERROR_RATE
+        self.window = window or site_config.CIRCUIT_WINDOW
+        self.initial_backoff = backoff or site_config.CIRCUIT_BACKOFF
+        self.max_backoff = max_backoff or site_config.CIRCUIT_MAX_BACKOFF
+
+        self.lock = threading.Lock()
+        self.state = 'closed'
+        self.backoff = 0
+        self.retry_at = 0
+        self.reason = None
+        self.consecutive_failures = 0
+        self.probe_successes = 0
+        self.results = collections.deque(maxlen=self.window)
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                content = json.load(f)
+
+            self.state = content['state']
+            self.backoff = content.get('backoff', 0)
+            self.retry_at = content.get('retry_at', 0)
+            self.reason = content.get('reason')
+            self.consecutive_failures = content.get(
+                'consecutive_failures', 0)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(
+                "Circuit state '{}' is broken, ignored. ({})".format(
+                    self.path, e))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), 0o755, True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "state": self.state,
+                "backoff": self.backoff,
+                "retry_at": self.retry_at,
+                "reason": self.reason,
+                "consecutive_failures": self.consecutive_failures,
+            }, f, indent=2, ensure_ascii=False)
+
+        os.replace(tmp_path, self.path)
+
+    def get_message(self):
+        return "Circuit open until {}: {}".format(
+            datetime.datetime.fromtimestamp(self.retry_at).isoformat(
+                timespec='seconds'),
+            self.reason)
+
+    def check(self):
+        """
+        Check if requests can be sent to the site.
+        Call this before starting the harvest.
+
+        Raises
+        ------
+        CircuitOpenError
+            If the circuit is open.
+        """
+        with self.lock:
+            if self.state == 'closed':
+                return
+
+            if self.state == 'open' and time.time() < self.retry_at:
+                raise CircuitOpenError(self.get_message())
+
+            if self.state != 'half_open':
+                logger.info("[{}] Probing the site after {} seconds.".format(
+                    self.site_id, self.backoff))
+                self.state = 'half_open'
+                self.probe_successes = 0
+                self.save()
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.results.append(True)
+            if self.state == 'half_open':
+                self.probe_successes += 1
+                if self.probe_successes >= self.probe_requests:
+                    self.__close()
+
+    def record_failure(self, reason):
+        """
+        Record a failed request.
+
+        Raises
+        ------
+        CircuitOpenError
+            If the circuit is opened by this failure.
+        """
+        with self.lock:
+            self.consecutive_failures += 1
+            self.results.append(False)
+
+            if self.state == 'half_open':
+                self.__open("Probe failed, {}".format(reason))
+            elif self.consecutive_failures >= self.failures:
+                self.__open("{} consecutive failures, last: {}".format(
+                    self.consecutive_failures, reason))
+            elif len(self.results) >= self.window and \
+                    self.results.count(False) >= \
+                    self.error_rate * len(self.results):
+                self.__open("{} of the last {} requests failed".format(
+                    self.results.count(False), len(self.results)))
+            else:
+                self.save()
+                return
+
+            raise CircuitOpenError(self.get_message())
+
+    def finish(self):
+        """
+        Call this when the harvest is completed.
+        If the probe has not failed, close the circuit.
+        """
+        with self.lock:
+            if self.state == 'half_open':
+                self.__close()
+            elif self.state == 'closed':
+                self.save()
+
+    def __open(self, reason):
+        if self.state == 'half_open':
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+        else:
+            self.backoff = self.initial_backoff
+
+        self.state = 'open'
+        self.reason = reason
+        self.retry_at = time.time() + self.backoff
+        self.results.clear()
+        self.save()
+        logger.warning("[{}] {}".format(self.site_id, self.get_message()))
+
+    def __close(self):
+        if self.state != 'closed':
+            logger.info("[{}] Circuit closed after the successful probe."
+                        .format(self.site_id))
+
+        self.state = 'closed'
+        self.backoff = 0
+        self.retry_at = 0
+        self.reason = None
+        self.consecutive_failures = 0
+        self.save()
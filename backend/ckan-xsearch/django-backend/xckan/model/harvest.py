@@ -0,0 +1,174 @@
+# coding: utf-8
+
+import asyncio
+import concurrent.futures
+from logging import getLogger
+import threading
+import urllib.parse
+
+from xckan.siteconf import site_config
+
+logger = getLogger(__name__)
+
+# Semaphores limiting the number of concurrent requests per host.
+# They are shared by all harvesters running in different threads.
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def get_host_semaphore(url, concurrency, group='harvest'):
+    """
+    Get the semaphore for the host of the url.
+
+    Parameters
+    ----------
+    url: str
+        The url to be accessed.
+    concurrency: int
+        The maximum number of concurrent requests to the host.
+        Used only when the semaphore is created.
+    group: str, optional
+        The kind of the requests limited separately,
+        such as 'harvest' or 'resource'.
+
+    Returns
+    -------
+    threading.BoundedSemaphore
+    """
+    key = (group, urllib.parse.urlparse(url).netloc)
+    with _host_semaphores_lock:
+        if key not in _host_semaphores:
+            _host_semaphores[key] = threading.BoundedSemaphore(concurrency)
+
+        return _host_semaphores[key]
+
+
+class AsyncHarvester(object):
+    """
+    Fetch package metadata of a site concurrently using asyncio.
+
+    Requests are sent from a thread pool under a per-host concurrency cap,
+    and the fetched metadata is handed to a single writer thread,
+    so that cache writes and Solr buffering overlap with the network I/O.
+    """
+
+    def __init__(self, fetch, store, concurrency=None, fail=None):
+        """
+        Parameters
+        ----------
+        fetch: callable
+            fetch(package_id) returns a dict object decoded from
+            the JSON returned by the package_show API, or False.
+        store: callable
+            store(package_id, content) saves the fetched content.
+            It is always called from the same thread.
+        concurrency: int, optional
+            The maximum number of concurrent requests per host.
+            If not specified, HARVEST_CONCURRENCY in siteconf.py
+            will be used.
+        fail: callable, optional
+            fail(package_id, reason) is called when the package
+            could not be fetched, from the same thread as `store`.
+        """
+        self.fetch = fetch
+        self.store = store
+        self.fail = fail
+        self.concurrency = concurrency or site_config.HARVEST_CONCURRENCY
+
+    def run(self, site, id_list):
+        """
+        Fetch and store metadata of all packages in the id_list.
+
+        Parameters
+        ----------
+        site: xckan.site.Site
+            The target site.
+        id_list: iterable
+            The package_ids to be fetched.
+
+        Returns
+        -------
+        dict
+            success: Number of stored packages
+            fail: Number of packages which could not be fetched
+        """
+        return asyncio.run(self.__run(site, id_list))
+
+    async def __run(self, site, id_list):
+        loop = asyncio.get_running_loop()
+        site_id = site.get_site_id()
+        semaphore = get_host_semaphore(
+            site.get_proxy() or site.get_api(), self.concurrency)
+        results = asyncio.Queue(maxsize=self.concurrency * 4)
+        ids = iter(id_list)
+        stats = {"success": 0, "fail": 0}
+
+        def fetch(package_id):
+            with semaphore:
+                return self.fetch(package_id)
+
+        async def fetcher(executor):
+            for package_id in ids:
+                reason = "Can't get metadata"
+                try:
+                    content = await loop.run_in_executor(
+                        executor, fetch, package_id)
+                except Exception as e:
+                    logger.error("[{}] {} (while fetching '{}')".format(
+                        site_id, e, package_id))
+                    content = False
+                    reason = str(e)
+
+                await results.put((package_id, content, reason))
+
+        async def writer(executor):
+            while True:
+                item = await results.get()
+                if item is None:
+                    break
+
+                package_id, content, reason = item
+                if not isinstance(content, dict) or \
+                        content.get('success') is False:
+                    logger.error(
+                        "[{}] Can't get metadata of '{}' (Skipped)".format(
+                            site_id, package_id))
+                    stats['fail'] += 1
+                    if self.fail is not None:
+                        await loop.run_in_executor(
+                            executor, self.fail, package_id, reason)
+
+                    continue
+
+                await loop.run_in_executor(
+                    executor, self.store, package_id, content)
+                stats['success'] += 1
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.concurrency) as fetch_executor, \
+                concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1) as write_executor:
+            writer_task = asyncio.ensure_future(writer(write_executor))
+            fetchers = asyncio.gather(*[
+                fetcher(fetch_executor) for _ in range(self.concurrency)])
+
+            await asyncio.wait(
+                [writer_task, fetchers],
+                return_when=asyncio.FIRST_COMPLETED)
+            if writer_task.done():
+                # The writer stopped unexpectedly.
+                fetchers.cancel()
+                try:
+                    await fetchers
+                except asyncio.CancelledError:
+                    pass
+
+                writer_task.result()
+
+            await fetchers
+            await results.put(None)
+            await writer_task
+
+        logger.debug("[{}] Harvested {} packages ({} failed).".format(
+            site_id, stats['success'], stats['fail']))
+        return stats
@@ -0,0 +1,373 @@
+# coding: utf-8
+
+import hashlib
+from logging import getLogger
+import ssl
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import urllib3
+
+from xckan.siteconf import site_config
+from .ratelimit import rate_limiter
+
+logger = getLogger(__name__)
+
+# Returned instead of the content when the server responded
+# '304 Not Modified' to a conditional request.
+NOT_MODIFIED = object()
+
+
+def get_conditional_headers(validators):
+    """
+    Build conditional request headers from the validators
+    recorded at the last download.
+
+    Parameters
+    ----------
+    validators: dict or None
+        A dict object which may have 'etag' and 'last_modified'.
+
+    Returns
+    -------
+    dict
+        'If-None-Match' and/or 'If-Modified-Since' headers.
+    """
+    headers = {}
+    if not validators:
+        return headers
+
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    return headers
+
+
+def update_validators(validators, response, body=None):
+    """
+    Record the validators of the response.
+
+    Parameters
+    ----------
+    validators: dict or None
+        The dict object to be updated. If None, do nothing.
+    response: urllib3.response.HTTPResponse
+        The response.
+    body: bytes, optional
+        If given, its SHA-256 hash is also recorded as 'sha256'.
+        Otherwise, the recorded hash is discarded.
+    """
+    if validators is None:
+        return
+
+    validators['etag'] = response.headers.get('ETag')
+    validators['last_modified'] = response.headers.get('Last-Modified')
+    if body is not None:
+        validators['sha256'] = hashlib.sha256(body).hexdigest()
+    else:
+        validators.pop('sha256', None)
+
+
+class HttpError(Exception):
+    """
+    Raised when the request could not be completed or
+    the server returned an error status.
+    """
+
+    def __init__(self, message, url=None, status=None, headers=None):
+        super().__init__(message)
+        self.url = url
+        self.status = status
+        self.headers = headers or {}
+
+
+class TransferStats(object):
+    """
+    Per-site counters of the transferred bytes, to see
+    how much the compressed transfer saves.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def add(self, key, compressed, uncompressed):
+        """
+        Count a response.
+
+        Parameters
+        ----------
+        key: str
+            The key to aggregate, usually the site_id.
+        compressed: int
+            The number of bytes actually received.
+        uncompressed: int
+            The number of bytes after decoding.
+        """
+        with self.lock:
+            counter = self.counters.setdefault(key, {
+                "requests": 0, "compressed": 0, "uncompressed": 0})
+            counter['requests'] += 1
+            counter['compressed'] += compressed
+            counter['uncompressed'] += uncompressed
+
+    def get(self, key):
+        """
+        Get a copy of the counters of the key.
+        """
+        with self.lock:
+            return dict(self.counters.get(key, {
+                "requests": 0, "compressed": 0, "uncompressed": 0}))
+
+    def diff(self, key, since):
+        """
+        Get the counts since the snapshot taken by `get`.
+        """
+        current = self.get(key)
+        return {k: v - since.get(k, 0) for k, v in current.items()}
+
+
+class StreamedResponse(object):
+    """
+    Wrapper of a streamed response which counts the bytes read,
+    and records them to the TransferStats on `release_conn`.
+    The other attributes are delegated to the response.
+    """
+
+    def __init__(self, response, stats, key):
+        self.response = response
+        self.stats = stats
+        self.key = key
+        self.uncompressed = 0
+        self.recorded = False
+
+    def read(self, amt=None, **kwargs):
+        data = self.response.read(amt, **kwargs)
+        self.uncompressed += len(data)
+        return data
+
+    def stream(self, amt=2**16, **kwargs):
+        for data in self.response.stream(amt, **kwargs):
+            self.uncompressed += len(data)
+            yield data
+
+    def release_conn(self):
+        if not self.recorded:
+            self.recorded = True
+            self.stats.add(
+                self.key, self.response.tell(), self.uncompressed)
+
+        self.response.release_conn()
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+
+class HttpClient(object):
+    """
+    Connection-pooled HTTP client shared by all site accesses.
+
+    Connections are kept alive per host, so that successive requests
+    to the same CKAN site reuse the TCP connection and its TLS session
+    instead of doing a new handshake every time.
+
+    Compressed responses are requested by 'Accept-Encoding' and
+    decoded transparently, also while streaming.
+
+    Each request waits for the per-host rate limiter, and requests
+    answered with 429/503 are retried after the 'Retry-After' period.
+    """
+
+    # Number of retries when the server returned 429 or 503
+    throttle_retries = 2
+
+    def __init__(self, num_pools=None, maxsize=None, ssl_context=None):
+        """
+        Parameters
+        ----------
+        num_pools: int, optional
+            The number of hosts whose connections are kept.
+            If not specified, HTTP_POOL_NUM_POOLS in siteconf.py
+            will be used.
+        maxsize: int, optional
+            The number of connections kept for each host.
+            If not specified, HTTP_POOL_MAXSIZE in siteconf.py
+            will be used.
+        ssl_context: ssl.SSLContext, optional
+            If not specified, the context created by
+            `site_config.get_ssl_context()` will be used.
+        """
+        if num_pools is None:
+            num_pools = site_config.HTTP_POOL_NUM_POOLS
+
+        if maxsize is None:
+            maxsize = site_config.HTTP_POOL_MAXSIZE
+
+        if ssl_context is None:
+            ssl_context = site_config.get_ssl_context()
+
+        headers = {'User-Agent': site_config.HTTP_USER_AGENT}
+        if site_config.HTTP_ACCEPT_ENCODING:
+            headers['Accept-Encoding'] = site_config.HTTP_ACCEPT_ENCODING
+
+        self.pool_kwargs = {
+            'num_pools': num_pools,
+            'maxsize': maxsize,
+            'block': False,
+            'ssl_context': ssl_context,
+            'headers': headers,
+            # 429/503 are retried by `request` through the rate limiter,
+            # not by urllib3 following 'Retry-After' by itself.
+            'retries': urllib3.Retry(
+                total=5, connect=0, read=0, redirect=5, other=0,
+                respect_retry_after_header=False),
+        }
+
+        if ssl_context.verify_mode == ssl.CERT_NONE:
+            # urllib3 overwrites the verify_mode of the context
+            # by 'cert_reqs', so self-signed certificates must be
+            # accepted explicitly.
+            self.pool_kwargs['cert_reqs'] = ssl.CERT_NONE
+            self.pool_kwargs['assert_hostname'] = False
+            urllib3.disable_warnings(
+                urllib3.exceptions.InsecureRequestWarning)
+
+        self.lock = threading.Lock()
+        self.managers = {}
+        self.transfer_stats = TransferStats()
+
+    def __get_manager(self, url):
+        """
+        Get the pool manager for the url.
+        If a proxy is set by environment variables for the scheme,
+        return the proxy manager.
+        """
+        parsed = urllib.parse.urlparse(url)
+        proxy = urllib.request.getproxies().get(parsed.scheme)
+        if proxy and urllib.request.proxy_bypass(parsed.hostname or ''):
+            proxy = None
+
+        with self.lock:
+            if proxy not in self.managers:
+                if proxy is None:
+                    manager = urllib3.PoolManager(**self.pool_kwargs)
+                else:
+                    manager = urllib3.ProxyManager(proxy, **self.pool_kwargs)
+
+                self.managers[proxy] = manager
+
+            return self.managers[proxy]
+
+    def request(self, method, url, headers=None, timeout=10, stream=False,
+                stats_key=None):
+        """
+        Send a request and return the response.
+
+        Parameters
+        ----------
+        method: str
+            HTTP method, such as 'GET' or 'HEAD'.
+        url: str
+            The target url.
+        headers: dict, optional
+            Additional request headers.
+        timeout: float, optional
+            Timeout seconds for both connect and read.
+        stream: bool, optional
+            If True, the body is not read in advance.
+            Read it with `response.read(amt)` or `response.stream()`,
+            and call `response.release_conn()` when finished.
+        stats_key: str, optional
+            If set, the transferred bytes are counted
+            in `transfer_stats` under this key.
+
+        Returns
+        -------
+        urllib3.response.HTTPResponse
+            The response object.
+
+        Raises
+        ------
+        HttpError
+            If the connection failed or the server returned
+            an error status (>= 400).
+        """
+        # The default headers are replaced, not merged, by urllib3
+        # when the headers are given.
+        request_headers = dict(self.pool_kwargs['headers'])
+        request_headers.update(headers or {})
+
+        for retry in range(self.throttle_retries + 1):
+            rate_limiter.acquire(url)
+            started_at = time.monotonic()
+            try:
+                response = self.__get_manager(url).request(
+                    method, url, headers=request_headers, timeout=timeout,
+                    preload_content=not stream,
+                    enforce_content_length=True)
+            except urllib3.exceptions.MaxRetryError as e:
+                rate_limiter.feedback(
+                    url, None, time.monotonic() - started_at)
+                raise HttpError(str(e.reason), url=url) from e
+            except (urllib3.exceptions.HTTPError, ValueError) as e:
+                rate_limiter.feedback(
+                    url, None, time.monotonic() - started_at)
+                raise HttpError(str(e), url=url) from e
+
+            retry_after = rate_limiter.parse_retry_after(
+                response.headers.get('Retry-After'))
+            rate_limiter.feedback(
+                url, response.status, time.monotonic() - started_at,
+                retry_after)
+
+            if response.status < 400:
+                if stats_key is None:
+                    return response
+
+                if stream:
+                    return StreamedResponse(
+                        response, self.transfer_stats, stats_key)
+
+                self.transfer_stats.add(
+                    stats_key, response.tell(), len(response.data))
+                return response
+
+            if stream:
+                # Read the rest of the body not to reuse the connection
+                # in the middle of the response.
+                response.drain_conn()
+                response.release_conn()
+
+            if response.status not in (429, 503) or \
+                    retry == self.throttle_retries:
+                break
+
+            logger.debug("Retrying '{}' after status {}".format(
+                url, response.status))
+
+        raise HttpError(
+            "HTTP Error {}: {}".format(response.status, response.reason),
+            url=url, status=response.status,
+            headers=dict(response.headers))
+
+    def get(self, url, **kwargs):
+        """
+        Send a GET request.
+        See `request` for the parameters.
+        """
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        """
+        Send a HEAD request.
+        See `request` for the parameters.
+        """
+        return self.request('HEAD', url, **kwargs)
+
+
+http_client = HttpClient()
@@ -0,0 +1,240 @@
+# coding: utf-8
+
+import codecs
+import json
+import re
+
+
+class JsonStreamError(ValueError):
+    """
+    Raised when the stream is not a valid JSON.
+    """
+    pass
+
+
+class JsonArrayStream(object):
+    """
+    Parse a JSON document incrementally and iterate over the elements
+    of the array at the specified path, without reading the whole
+    document into memory.
+
+    The other values on the way are stored in `fields`,
+    keyed by the dot-separated path, e.g. 'success' or 'result.count'.
+
+    Example
+    -------
+    >>> stream = JsonArrayStream(response, ('result', 'results'))
+    >>> for package in stream:
+    ...     print(package['name'])
+    >>> count = stream.fields['result.count']
+    """
+
+    chunk_size = 65536
+    whitespaces = ' \t\r\n'
+    # Max characters of an element, to stop reading a broken stream
+    max_value_size = 64 * 1024 * 1024
+
+    re_scalar_end = re.compile(r'[,\]}\s]')
+    # A string, a bracket, or the quote of an incomplete string
+    re_token = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]|"')
+
+    def __init__(self, fp, path):
+        """
+        Parameters
+        ----------
+        fp: File-like object
+            The stream to be read by `fp.read(size)`.
+            It may return either bytes (UTF-8) or str.
+        path: tuple of str
+            The keys to the target array from the top-level object.
+        """
+        self.fp = fp
+        self.path = tuple(path)
+        self.fields = {}
+        self.found = False   # Becomes True when the array is found
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def __iter__(self):
+        yield from self.__parse_value(())
+        if self.__peek() is not None:
+            raise JsonStreamError("Extra data after the JSON document")
+
+    def __fill(self):
+        """
+        Read the next chunk into the buffer.
+        Returns False at the end of the stream.
+        """
+        if self.eof:
+            return False
+
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            chunk = self.text_decoder.decode(b'', final=True)
+            if chunk == '':
+                return False
+        elif isinstance(chunk, bytes):
+            chunk = self.text_decoder.decode(chunk)
+
+        # Drop the consumed part
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def __fill_value(self):
+        """
+        Read the next chunk while a value is not complete.
+        Returns False at the end of the stream.
+        """
+        if len(self.buf) - self.pos > self.max_value_size:
+            raise JsonStreamError(
+                "A value exceeds {} characters".format(self.max_value_size))
+
+        return self.__fill()
+
+    def __find_value_end(self):
+        """
+        Find the end of the value from the current position,
+        reading the chunks as needed.
+
+        The nesting and the strings are tracked while scanning,
+        and the scanned part is not scanned again after the next
+        chunk is read, so that a value spanning many chunks
+        is decoded only once.
+
+        Returns
+        -------
+        int
+            The position next to the value.
+        """
+        if self.buf[self.pos] not in '{["':
+            # A number or a literal ends at a delimiter.
+            while True:
+                m = self.re_scalar_end.search(self.buf, self.pos)
+                if m is not None:
+                    return m.start()
+
+                if not self.__fill_value():
+                    return len(self.buf)
+
+        # The offset from self.pos, since it changes on filling.
+        offset = 0
+        depth = 0
+        while True:
+            for m in self.re_token.finditer(self.buf, self.pos + offset):
+                token = m.group()
+                if token == '"':
+                    # The string continues in the next chunk.
+                    offset = m.start() - self.pos
+                    break
+
+                if token[0] == '"':
+                    if depth == 0:
+                        return m.end()
+                elif token in '[{':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth <= 0:
+                        return m.end()
+            else:
+                offset = len(self.buf) - self.pos
+
+            if not self.__fill_value():
+                raise JsonStreamError("Unexpected end of the stream")
+
+    def __peek(self):
+        """
+        Skip whitespaces and return the next character,
+        or None at the end of the stream.
+        """
+        while True:
+            while self.pos < len(self.buf) and \
+                    self.buf[self.pos] in self.whitespaces:
+                self.pos += 1
+
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+
+            if not self.__fill():
+                return None
+
+    def __next_char(self, expected):
+        ch = self.__peek()
+        if ch is None or ch not in expected:
+            raise JsonStreamError(
+                "Expected one of '{}' but got '{}'".format(expected, ch))
+
+        self.pos += 1
+        return ch
+
+    def __decode_value(self):
+        """
+        Decode a complete JSON value from the current position.
+        """
+        if self.__peek() is None:
+            raise JsonStreamError("Unexpected end of the stream")
+
+        # Most values are within the buffer.
+        # A number may continue in the next chunk unless delimited.
+        try:
+            value, end = self.decoder.raw_decode(self.buf, self.pos)
+            if self.buf[self.pos] in '{["' or \
+                    self.re_scalar_end.match(self.buf, end) or \
+                    (end == len(self.buf) and self.eof):
+                self.pos = end
+                return value
+        except (json.JSONDecodeError, RecursionError):
+            pass
+
+        # Read the rest of the value, and decode it once.
+        end = self.__find_value_end()
+        try:
+            value, decoded_end = self.decoder.raw_decode(self.buf, self.pos)
+        except (json.JSONDecodeError, RecursionError) as e:
+            raise JsonStreamError(str(e)) from e
+
+        if decoded_end != end:
+            raise JsonStreamError(
+                "Invalid value at {}".format(self.buf[self.pos:end][:20]))
+
+        self.pos = end
+        return value
+
+    def __parse_value(self, path):
+        ch = self.__peek()
+        if path == self.path and ch == '[':
+            self.found = True
+            self.pos += 1
+            if self.__peek() == ']':
+                self.pos += 1
+                return
+
+            while True:
+                yield self.__decode_value()
+                if self.__next_char(',]') == ']':
+                    return
+
+        elif ch == '{' and path == self.path[:len(path)] and \
+                len(path) < len(self.path):
+            self.pos += 1
+            if self.__peek() == '}':
+                self.pos += 1
+                return
+
+            while True:
+                key = self.__decode_value()
+                if not isinstance(key, str):
+                    raise JsonStreamError("Invalid object key")
+
+                self.__next_char(':')
+                yield from self.__parse_value(path + (key,))
+                if self.__next_char(',}') == '}':
+                    return
+
+        else:
+            self.fields['.'.join(path)] = self.__decode_value()
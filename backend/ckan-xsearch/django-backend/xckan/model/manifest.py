@@ -0,0 +1,409 @@
+# coding: utf-8
+
+import hashlib
+import json
+from logging import getLogger
+import sqlite3
+import threading
+
+logger = getLogger(__name__)
+
+
+def get_content_hash(content):
+    """
+    Get the SHA-256 hash of the content serialized as a canonical JSON.
+
+    Parameters
+    ----------
+    content: dict
+        The content.
+
+    Returns
+    -------
+    str
+        The hex digest.
+    """
+    data = json.dumps(
+        content, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class SiteManifest(object):
+    """
+    Records of the cached files of a site.
+
+    For each package, the time it was fetched, the modified time
+    reported by the site, the content hash, the size of the cached
+    file and the downloaded resources are recorded,
+    so that freshness checks and statistics do not need
+    to access the cached files.
+    Each update is a SQLite transaction.
+
+    The time each resource file was last read is also recorded,
+    so that the least recently used files can be found
+    without walking the cache directory.
+    """
+
+    # Number of rows read at once while iterating
+    batch_size = 1000
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path: str
+            The path to the manifest file, created if not exists.
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(
+            path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS packages (
+                    id TEXT PRIMARY KEY,
+                    fetched_at REAL NOT NULL,
+                    modified TEXT,
+                    hash TEXT,
+                    size INTEGER
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS resources (
+                    package_id TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    path TEXT,
+                    downloaded_at REAL,
+                    size INTEGER,
+                    sha256 TEXT,
+                    accessed_at REAL,
+                    PRIMARY KEY (package_id, id)
+                )""")
+            columns = [row[1] for row in self.conn.execute(
+                "PRAGMA table_info(resources)")]
+            if 'accessed_at' not in columns:
+                # Created before the access time was recorded.
+                self.conn.execute(
+                    "ALTER TABLE resources ADD COLUMN accessed_at REAL")
+                self.conn.execute(
+                    "UPDATE resources SET accessed_at = downloaded_at")
+
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS resources_accessed_at
+                ON resources (accessed_at, package_id, id)""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    name TEXT PRIMARY KEY,
+                    updated_at REAL NOT NULL
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS properties (
+                    name TEXT PRIMARY KEY,
+                    value TEXT
+                )""")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get_package(self, package_id):
+        """
+        Get the record of the cached package metadata.
+
+        Returns
+        -------
+        dict or None
+            'fetched_at', 'modified', 'hash' and 'size',
+            or None if not recorded.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT fetched_at, modified, hash, size FROM packages "
+                "WHERE id = ?", (package_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        return dict(zip(('fetched_at', 'modified', 'hash', 'size'), row))
+
+    def get_fetched_times(self):
+        """
+        Get the fetched times of all the recorded packages.
+
+        Returns
+        -------
+        dict
+            A dict object whose keys are package_ids and whose values
+            are the fetched times.
+        """
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT id, fetched_at FROM packages"))
+
+    def set_package(self, package_id, fetched_at, modified=None,
+                    hash=None, size=None):
+        """
+        Record the cached package metadata.
+        """
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO packages (id, fetched_at, modified, hash, size)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    fetched_at = excluded.fetched_at,
+                    modified = excluded.modified,
+                    hash = excluded.hash,
+                    size = excluded.size""",
+                (package_id, fetched_at, modified, hash, size))
+
+    def touch_package(self, package_id, fetched_at):
+        """
+        Update the fetched time of the package metadata.
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE packages SET fetched_at = ? WHERE id = ?",
+                (fetched_at, package_id))
+
+    def delete_packages(self, package_ids, with_resources=True):
+        """
+        Delete the records of the packages.
+
+        Parameters
+        ----------
+        package_ids: iterable
+            The target ids.
+        with_resources: bool, optional
+            If True (default), the records of their resources
+            are also deleted.
+        """
+        params = [(package_id,) for package_id in package_ids]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM packages WHERE id = ?", params)
+            if with_resources:
+                self.conn.executemany(
+                    "DELETE FROM resources WHERE package_id = ?", params)
+
+    def get_resource(self, package_id, resource_id):
+        """
+        Get the record of the downloaded resource file.
+
+        Returns
+        -------
+        dict or None
+            'path', 'downloaded_at', 'size' and 'sha256',
+            or None if not recorded.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT path, downloaded_at, size, sha256 FROM resources "
+                "WHERE package_id = ? AND id = ?",
+                (package_id, resource_id)).fetchone()
+
+        if row is None:
+            return None
+
+        return dict(zip(('path', 'downloaded_at', 'size', 'sha256'), row))
+
+    def set_resource(self, package_id, resource_id, path, downloaded_at,
+                     size=None, sha256=None):
+        """
+        Record the downloaded resource file.
+        The access time is initialized to the downloaded time
+        and kept on later downloads.
+        """
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO resources (package_id, id, path,
+                    downloaded_at, size, sha256, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (package_id, id) DO UPDATE SET
+                    path = excluded.path,
+                    downloaded_at = excluded.downloaded_at,
+                    size = excluded.size,
+                    sha256 = excluded.sha256""",
+                (package_id, resource_id, path, downloaded_at, size, sha256,
+                 downloaded_at))
+
+    def touch_resource(self, package_id, resource_id, accessed_at):
+        """
+        Record that the resource file was read.
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE resources SET accessed_at = ? "
+                "WHERE package_id = ? AND id = ?",
+                (accessed_at, package_id, resource_id))
+
+    def get_resource_package_ids(self):
+        """
+        Get the ids of the packages which have downloaded resources.
+
+        Returns
+        -------
+        set
+        """
+        with self.lock:
+            return {row[0] for row in self.conn.execute(
+                "SELECT DISTINCT package_id FROM resources")}
+
+    def get_package_resources(self, package_ids):
+        """
+        Get the records of the resources of the packages.
+
+        Returns
+        -------
+        list
+            The dict objects which have 'package_id', 'id', 'path',
+            'downloaded_at', 'accessed_at', 'size' and 'sha256'.
+        """
+        entries = []
+        with self.lock:
+            for package_id in package_ids:
+                entries.extend(
+                    self.__to_resource_entry(row)
+                    for row in self.conn.execute(
+                        "SELECT package_id, id, path, downloaded_at, "
+                        "accessed_at, size, sha256 FROM resources "
+                        "WHERE package_id = ?", (package_id,)))
+
+        return entries
+
+    @staticmethod
+    def __to_resource_entry(row):
+        return dict(zip((
+            'package_id', 'id', 'path', 'downloaded_at', 'accessed_at',
+            'size', 'sha256'), row))
+
+    def each_resource_by_access(self):
+        """
+        Iterate over the records of the resources
+        in the order of the access time, the oldest first.
+
+        The rows are read in batches, so that only the rows
+        needed by the caller are read, and the database is not
+        locked while the caller processes them.
+        The records deleted while iterating are not returned again.
+
+        Returns
+        -------
+        dict
+            See `get_package_resources`.
+        """
+        last_key = (-1.0, '', '')
+        while True:
+            with self.lock:
+                rows = self.conn.execute("""
+                    SELECT package_id, id, path, downloaded_at,
+                        accessed_at, size, sha256
+                    FROM resources
+                    WHERE (accessed_at, package_id, id) > (?, ?, ?)
+                    ORDER BY accessed_at, package_id, id
+                    LIMIT ?""",
+                    last_key + (self.batch_size,)).fetchall()
+
+            for row in rows:
+                yield self.__to_resource_entry(row)
+
+            if len(rows) < self.batch_size:
+                break
+
+            last_key = (rows[-1][4], rows[-1][0], rows[-1][1])
+
+    def delete_resources(self, keys):
+        """
+        Delete the records of the resources.
+
+        Parameters
+        ----------
+        keys: iterable
+            The pairs of the package_id and the resource id.
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM resources WHERE package_id = ? AND id = ?",
+                list(keys))
+
+    def get_file_time(self, name):
+        """
+        Get the updated time of the cached file of the site,
+        such as 'package_list.json'.
+
+        Returns
+        -------
+        float or None
+            The updated time, or None if not recorded.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT updated_at FROM files WHERE name = ?",
+                (name,)).fetchone()
+
+        return None if row is None else row[0]
+
+    def set_file_time(self, name, updated_at):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO files (name, updated_at) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    updated_at = excluded.updated_at""",
+                (name, updated_at))
+
+    def delete_file(self, name):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM files WHERE name = ?", (name,))
+
+    def get_property(self, name):
+        """
+        Get the property of the site, such as 'metadata_class'.
+
+        Returns
+        -------
+        str or None
+            The value, or None if not recorded.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM properties WHERE name = ?",
+                (name,)).fetchone()
+
+        return None if row is None else row[0]
+
+    def set_property(self, name, value):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO properties (name, value) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    value = excluded.value""",
+                (name, value))
+
+    def get_stats(self):
+        """
+        Get the statistics of the cache of the site.
+
+        Returns
+        -------
+        dict
+            - packages: Number of cached packages
+            - package_bytes: Total size of the cached metadata
+            - last_fetched: The latest fetched time of the metadata
+            - resources: Number of downloaded resources
+            - resource_bytes: Total size of the resource files
+        """
+        with self.lock:
+            packages, package_bytes, last_fetched = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), MAX(fetched_at) "
+                "FROM packages").fetchone()
+            resources, resource_bytes = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) "
+                "FROM resources").fetchone()
+
+        return {
+            "packages": packages,
+            "package_bytes": package_bytes,
+            "last_fetched": last_fetched,
+            "resources": resources,
+            "resource_bytes": resource_bytes,
+        }
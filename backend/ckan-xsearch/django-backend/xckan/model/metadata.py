@@ -1,13 +1,18 @@
 # coding: utf-8
 from abc import ABC
 import datetime
+import functools
+import hashlib
 from html.parser import HTMLParser
 from io import StringIO
 import json
 from logging import getLogger
 import re
+import sys
 import traceback
 
+from xckan.siteconf import site_config
+
 logger = getLogger(__name__)
 
 
@@ -15,6 +20,9 @@ class MLStripper(HTMLParser):
     """
     Strip HTML Tags from string.
     ref: https://stackoverflow.com/questions/753052/
+
+    The text is regarded as HTML only if it contains a pair of
+    a start tag and its end tag, otherwise it is returned as is.
     """
 
     def __init__(self):
@@ -23,16 +31,18 @@ class MLStripper(HTMLParser):
         self.strict = False
         self.convert_charrefs = True
         self.text = StringIO()
-        self.tag_started = set()
+        self.tag_stack = []
         self.is_mltext = False
 
     def handle_starttag(self, tag, attrs):
-        self.tag_started = self.tag_started | set(tag)
+        self.tag_stack.append(tag)
 
     def handle_endtag(self, tag):
-        if tag in self.tag_started:
+        if tag in self.tag_stack:
             self.is_mltext = True
-            self.tag_started = self.tag_started - set(tag)
+            # Also close the unclosed tags inside it, such as <br>.
+            while self.tag_stack.pop() != tag:
+                pass
 
     def handle_data(self, d):
         self.text.write(d)
@@ -48,36 +58,120 @@ class MLStripper(HTMLParser):
         return stripped
 
 
+re_datetime = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})')
+re_spaces = re.compile(r'([ \t\u3000])+(?=.)')
+re_newlines = re.compile(r' *([\r\n]|\\n)+ *(?=.)')
+re_trailing_newlines = re.compile(r'\n+$')
+
+
 def strip_tags(html):
-    s = MLStripper()
-    string = s.get_data(html)
-    string = re.sub(r'([ \t\u3000])+(?=.)', ' ', string)
-    string = re.sub(r' *([\r\n]|\\n)+ *(?=.)', ' / ', string)
-    string = re.sub(r'\n+$', '', string)
+    if '<' in html:
+        string = MLStripper().get_data(html)
+    else:
+        # No tags, the text is returned as is by MLStripper.
+        string = html
+
+    string = re_spaces.sub(' ', string)
+    if '\n' in string or '\r' in string or '\\n' in string:
+        string = re_newlines.sub(' / ', string)
+        string = re_trailing_newlines.sub('', string)
+
     return string
 
 
-def unnest(obj, dic={}, prefix=''):
+class TagStripper(object):
+    """
+    `strip_tags` memoized within a package,
+    where the same names are repeated in the resources.
+    """
+
+    def __init__(self):
+        self.stripped = {}
+
+    def strip(self, text):
+        stripped = self.stripped.get(text)
+        if stripped is None:
+            stripped = self.stripped[text] = strip_tags(text)
+
+        return stripped
+
+    def unique(self, texts):
+        """
+        Strip the tags from the non-empty texts
+        and remove the duplicates keeping the order.
+
+        Returns
+        -------
+        list
+            The stripped texts.
+        """
+        # A dict is used as an ordered set.
+        return list(dict.fromkeys(self.strip(v) for v in texts if v))
+
+
+def unnest(obj, dic=None, prefix=''):
     """
     Unnest nested object.
+
+    The values in dicts are stored with the keys joined by '.',
+    and the values in lists are stored with the same key.
+    If different values are stored with the same key,
+    they are stored as a list without duplicates.
+
+    Parameters
+    ----------
+    obj: any
+        A value decoded from JSON.
+    dic: dict, optional
+        The dict to store the values. A new dict if omitted.
+    prefix: str, optional
+        The key of the obj.
+
+    Returns
+    -------
+    dict
+        The dic.
     """
-    if isinstance(obj, list):
-        for x in obj:
-            unnest(x, dic, prefix)
-    elif isinstance(obj, dict):
-        for k, v in obj.items():
-            new_prefix = prefix + '.' + k if len(prefix) > 0 else k
-            unnest(v, dic, new_prefix)
-    elif prefix not in dic:
-        dic[prefix] = obj
-    else:
-        if not isinstance(dic[prefix], list):
-            if dic[prefix] == obj:
-                pass
+    if dic is None:
+        dic = {}
+
+    # The sets of values already stored as a list for each key.
+    seen = {}
+    # The joined keys, shared by the elements of a list.
+    prefixes = {}
+
+    # Traverse in depth-first order to keep the order of the values.
+    stack = [(obj, prefix)]
+    while stack:
+        obj, prefix = stack.pop()
+        if isinstance(obj, list):
+            stack.extend((x, prefix) for x in reversed(obj))
+        elif isinstance(obj, dict):
+            for k, v in reversed(obj.items()):
+                new_prefix = prefixes.get((prefix, k))
+                if new_prefix is None:
+                    new_prefix = sys.intern(
+                        prefix + '.' + k if len(prefix) > 0 else k)
+                    prefixes[(prefix, k)] = new_prefix
+
+                stack.append((v, new_prefix))
+        elif prefix not in dic:
+            dic[prefix] = obj
+        else:
+            values = dic[prefix]
+            if not isinstance(values, list):
+                if values != obj:
+                    dic[prefix] = [values, obj]
+                    seen[prefix] = {values, obj}
             else:
-                dic[prefix] = [dic[prefix], obj]
-        elif obj not in dic[prefix]:
-            dic[prefix].append(obj)
+                if prefix not in seen:
+                    # Stored by the caller.
+                    seen[prefix] = set(values)
+
+                if obj not in seen[prefix]:
+                    seen[prefix].add(obj)
+                    values.append(obj)
 
     return dic
 
@@ -87,31 +181,98 @@ class Metadata(ABC):
     The abstract class of metadata classes.
     """
 
+    # Version of the conversion to the Solr metadata.
+    # Increment it when the converted fields change, so that
+    # the packages indexed by the older version are not skipped.
+    converter_version = 1
+
     @staticmethod
-    def get_class(metadata):
+    def get_index_hash(content_hash, site):
         """
-        Get the subclass compatible with the metadata.
+        Get the hash stored in the 'xckan_content_hash' field,
+        which changes when the package metadata, the converter
+        or the settings of the site change.
+
+        Parameters
+        ----------
+        content_hash: str
+            The hash of the package metadata.
+        site: xckan.site.Site
+            The site which published the metadata.
+
+        Returns
+        -------
+        str
+            The hex digest.
         """
-        if not isinstance(metadata, dict) and not isinstance(metadata, list):
-            return False
+        data = "{}:{}:{}".format(
+            Metadata.converter_version,
+            site.get_conversion_fingerprint(), content_hash)
+        return hashlib.sha256(data.encode('ascii')).hexdigest()
 
-        for c in [
+    @staticmethod
+    def get_subclasses():
+        """
+        Get the subclasses in the order to be probed.
+        """
+        return [
             ShirasagiMetadata,  # SHIRASAGI
             CkanMetadata,     # ckan, dkan
             MikawaMetadata,   # opendata-east-mikawa.jp
             KagawaMetadata   # opendata.pref.kagawa.lg.jp
-        ]:
+        ]
+
+    @staticmethod
+    def get_class_by_name(name):
+        """
+        Get the subclass by its name, or False if not found.
+        """
+        for c in Metadata.get_subclasses():
+            if c.__name__ == name:
+                return c
+
+        return False
+
+    @staticmethod
+    def get_class(metadata, site=None):
+        """
+        Get the subclass compatible with the metadata.
+
+        If the site is specified, the class detected for the site
+        is tried first, and the others are probed only if
+        the metadata is not compatible with it.
+        The detected class is recorded in the site.
+
+        Parameters
+        ----------
+        metadata: dict or list
+            The metadata decoded from JSON.
+        site: xckan.site.Site, optional
+            The site which published the metadata.
+        """
+        if not isinstance(metadata, dict) and not isinstance(metadata, list):
+            return False
+
+        if site is not None and site.metadata_class is not None and \
+                site.metadata_class.is_compatible(metadata):
+            return site.metadata_class
+
+        for c in Metadata.get_subclasses():
             if c.is_compatible(metadata):
+                if site is not None:
+                    site.set_metadata_class(c)
+
                 return c
 
         return False
 
     @staticmethod
-    def get_instance(metadata):
+    def get_instance(metadata, site=None):
         """
-        Get the subclass object of the metadata
+        Get the subclass object of the metadata.
+        See `get_class` for the site.
         """
-        c = Metadata.get_class(metadata)
+        c = Metadata.get_class(metadata, site)
         if c is False:
             return False
 
@@ -127,6 +288,13 @@ class Metadata(ABC):
     def support_fq(self):
         return False
 
+    def support_bulk(self):
+        """
+        Whether the 'package_search' API of the site returns
+        the complete metadata, same as 'package_show'.
+        """
+        return False
+
     def get_id(self):
         return False
 
@@ -163,24 +331,32 @@ class Metadata(ABC):
         return False
 
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def reformat_date_field(dt_str):
         """
         Reformat CKAN's datatime value to Solr compatible.
+
+        The results are memoized, since the same values are repeated
+        in the resources and the packages of a site.
         """
 
         if dt_str is None or dt_str == '':
             return None
 
-        m = re.search(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}', dt_str)
+        m = re_datetime.search(dt_str)
         if not m:
             return None
 
         try:
-            dt = datetime.datetime.strptime(m.group(0), '%Y-%m-%dT%H:%M:%S')
+            dt = datetime.datetime(*[int(x) for x in m.groups()])
         except ValueError:
             return None
 
-        return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+        if dt.year < 1000 or not m.group(0).isascii():
+            # Not zero-padded, or non-ASCII digits.
+            return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        return m.group(0) + 'Z'
 
     def get_solr_metadata(self, site, metadata=None):
         """
@@ -388,22 +564,36 @@ class Metadata(ABC):
 
         Otherwise, returns the list of all candidates found.
         """
-        if site.re_vocab is None:
+        if site.vocabulary is None:
             if isinstance(site.tag_default, str):
                 return [site.tag_default]
 
             return site.tag_default
 
-        tags = site.re_vocab.findall(from_text)
+        tags = site.vocabulary.findall(from_text)
         if len(tags) == 0:
             if isinstance(site.tag_default, str):
                 return [site.tag_default]
 
             return site.tag_default
 
-        tags = (list)(filter(None, set(tags[0])))
         return tags
 
+    @staticmethod
+    def format_resource_names(resource_names):
+        """
+        Format the resource names appended to the description.
+        If there are more than DESCRIPTION_MAX_RESOURCES names,
+        the rest are counted instead of listed.
+        """
+        limit = site_config.DESCRIPTION_MAX_RESOURCES
+        if limit > 0 and len(resource_names) > limit:
+            return '【リソース】{} / ほか{}件'.format(
+                ' / '.join(resource_names[:limit]),
+                len(resource_names) - limit)
+
+        return '【リソース】{}'.format(' / '.join(resource_names))
+
 
 class CkanMetadata(Metadata):
     """
@@ -423,6 +613,9 @@ class CkanMetadata(Metadata):
     def support_fq(self):
         return True
 
+    def support_bulk(self):
+        return True
+
     def get_id(self):
         return self.metadata['name']
 
@@ -459,40 +652,28 @@ class CkanMetadata(Metadata):
         description = self.metadata.get('notes') or ''
         description = strip_tags(description)
 
-        resource_names = []
-        for resource in self.metadata.get('resources', []):
-            v = resource.get('name')
-            if v:
-                v = strip_tags(v)
-                if v not in resource_names:
-                    resource_names.append(v)
-
-            v = resource.get('description')
-            if v:
-                v = strip_tags(v)
-                if v not in resource_names:
-                    resource_names.append(v)
-
-        # Resource description is stored in extras field
-        # in "data.go.jp"
-        for extra_kv in self.metadata.get('extras', []):
-            if extra_kv.get('key') in ('description', 'resource_names'):
-                v = extra_kv.get('value')
-                if v:
-                    v = strip_tags(v)
-                    if v not in resource_names:
-                        resource_names.append(v)
+        def each_resource_text():
+            for resource in self.metadata.get('resources', []):
+                yield resource.get('name')
+                yield resource.get('description')
 
+            # Resource description is stored in extras field
+            # in "data.go.jp"
+            for extra_kv in self.metadata.get('extras', []):
+                if extra_kv.get('key') in ('description', 'resource_names'):
+                    yield extra_kv.get('value')
+
+        stripper = TagStripper()
+        resource_names = stripper.unique(each_resource_text())
         if len(resource_names) > 0:
-            description += '【リソース】{}'.format(
-                ' / '.join(resource_names))
+            description += self.format_resource_names(resource_names)
 
         tags = []
         for tag in self.metadata.get('tags', []):
             if isinstance(tag, str):
-                tags.append(strip_tags(tag))
+                tags.append(stripper.strip(tag))
             elif isinstance(tag, dict) and 'name' in tag:
-                tags.append(strip_tags(tag['name']))
+                tags.append(stripper.strip(tag['name']))
 
         if len(tags) > 0:
             description += '【キーワード】{}'.format(
@@ -557,20 +738,15 @@ class ShirasagiMetadata(Metadata):
         description = self.metadata.get('text') or ''
         description = strip_tags(description)
 
-        resource_names = []
-        for resource in self.metadata.get('resources', []):
-            v = resource.get('name')
-            if v:
-                v = strip_tags(v)
-                if v not in resource_names:
-                    resource_names.append(v)
-
+        stripper = TagStripper()
+        resource_names = stripper.unique(
+            resource.get('name')
+            for resource in self.metadata.get('resources', []))
         if len(resource_names) > 0:
-            description += '【リソース】{}'.format(
-                ' / '.join(resource_names))
+            description += self.format_resource_names(resource_names)
 
         tags = ' / '.join(
-            [strip_tags(x) for x in self.metadata.get('tags', [])])
+            [stripper.strip(x) for x in self.metadata.get('tags', [])])
         if len(tags) > 0:
             description += '【キーワード】{}'.format(tags)
 
@@ -655,19 +831,14 @@ class MikawaMetadata(Metadata):
         description = metadata.get('notes') or ''
         description = strip_tags(description)
 
-        resource_names = []
-        for resource in metadata.get('resources', []):
-            v = resource.get('description')
-            if v:
-                v = strip_tags(v)
-                if v not in resource_names:
-                    resource_names.append(v)
-
+        stripper = TagStripper()
+        resource_names = stripper.unique(
+            resource.get('description')
+            for resource in metadata.get('resources', []))
         if len(resource_names) > 0:
-            description += '【リソース】{}'.format(
-                ' / '.join(resource_names))
+            description += self.format_resource_names(resource_names)
 
-        tags = [strip_tags(tag.get('name'))
+        tags = [stripper.strip(tag.get('name'))
                 for tag in metadata.get('tags', [])]
         if len(tags) > 0:
             description += '【キーワード】{}'.format(
@@ -738,17 +909,11 @@ class KagawaMetadata(Metadata):
             + (self.metadata.get('notes') or '')
         description = strip_tags(description)
 
-        resource_names = []
-        for resource in self.metadata.get('resources', []):
-            v = resource.get('name')
-            if v:
-                v = strip_tags(v)
-                if v not in resource_names:
-                    resource_names.append(v)
-
+        resource_names = TagStripper().unique(
+            resource.get('name')
+            for resource in self.metadata.get('resources', []))
         if len(resource_names) > 0:
-            description += '【リソース】{}'.format(
-                ' / '.join(resource_names))
+            description += self.format_resource_names(resource_names)
 
         tags = []
         for tag in self.metadata.get('tags', []):
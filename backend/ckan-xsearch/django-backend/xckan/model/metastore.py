@@ -0,0 +1,241 @@
+# coding: utf-8
+
+import hashlib
+import json
+from logging import getLogger
+import sqlite3
+import threading
+import time
+import zlib
+
+logger = getLogger(__name__)
+
+
+class MetadataStore(object):
+    """
+    Package metadata of a site stored in a SQLite database
+    instead of one 'catalog.json' file per package.
+
+    The database is opened in WAL mode, so that readers are not
+    blocked by the harvest writing new metadata.
+    Each row holds the package_id, the time it was fetched,
+    the modified time reported by the site, the SHA-256 hash of
+    the content, the zlib-compressed JSON and the HTTP validators.
+    """
+
+    # Number of rows read at once while iterating
+    batch_size = 1000
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path: str
+            The path to the database file, created if not exists.
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(
+            path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS packages (
+                    id TEXT PRIMARY KEY,
+                    fetched_at REAL NOT NULL,
+                    modified TEXT,
+                    hash TEXT,
+                    body BLOB NOT NULL,
+                    validators TEXT
+                )""")
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS packages_fetched_at
+                ON packages (fetched_at)""")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    @staticmethod
+    def encode(content):
+        """
+        Encode the content to a compact JSON.
+
+        Returns
+        -------
+        (bytes, str)
+            The zlib-compressed JSON and its SHA-256 hash.
+        """
+        data = json.dumps(
+            content, ensure_ascii=False, separators=(',', ':'),
+            sort_keys=True).encode('utf-8')
+        return zlib.compress(data), hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def decode(body):
+        return json.loads(zlib.decompress(body).decode('utf-8'))
+
+    def get(self, package_id):
+        """
+        Get the stored metadata.
+
+        Parameters
+        ----------
+        package_id: str
+            The target id.
+
+        Returns
+        -------
+        (dict, float) or None
+            The content and the time it was fetched,
+            or None if not stored.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT body, fetched_at FROM packages WHERE id = ?",
+                (package_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        return self.decode(row[0]), row[1]
+
+    def has(self, package_id):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM packages WHERE id = ?",
+                (package_id,)).fetchone() is not None
+
+    def put(self, package_id, content, fetched_at=None, validators=None):
+        """
+        Store the metadata.
+
+        Parameters
+        ----------
+        package_id: str
+            The target id.
+        content: dict
+            A dict object decoded from the JSON returned by
+            the package_show API.
+        fetched_at: float, optional
+            The time the content was fetched. Now if omitted.
+        validators: dict, optional
+            The HTTP validators. The stored ones are kept if omitted.
+        """
+        body, sha256 = self.encode(content)
+        modified = None
+        if isinstance(content.get('result'), dict):
+            modified = content['result'].get('metadata_modified')
+
+        if fetched_at is None:
+            fetched_at = time.time()
+
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO packages (id, fetched_at, modified, hash, body)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    fetched_at = excluded.fetched_at,
+                    modified = excluded.modified,
+                    hash = excluded.hash,
+                    body = excluded.body""",
+                (package_id, fetched_at, modified, sha256, body))
+            if validators is not None:
+                self.conn.execute(
+                    "UPDATE packages SET validators = ? WHERE id = ?",
+                    (json.dumps(validators, ensure_ascii=False),
+                     package_id))
+
+    def touch(self, package_id, fetched_at=None):
+        """
+        Mark the metadata as fetched now without rewriting it.
+        """
+        if fetched_at is None:
+            fetched_at = time.time()
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE packages SET fetched_at = ? WHERE id = ?",
+                (fetched_at, package_id))
+
+    def get_validators(self, package_id):
+        """
+        Get the HTTP validators recorded at the last download.
+
+        Returns
+        -------
+        dict
+            The validators. Empty if not recorded.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT validators FROM packages WHERE id = ?",
+                (package_id,)).fetchone()
+
+        if row is None or row[0] is None:
+            return {}
+
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return {}
+
+    def set_validators(self, package_id, validators):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE packages SET validators = ? WHERE id = ?",
+                (json.dumps(validators, ensure_ascii=False), package_id))
+
+    def delete(self, package_ids):
+        """
+        Delete the metadata of the packages.
+
+        Parameters
+        ----------
+        package_ids: iterable
+            The target ids.
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM packages WHERE id = ?",
+                [(package_id,) for package_id in package_ids])
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM packages").fetchone()[0]
+
+    def each(self, expire_timestamp=0):
+        """
+        Iterate over the stored metadata sorted by package_id.
+
+        The rows are read in batches, so the database is not locked
+        while the caller processes them.
+
+        Parameters
+        ----------
+        expire_timestamp: float, optional
+            Skip the metadata fetched before this time.
+
+        Returns
+        -------
+        (str, dict)
+            The package_id and the content.
+        """
+        last_id = ''
+        while True:
+            with self.lock:
+                rows = self.conn.execute("""
+                    SELECT id, body FROM packages
+                    WHERE id > ? AND fetched_at >= ?
+                    ORDER BY id LIMIT ?""",
+                    (last_id, expire_timestamp, self.batch_size)).fetchall()
+
+            for package_id, body in rows:
+                yield package_id, self.decode(body)
+
+            if len(rows) < self.batch_size:
+                break
+
+            last_id = rows[-1][0]
@@ -0,0 +1,269 @@
+# coding: utf-8
+
+import datetime
+import email.utils
+from logging import getLogger
+import threading
+import time
+import urllib.parse
+
+from xckan.siteconf import site_config
+
+logger = getLogger(__name__)
+
+
+class TokenBucket(object):
+    """
+    Token bucket limiting the request rate to a host.
+
+    The rate is adjusted by AIMD (additive increase,
+    multiplicative decrease) according to the responses;
+    it is halved when the server returns 429/503 or the request fails,
+    reduced when the latency grows, and recovers gradually
+    up to the configured rate while the server responds well.
+
+    If the rate is 0, the requests are not limited, but they are
+    paused after 429/503 or a failure; for `overload_backoff` seconds
+    doubled while the server keeps failing, or for 'Retry-After'.
+    """
+
+    # Multiplier applied to the rate when the server is overloaded
+    decrease_factor = 0.5
+    # Multiplier applied when the latency grows
+    slowdown_factor = 0.8
+    # The lowest rate is (configured rate) * min_rate_factor
+    min_rate_factor = 1.0 / 16
+    # The rate is increased by (configured rate) * increase_factor
+    # for each successful response
+    increase_factor = 1.0 / 20
+    # Latency is regarded as grown when it exceeds
+    # (baseline latency) * latency_threshold + latency_margin
+    latency_threshold = 2.0
+    latency_margin = 0.5
+    # Smoothing factor of the latency EWMA
+    latency_alpha = 0.2
+    # Maximum seconds to wait following 'Retry-After'
+    max_retry_after = 3600
+    # Seconds to pause an unlimited host when it is overloaded,
+    # doubled up to max_overload_backoff while it continues
+    overload_backoff = 1.0
+    max_overload_backoff = 60.0
+
+    def __init__(self, rate, burst):
+        """
+        Parameters
+        ----------
+        rate: float
+            The maximum number of requests per second, 0 for unlimited.
+        burst: int
+            The number of requests that can be sent at once.
+        """
+        self.lock = threading.Lock()
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.latency = None
+        self.baseline_latency = None
+        self.backoff = 0.0
+        self.configure(rate, burst)
+        self.rate = self.max_rate
+
+    def configure(self, rate, burst):
+        """
+        Change the configured rate and burst.
+        The current (adapted) rate is kept within the new range.
+        """
+        with self.lock:
+            self.max_rate = float(rate)
+            self.min_rate = self.max_rate * self.min_rate_factor
+            self.burst = max(1, int(burst))
+            self.tokens = min(self.tokens, self.burst)
+            if hasattr(self, 'rate'):
+                self.rate = min(max(self.rate, self.min_rate), self.max_rate)
+
+    def __refill(self, now):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        """
+        Wait until a request can be sent and consume a token.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.__refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.max_rate == 0:
+                    return
+                elif self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                else:
+                    wait = (1.0 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def feedback(self, status, latency, retry_after=None):
+        """
+        Adjust the rate by the result of a request.
+
+        Parameters
+        ----------
+        status: int or None
+            The status code of the response.
+            None if the request failed without response.
+        latency: float
+            Seconds taken by the request.
+        retry_after: float, optional
+            Seconds specified by the 'Retry-After' header.
+        """
+        with self.lock:
+            if status is None or status in (429, 503):
+                self.rate = max(
+                    self.min_rate, self.rate * self.decrease_factor)
+                pause = None
+                if self.max_rate == 0:
+                    # No rate to decrease, pause the requests instead.
+                    self.backoff = min(
+                        max(self.backoff * 2, self.overload_backoff),
+                        self.max_overload_backoff)
+                    pause = self.backoff
+
+                if retry_after is not None:
+                    pause = min(retry_after, self.max_retry_after)
+
+                if pause is not None:
+                    self.blocked_until = time.monotonic() + pause
+                    self.tokens = 0.0
+
+                return
+
+            if self.max_rate == 0:
+                self.backoff = 0.0
+                return
+
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.latency_alpha * (latency - self.latency)
+
+            if self.baseline_latency is None or \
+                    self.latency < self.baseline_latency:
+                self.baseline_latency = self.latency
+
+            if self.latency > self.baseline_latency * \
+                    self.latency_threshold + self.latency_margin:
+                self.rate = max(
+                    self.min_rate, self.rate * self.slowdown_factor)
+            else:
+                self.rate = min(
+                    self.max_rate,
+                    self.rate + self.max_rate * self.increase_factor)
+
+
+class RateLimiter(object):
+    """
+    Per-host registry of token buckets.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    @staticmethod
+    def get_host(url):
+        return urllib.parse.urlparse(url).netloc
+
+    def configure(self, url, rate=None, burst=None):
+        """
+        Set the rate and burst of the host of the url.
+
+        Parameters
+        ----------
+        url: str
+            Any url of the target host.
+        rate: float, optional
+            Requests per second, 0 for unlimited. If not specified,
+            RATE_LIMIT in siteconf.py will be used.
+        burst: int, optional
+            If not specified, RATE_BURST in siteconf.py will be used.
+        """
+        if rate is None:
+            rate = site_config.RATE_LIMIT
+
+        if burst is None:
+            burst = site_config.RATE_BURST
+
+        host = self.get_host(url)
+        with self.lock:
+            if host in self.buckets:
+                self.buckets[host].configure(rate, burst)
+            else:
+                self.buckets[host] = TokenBucket(rate, burst)
+
+    def get_bucket(self, url):
+        """
+        Get the token bucket of the host of the url.
+        Unconfigured hosts use the default rate and burst.
+        """
+        host = self.get_host(url)
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(
+                    site_config.RATE_LIMIT, site_config.RATE_BURST)
+
+            return self.buckets[host]
+
+    def acquire(self, url):
+        self.get_bucket(url).acquire()
+
+    def feedback(self, url, status, latency, retry_after=None):
+        bucket = self.get_bucket(url)
+        bucket.feedback(status, latency, retry_after)
+        if status not in (429, 503):
+            return
+
+        if bucket.max_rate > 0:
+            logger.warning(
+                "{} returned {}, reduce rate to {:.3f} req/s".format(
+                    self.get_host(url), status, bucket.rate))
+        else:
+            logger.warning(
+                "{} returned {}, pause requests for {:.1f} seconds".format(
+                    self.get_host(url), status,
+                    max(0.0, bucket.blocked_until - time.monotonic())))
+
+    @staticmethod
+    def parse_retry_after(value):
+        """
+        Parse the value of 'Retry-After' header.
+
+        Returns
+        -------
+        float or None
+            Seconds to wait, or None if the value is invalid.
+        """
+        if value is None:
+            return None
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+        try:
+            dt = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return max(0.0, (dt - now).total_seconds())
+
+
+rate_limiter = RateLimiter()
@@ -1,18 +1,22 @@
 # coding: utf-8
 
 import datetime
+import hashlib
 import json
 from logging import getLogger
-import socket
 import time
 import urllib.parse
-import urllib.request
+
+import urllib3
 
 from xckan.siteconf import site_config
+from xckan.model.httpclient import http_client, HttpError, NOT_MODIFIED, \
+    get_conditional_headers, update_validators
+from xckan.model.jsonstream import JsonArrayStream, JsonStreamError
 from xckan.model.metadata import Metadata
+from xckan.model.ratelimit import rate_limiter
 
 logger = getLogger(__name__)
-ctx = site_config.get_ssl_context()
 
 
 class Site:
@@ -24,10 +28,17 @@ class Site:
         url_api=None,
         proxy=None,
         is_fq_available=False,
+        rate_limit=None,
+        rate_burst=None,
     ):
         """
         Set URLs of the site-top and API endpoint.
         Both urls must end with '/'.
+
+        If rate_limit (requests/sec) or rate_burst is specified,
+        requests to the hosts of the site are limited by them
+        while the site is harvested (see `configure_rate_limit`).
+        Otherwise, RATE_LIMIT and RATE_BURST in siteconf.py are used.
         """
         self.name = name
         self.url_top = url_top if url_top is None or url_top.endswith(
@@ -38,9 +49,27 @@ class Site:
             '/') else proxy + '/'
         self.tag_default = None
         self.is_fq_available = is_fq_available
-        self.re_vocab = None  # Compiled regexp object of controlled vocabulary
+        self.vocabulary = None  # VocabularyMatcher of controlled vocabulary
+        self.metadata_class = None  # Metadata subclass detected for the site
+        # Numbers of packages whose formats differ from the detected one,
+        # by "<old class> -> <new class>".
+        self.metadata_class_changes = {}
 
         self.sample_metadata = None
+        self.conversion_fingerprint = None  # (settings, hash)
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+
+    def configure_rate_limit(self):
+        """
+        Apply the rate limit of the site to the limiter of its hosts.
+
+        The limiter is shared by the process, so this is called
+        when the site is harvested, not when the object is created.
+        """
+        for url in (self.url_top, self.url_api):
+            if url is not None:
+                rate_limiter.configure(url, self.rate_limit, self.rate_burst)
 
     @staticmethod
     def read_from_conf():
@@ -100,6 +129,35 @@ class Site:
     def get_proxy(self):
         return self.proxy
 
+    def get_conversion_fingerprint(self):
+        """
+        Get the hash of the settings of the site which affect
+        the conversion to the Solr metadata, such as the name
+        and the tag vocabulary.
+
+        Returns
+        -------
+        str
+            The hex digest.
+        """
+        settings = (self.name, self.url_api, self.tag_default,
+                    self.vocabulary, site_config.DESCRIPTION_MAX_RESOURCES)
+        if self.conversion_fingerprint is None or \
+                self.conversion_fingerprint[0] != settings:
+            data = json.dumps({
+                "name": self.name,
+                "url_api": self.url_api,
+                "tag_default": self.tag_default,
+                "vocabulary": None if self.vocabulary is None
+                else self.vocabulary.terms,
+                "description_max_resources":
+                    site_config.DESCRIPTION_MAX_RESOURCES,
+            }, ensure_ascii=False, sort_keys=True)
+            self.conversion_fingerprint = (
+                settings, hashlib.sha256(data.encode('utf-8')).hexdigest())
+
+        return self.conversion_fingerprint[1]
+
     def get_api_base(self):
         url = self.get_api()
         pos = url.rfind('/api')
@@ -121,23 +179,30 @@ class Site:
 
         return site_id
 
-    def get_package_list(self):
+    def get_package_list(self, validators=None):
         """
         Call 'package_list' API.
         If the response is not valid, return False.
+
+        If validators (a dict with 'etag' and 'last_modified')
+        is given, send a conditional request and return
+        NOT_MODIFIED if the list has not been changed.
+        Otherwise, the validators are updated by the response.
         """
         site_id = self.get_site_id()
         from_proxy = False
+        headers = get_conditional_headers(validators)
 
         if self.proxy is not None:
             # Request to the proxy server
             url = self.proxy + 'package_list?fq={}'.format(
                 urllib.parse.quote('id:' + site_id + r'\:*'))
             try:
-                response = urllib.request.urlopen(url, context=ctx, timeout=10)
+                response = http_client.get(
+                    url, headers=headers, timeout=10,
+                    stats_key=self.get_site_id())
                 from_proxy = True
-            except (urllib.error.HTTPError, urllib.error.URLError,
-                    socket.timeout) as e:
+            except HttpError as e:
                 logger.error(str(e) + "while accessing proxy '{}'".format(url))
                 return False
 
@@ -145,16 +210,20 @@ class Site:
             # Request to the original ckan server
             url = self.get_api() + 'package_list'
             try:
-                response = urllib.request.urlopen(url, context=ctx, timeout=10)
+                response = http_client.get(
+                    url, headers=headers, timeout=10,
+                    stats_key=self.get_site_id())
                 from_proxy = False
-            except (urllib.error.HTTPError, urllib.error.URLError,
-                    socket.timeout) as e:
+            except HttpError as e:
                 logger.error(
                     str(e) + " while accessing '{}'".format(url)
                 )
                 return False
 
-        body = response.read()
+        if response.status == 304:
+            return NOT_MODIFIED
+
+        body = response.data
         if body is None or len(body) == 0:
             logger.warning(
                 "Cannot read dataset list from '{}', skipped.".format(url))
@@ -167,6 +236,8 @@ class Site:
                 "Not JSON response from '{}', skipped.".format(url))
             return False
 
+        update_validators(validators, response, body)
+
         if from_proxy:
             # translate xckan-id to the original-id.
             result['result'] = [
@@ -178,40 +249,118 @@ class Site:
 
         return result
 
-    def get_package_metadata(self, package_id):
+    def iter_package_list(self, validators=None):
+        """
+        Call 'package_list' API and iterate over the package ids
+        while parsing the response incrementally, so that
+        the whole list is not kept in memory.
+
+        The validators are handled in the same way as `get_package_list`.
+
+        Returns
+        -------
+        generator
+            Yields package ids. Duplicated ids are not removed.
+            Raises HttpError or ValueError if the response is broken
+            while iterating.
+            Returns NOT_MODIFIED if the list has not been changed,
+            or False if the server could not be connected.
+        """
+        site_id = self.get_site_id()
+        headers = get_conditional_headers(validators)
+
+        if self.proxy is not None:
+            url = self.proxy + 'package_list?fq={}'.format(
+                urllib.parse.quote('id:' + site_id + r'\:*'))
+        else:
+            url = self.get_api() + 'package_list'
+
+        try:
+            response = http_client.get(
+                url, headers=headers, timeout=10, stream=True,
+                stats_key=self.get_site_id())
+        except HttpError as e:
+            logger.error(str(e) + " while accessing '{}'".format(url))
+            return False
+
+        if response.status == 304:
+            response.release_conn()
+            return NOT_MODIFIED
+
+        update_validators(validators, response)
+
+        def iterate():
+            stream = JsonArrayStream(response, ('result',))
+            try:
+                for package_id in stream:
+                    if self.proxy is not None:
+                        # translate xckan-id to the original-id.
+                        package_id = package_id[len(site_id) + 1:]
+
+                    yield package_id
+            except urllib3.exceptions.HTTPError as e:
+                raise HttpError(
+                    str(e) + " while reading '{}'".format(url),
+                    url=url) from e
+            finally:
+                response.release_conn()
+
+            if stream.fields.get('success') is False or not stream.found:
+                raise JsonStreamError(
+                    "Unexpected response from '{}'".format(url))
+
+        return iterate()
+
+    def get_package_metadata(self, package_id, validators=None):
         """
         Call 'package_show' API.
         If the response is not valid, return False.
+        If the site answered that the package is not available,
+        such as deleted after 'package_list', the returned dict
+        has 'success' of False (see `get_failed_package_content`).
+
+        If validators (a dict with 'etag' and 'last_modified')
+        is given, send a conditional request and return
+        NOT_MODIFIED if the metadata has not been changed.
+        Otherwise, the validators are updated by the response.
         """
 
         site_id = self.get_site_id()
         from_proxy = False
+        headers = get_conditional_headers(validators)
 
         if self.proxy is not None:
             # Request to the proxy server
             url = self.proxy + 'package_show?id=' + urllib.parse.quote(
                 site_id + ':' + package_id)
             try:
-                response = urllib.request.urlopen(url, context=ctx, timeout=10)
+                response = http_client.get(
+                    url, headers=headers, timeout=10,
+                    stats_key=self.get_site_id())
                 from_proxy = True
-            except Exception as e:
+            except HttpError as e:
                 logger.error(
                     str(e) + " while accessing proxy '{}'".format(url))
-                return False
+                return self.get_failed_package_content(e)
 
         if not from_proxy:
             url = self.get_api() + 'package_show?id=' + urllib.parse.quote(
                 package_id)
 
             try:
-                response = urllib.request.urlopen(url, context=ctx, timeout=10)
+                response = http_client.get(
+                    url, headers=headers, timeout=10,
+                    stats_key=self.get_site_id())
                 from_proxy = False
-            except Exception as e:
+            except HttpError as e:
                 logger.error(
                     str(e) + " while accessing '{}'".format(url))
-                return False
+                return self.get_failed_package_content(e)
+
+        if response.status == 304:
+            return NOT_MODIFIED
 
-        body = response.read()
+        body = response.data
         if body is None or len(body) == 0:
             logger.error(
                 "Cannot read metadata from '{}'".format(url))
@@ -224,8 +373,36 @@ class Site:
                 "Not JSON response from '{}', skipped.".format(url))
             return False
 
+        update_validators(validators, response, body)
+
         return result
 
+    @staticmethod
+    def get_failed_package_content(error):
+        """
+        Get the result of 'package_show' which failed with the error.
+
+        Client errors such as 404 mean that the site is working
+        but the package is not available, which should not be
+        regarded as a failure of the site.
+
+        Parameters
+        ----------
+        error: xckan.model.httpclient.HttpError
+            The error raised by the request.
+
+        Returns
+        -------
+        dict or False
+            A dict whose 'success' is False if the server returned
+            4xx except 429, otherwise False.
+        """
+        if error.status is not None and 400 <= error.status < 500 and \
+                error.status != 429:
+            return {"success": False, "error": str(error)}
+
+        return False
+
     def get_updated_package_list(self, since=None):
         """
         Get updated packages modified/created after the datetime
@@ -248,13 +425,50 @@ class Site:
             Returns False if the server could not be connected
             or if an error is returned.
         """
-        # https://www.data.go.jp/data/api/3/action/package_search?fq=(metadata_modified:["2020-06-20T00:00:00Z" TO *] OR metadata_created:["2020-06-20T00:00:00Z" TO *])  # noqa: E501
+        packages = self.iter_updated_packages(since)
+        if packages is False:
+            return False
 
-        site_id = self.get_site_id()
-        if self.proxy is None:
-            from_proxy = False
-        else:
-            from_proxy = None
+        try:
+            results = list(packages)
+        except (HttpError, ValueError) as e:
+            logger.error(str(e))
+            return False
+
+        return {
+            "help": self.get_api() + 'help_show?name=package_search',
+            "success": True,
+            "result": {
+                "count": len(results),
+                "results": results,
+            }
+        }
+
+    def iter_updated_packages(self, since=None):
+        """
+        Iterate over updated packages modified/created after
+        the datetime specified by 'since'.
+
+        The responses of the package_search API are parsed
+        incrementally, so only one package is kept in memory at once.
+        The first page is requested before returning to verify
+        that the query is executed correctly.
+
+        Parameters
+        ----------
+        since: integer or iso-format string or None
+            See `get_updated_package_list`.
+
+        Returns
+        -------
+        generator
+            Yields the metadata of the packages.
+            Raises HttpError or ValueError if the following pages
+            could not be read.
+            Returns False if the server could not be connected,
+            an error is returned or the result is not reliable.
+        """
+        # https://www.data.go.jp/data/api/3/action/package_search?fq=(metadata_modified:["2020-06-20T00:00:00Z" TO *] OR metadata_created:["2020-06-20T00:00:00Z" TO *])  # noqa: E501
 
         if since is None:
             since = datetime.datetime.utcfromtimestamp(
@@ -265,83 +479,158 @@ class Site:
         elif isinstance(since, str):
             since = datetime.datetime.fromisoformat(since)
 
-        start = 0   # default start position to be fetched
         rows = 100  # default number of rows to be fetched at once
-        count = None
-
         from_str = since.strftime('%Y-%m-%dT%H:%M:%SZ')
-        results = []
-
-        while count is None or start < count:
-            if from_proxy is None or from_proxy is True:
-                query = {
-                    'fq': r'id:{}\;* AND xckan_last_updated:["{}" TO *]'.format(
-                        site_id, from_str),
-                    'start': start,
-                    'rows': rows
-                }
-                params = urllib.parse.urlencode(query)
-                url = self.proxy + 'package_search?' + params
-                logger.debug("Updating from url;'{}'".format(url))
 
-                try:
-                    response = urllib.request.urlopen(
-                        url, context=ctx, timeout=10)
-                    from_proxy = True
-                except Exception as e:
-                    logger.error(
-                        str(e) + " while accessing proxy '{}'".format(url))
-                    return False
+        try:
+            stream, url = self.__open_updated_packages(from_str, 0, rows)
+            packages = iter(stream)
+            first = next(packages, None)
+        except (HttpError, ValueError) as e:
+            logger.error(str(e))
+            return False
 
-            if from_proxy is None or from_proxy is False:
-                query = {
-                    'fq': ('(metadata_modified:["{0}" TO *] OR '
-                           'metadata_created:["{0}" TO *])').format(from_str),
-                    'start': start,
-                    'rows': rows
-                }
-                # params = urllib.parse.quote(q)  # , safe='([]):*')
-                params = urllib.parse.urlencode(query)
-                url = self.get_api() + 'package_search?' + params
+        # Verify that the query is executed correctly
+        if first is not None:
+            m = Metadata.get_instance(first, self)
+            if m is False:
+                stream.fp.release_conn()
+                raise RuntimeError(
+                    "Cannot detect metadata class.\n"
+                    + json.dumps(first, indent=2, ensure_ascii=False))
+
+            if self.proxy is None and not m.support_fq():
+                stream.fp.release_conn()
+                logger.warn(
+                    "The result of 'package_search' API is not reliable.")
+                return False
 
+        def iterate(stream, url, packages, first):
+            start = 0
+            while True:
+                n = 0
                 try:
-                    response = urllib.request.urlopen(
-                        url, context=ctx, timeout=10)
-                    from_proxy = False
-                except Exception as e:
-                    logger.error(
-                        str(e) + " while accessing '{}'".format(url))
-                    return False
+                    if first is not None:
+                        yield first
+                        n += 1
+                        first = None
+
+                    for package in packages:
+                        yield package
+                        n += 1
+                except urllib3.exceptions.HTTPError as e:
+                    raise HttpError(
+                        str(e) + " while reading '{}'".format(url),
+                        url=url) from e
+                finally:
+                    stream.fp.release_conn()
+
+                if stream.fields.get('success') is False or \
+                        not stream.found:
+                    raise JsonStreamError(
+                        "Unexpected response from '{}'".format(url))
+
+                start += n
+                count = stream.fields.get('result.count', 0)
+                if n == 0 or start >= count:
+                    return
+
+                stream, url = self.__open_updated_packages(
+                    from_str, start, rows)
+                packages = iter(stream)
+
+        return iterate(stream, url, packages, first)
+
+    def __open_updated_packages(self, from_str, start, rows):
+        """
+        Request a page of the updated packages.
 
-            body = response.read()
-            try:
-                result = json.loads(body.decode('utf-8'))
-            except json.decoder.JSONDecodeError:
-                logger.error(
-                    "Not JSON response from '{}'".format(url))
-                return False
+        Returns
+        -------
+        (JsonArrayStream, str)
+            The stream over the packages in the page and the url.
+        """
+        if self.proxy is not None:
+            query = {
+                'fq': r'id:{}\;* AND xckan_last_updated:["{}" TO *]'.format(
+                    self.get_site_id(), from_str),
+                'start': start,
+                'rows': rows
+            }
+            params = urllib.parse.urlencode(query)
+            url = self.proxy + 'package_search?' + params
+            logger.debug("Updating from url;'{}'".format(url))
+        else:
+            query = {
+                'fq': ('(metadata_modified:["{0}" TO *] OR '
+                       'metadata_created:["{0}" TO *])').format(from_str),
+                'start': start,
+                'rows': rows
+            }
+            params = urllib.parse.urlencode(query)
+            url = self.get_api() + 'package_search?' + params
 
-            results += result['result']['results']
-            start = len(results)
-            count = result['result']['count']
+        try:
+            response = http_client.get(url, timeout=10, stream=True,
+                                       stats_key=self.get_site_id())
+        except HttpError as e:
+            raise HttpError(
+                str(e) + " while accessing '{}'".format(url),
+                url=url, status=e.status, headers=e.headers) from e
 
-            # Verify that the query is executed correctly
-            if len(results) > 0:
-                m = Metadata.get_instance(results[0])
-                if m is False:
-                    raise RuntimeError(
-                        "Cannot detect metadata class.\n"
-                        + json.dumps(
-                            results[0], indent=2, force_ascii=False))
+        return JsonArrayStream(response, ('result', 'results')), url
 
-                if from_proxy is False and not m.support_fq():
-                    logger.warn(
-                        "The result of 'package_search' API is not reliable.")
-                    return False
+    def search_packages(self, start=0, rows=1000):
+        """
+        Call 'package_search' API without conditions to get
+        the complete metadata of the packages page by page.
+
+        Parameters
+        ----------
+        start: int, optional
+            The start position to be fetched.
+        rows: int, optional
+            The number of packages to be fetched at once.
+            CKAN limits it to 1000 by default.
 
-            time.sleep(1)
+        Returns
+        -------
+        dict
+            A dict object decoded from the JSON returned by
+            the package_search API.
+            Returns False if the server could not be connected
+            or if an error is returned.
+        """
+        query = {
+            'q': '*:*',
+            'sort': 'metadata_created asc',
+            'start': start,
+            'rows': rows,
+        }
+        url = self.get_api() + 'package_search?' + \
+            urllib.parse.urlencode(query)
 
-        result['result']['results'] = results
+        try:
+            response = http_client.get(url, timeout=60,
+                                       stats_key=self.get_site_id())
+        except HttpError as e:
+            logger.error(
+                str(e) + " while accessing '{}'".format(url))
+            return False
+
+        try:
+            result = json.loads(response.data.decode('utf-8'))
+        except json.decoder.JSONDecodeError:
+            logger.error(
+                "Not JSON response from '{}'".format(url))
+            return False
+
+        if result.get('success') is not True or \
+                not isinstance(result.get('result'), dict) or \
+                'results' not in result['result']:
+            logger.error(
+                "Unexpected response from '{}'".format(url))
+            return False
 
         return result
 
@@ -351,13 +640,13 @@ class Site:
         """
         for i in range(1, 3):
             try:
-                urllib.request.urlopen(self.get_top(), context=ctx, timeout=10)
+                http_client.get(self.get_top(), timeout=10)
                 return True
-            except (urllib.error.HTTPError, urllib.error.URLError,) as e:
-                logger.error(str(e))
-                return False
-            except ConnectionResetError as e:
+            except HttpError as e:
                 logger.error(str(e))
+                if e.status is not None:
+                    return False
+
                 time.sleep(1)
 
         return False
@@ -373,13 +662,36 @@ class Site:
 
         return True
 
+    def set_metadata_class(self, c):
+        """
+        Record the Metadata subclass detected for the site.
+        If another class has been detected, the change is counted
+        in `metadata_class_changes` and logged for the first time.
+
+        Parameters
+        ----------
+        c: class
+            The subclass of xckan.model.metadata.Metadata.
+        """
+        if self.metadata_class is not None and self.metadata_class is not c:
+            change = "{} -> {}".format(
+                self.metadata_class.__name__, c.__name__)
+            if change not in self.metadata_class_changes:
+                logger.warning("[{}] Metadata format changed: {}".format(
+                    self.get_site_id(), change))
+                self.metadata_class_changes[change] = 0
+
+            self.metadata_class_changes[change] += 1
+
+        self.metadata_class = c
+
     def get_site_class(self):
         metadata = self.__get_sample_metadata()
         if metadata is False:
             logger.error("Cannot get sample metadata.")
             return False
 
-        c = Metadata.get_class(metadata)
+        c = Metadata.get_class(metadata, self)
         if c is False:
             logger.error(
                 "Cannot detect metadata class.\n"
@@ -396,7 +708,7 @@ class Site:
         if metadata is None:
             metadata = self.__get_sample_metadata()
 
-        m = Metadata.get_instance(metadata)
+        m = Metadata.get_instance(metadata, self)
         results = {}
         solr_metadata = m.get_solr_metadata(self)
         for k, v in solr_metadata.items():
@@ -419,7 +731,7 @@ class Site:
         package_id = res['result'][0]
         res = self.get_package_metadata(package_id)
 
-        if not res:
+        if not res or res.get('success') is False:
             return False
 
         self.sample_metadata = res['result']
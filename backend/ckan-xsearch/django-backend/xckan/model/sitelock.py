@@ -0,0 +1,184 @@
+# coding: utf-8
+
+import errno
+import fcntl
+import json
+from logging import getLogger
+import os
+import socket
+import threading
+import time
+
+logger = getLogger(__name__)
+
+
+class SiteLock(object):
+    """
+    Exclusive lock of a site between processes.
+
+    The lock file is locked by `fcntl.flock` while the holder
+    keeps it open, and the kernel releases it when the holder exits,
+    so a crashed process never leaves a stale lock behind.
+    The pid, the hostname and the time of the holder are written
+    to the file, and the file is touched periodically as a heartbeat.
+
+    When the lock is acquired but the file still names a holder,
+    the holder is checked:
+
+    - On the same host, the holder is dead since it no longer keeps
+      the file locked, unless the file is written by an older version
+      (only the pid) and the process of the pid is alive.
+    - On another host, where the lock may not be shared, the holder
+      is alive while its heartbeat is newer than `expire` seconds.
+    """
+
+    def __init__(self, path, expire=600):
+        """
+        Parameters
+        ----------
+        path: str
+            The path to the lock file, created if not exists.
+        expire: int, optional
+            Seconds until the lease of a holder on another host expires.
+        """
+        self.path = path
+        self.expire = expire
+        self.fd = None
+        self.stopped = threading.Event()
+        self.heartbeat = None
+
+    @staticmethod
+    def __is_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # Owned by another user.
+            return True
+
+        return True
+
+    def get_holder(self):
+        """
+        Get the holder written in the lock file.
+
+        Returns
+        -------
+        dict or None
+            'pid', 'hostname' and 'acquired_at' of the holder,
+            or None if not written.
+            'hostname' is None if written by an older version.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                content = f.read().strip()
+        except FileNotFoundError:
+            return None
+
+        if content == '':
+            return None
+
+        if content.isdigit():
+            return {"pid": int(content), "hostname": None,
+                    "acquired_at": None}
+
+        try:
+            return json.loads(content)
+        except ValueError:
+            logger.warning("Broken lock file '{}'".format(self.path))
+            return None
+
+    def __is_held_by(self, holder):
+        """
+        Check whether the holder written in the file is still alive,
+        after the file is locked by this process.
+        """
+        if holder is None:
+            return False
+
+        if holder['hostname'] is None:
+            return holder['pid'] != os.getpid() and \
+                self.__is_alive(holder['pid'])
+
+        if holder['hostname'] != socket.gethostname():
+            return time.time() - os.path.getmtime(self.path) < self.expire
+
+        return False
+
+    def acquire(self):
+        """
+        Acquire the lock without waiting.
+
+        Returns
+        -------
+        bool
+            True if the lock is acquired, False if held by another.
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            os.close(fd)
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+
+            logger.debug("'{}' is locked by {}".format(
+                self.path, self.get_holder()))
+            return False
+
+        holder = self.get_holder()
+        if self.__is_held_by(holder):
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            logger.debug("'{}' is locked by {}".format(self.path, holder))
+            return False
+
+        if holder is not None:
+            logger.info("Reclaimed '{}' from the dead holder {}".format(
+                self.path, holder))
+
+        data = json.dumps({
+            "pid": os.getpid(),
+            "hostname": socket.gethostname(),
+            "acquired_at": time.time(),
+        }).encode('utf-8')
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, data, 0)
+
+        self.fd = fd
+        self.stopped.clear()
+        self.heartbeat = threading.Thread(
+            target=self.__beat, name='heartbeat', daemon=True)
+        self.heartbeat.start()
+        return True
+
+    def __beat(self):
+        while not self.stopped.wait(self.expire / 4):
+            try:
+                os.utime(self.fd)
+            except OSError as e:
+                logger.warning("{} (while touching '{}')".format(
+                    e, self.path))
+
+    def release(self):
+        """
+        Release the lock.
+        The file is emptied but not removed, so that a process
+        which has opened it does not lock a removed file.
+
+        Returns
+        -------
+        bool
+            True if released, False if not held.
+        """
+        if self.fd is None:
+            return False
+
+        self.stopped.set()
+        self.heartbeat.join()
+        os.ftruncate(self.fd, 0)
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+        return True
@@ -0,0 +1,7 @@
+# encoding: utf-8
+
+# How to perform the test
+# Prerequisites: none (solr is not used)
+#
+# cd ckan-xsearch/django-backend
+# python manage.py test xckan
@@ -0,0 +1,196 @@
+# coding: utf-8
+
+import copy
+import json
+import os
+from unittest import mock
+
+from xckan.model.archive import MetadataArchive
+from xckan.model.cache import CkanCache
+from xckan.model.tests.utils import CkanSiteTestCase, \
+    TemporaryDirectoryTestCase
+from xckan.siteconf import site_config
+
+
+class MetadataArchiveTest(TemporaryDirectoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.dir, 'archive')
+        self.archive = self.open()
+
+    def open(self):
+        archive = MetadataArchive(self.path)
+        self.addCleanup(archive.close)
+        return archive
+
+    def get_content(self, package_id, title='Title'):
+        return {"success": True,
+                "result": {"id": package_id, "title": title}}
+
+    def read_index(self):
+        with open(os.path.join(self.path, 'index.tsv')) as f:
+            return f.readlines()
+
+    def test_append(self):
+        self.assertIsNone(self.archive.get('p1'))
+        self.assertTrue(self.archive.append(
+            'p1', self.get_content('p1'), fetched_at=100))
+        # The same version is not appended.
+        self.assertFalse(self.archive.append('p1', self.get_content('p1')))
+        self.assertTrue(self.archive.append(
+            'p1', self.get_content('p1', 'Modified'), fetched_at=200))
+
+        self.assertEqual(len(self.archive), 1)
+        self.assertIn('p1', self.archive)
+        self.assertEqual(self.archive.get('p1'), {
+            "id": "p1", "fetched_at": 200,
+            "content": self.get_content('p1', 'Modified')})
+        self.assertEqual(len(self.read_index()), 2)
+
+        # The index is loaded again.
+        archive = self.open()
+        self.assertEqual(
+            archive.get('p1')['content'], self.get_content('p1', 'Modified'))
+        self.assertFalse(archive.append(
+            'p1', self.get_content('p1', 'Modified')))
+
+    def test_each(self):
+        self.archive.append('p1', self.get_content('p1'))
+        self.archive.append('p2', self.get_content('p2'))
+        self.archive.append('p1', self.get_content('p1', 'Modified'))
+
+        self.assertEqual(
+            [(v['id'], v['content']['result']['title'])
+             for v in self.archive.each()],
+            [('p2', 'Title'), ('p1', 'Modified')])
+        self.assertEqual(
+            [(v['id'], v['content']['result']['title'])
+             for v in self.archive.each(latest_only=False)],
+            [('p1', 'Title'), ('p2', 'Title'), ('p1', 'Modified')])
+
+    def test_segments(self):
+        with mock.patch.object(MetadataArchive, 'segment_bytes', 100):
+            for i in range(5):
+                package_id = 'p{}'.format(i)
+                self.archive.append(package_id, self.get_content(package_id))
+
+        names = sorted(name for name in os.listdir(self.path)
+                       if name.endswith('.jsonl'))
+        self.assertEqual(
+            names, ['metadata_{:0>3}.jsonl'.format(i) for i in range(5)])
+        self.assertEqual(
+            [v['id'] for v in self.archive.each()],
+            ['p{}'.format(i) for i in range(5)])
+
+        # Appended to the last segment after reopened.
+        archive = self.open()
+        self.assertEqual(archive.segment, 4)
+        archive.append('p0', self.get_content('p0', 'Modified'))
+        self.assertEqual(archive.get('p0')['content']['result']['title'],
+                         'Modified')
+        self.assertEqual(archive.get('p4')['id'], 'p4')
+
+    def test_delete(self):
+        self.archive.append('p1', self.get_content('p1'))
+        self.archive.append('p2', self.get_content('p2'))
+        self.archive.delete(['p1', 'missing'])
+        self.assertNotIn('p1', self.archive)
+        self.assertIsNone(self.archive.get('p1'))
+        self.assertEqual([v['id'] for v in self.archive.each()], ['p2'])
+        self.assertEqual(
+            len(list(self.archive.each(latest_only=False))), 2)
+
+        archive = self.open()
+        self.assertNotIn('p1', archive)
+        self.assertIn('p2', archive)
+
+    def test_compact_index(self):
+        for title in ('A', 'B', 'C'):
+            self.archive.append('p1', self.get_content('p1', title))
+
+        self.archive.append('p2', self.get_content('p2'))
+        self.archive.delete(['p2'])
+        self.assertEqual(len(self.read_index()), 5)
+
+        self.archive.compact_index()
+        self.assertEqual(len(self.read_index()), 1)
+        archive = self.open()
+        self.assertEqual(len(archive), 1)
+        self.assertEqual(
+            archive.get('p1')['content']['result']['title'], 'C')
+
+    def test_broken_index(self):
+        self.archive.append('p1', self.get_content('p1'))
+        self.archive.append('p2', self.get_content('p2'))
+        # Interrupted while appending to the index.
+        with open(os.path.join(self.path, 'index.tsv'), 'a') as f:
+            f.write('p1\t0\t')
+
+        archive = self.open()
+        self.assertEqual(len(archive), 2)
+        self.assertEqual(archive.get('p1')['id'], 'p1')
+
+
+class ArchivedSiteTest(CkanSiteTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(site_config, 'METADATA_ARCHIVE', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_update_site(self):
+        self.assertTrue(self.cache.update_site(self.site))
+        archive = self.cache.get_metadata_archive(self.site)
+        self.assertEqual(len(archive), len(self.packages))
+
+        del self.packages['pkg0']
+        self.assertTrue(self.cache.update_site(self.site))
+        self.assertNotIn('pkg0', archive)
+        self.assertEqual(
+            {v['id'] for v in self.cache.each_archived_metadata(self.site)},
+            {'pkg1', 'pkg2', 'pkg3', 'pkg4'})
+
+    def test_reindex_site(self):
+        self.assertTrue(self.cache.update_site(self.site))
+        documents = copy.deepcopy(self.cache.solr_manager.documents)
+        with mock.patch.object(CkanCache, 'each_metadata') as each_metadata:
+            id_list = self.cache.reindex_site(self.site)
+
+        each_metadata.assert_not_called()
+        self.assertEqual(set(id_list), set(self.packages))
+        # The same documents except the key order of 'data_dict',
+        # which is sorted in the archive.
+        self.assertEqual(self.cache.solr_manager.documents.keys(),
+                         documents.keys())
+        for id, doc in self.cache.solr_manager.documents.items():
+            self.assertEqual(json.loads(doc.pop('data_dict')),
+                             json.loads(documents[id].pop('data_dict')))
+            self.assertEqual(doc, documents[id])
+
+    def test_reindex_site_incomplete(self):
+        # The archive is enabled after the packages were cached.
+        with mock.patch.object(site_config, 'METADATA_ARCHIVE', False):
+            self.assertTrue(self.cache.update_site(self.site))
+
+        self.cache.get_metadata_archive(self.site).append(
+            'pkg0', {"success": True, "result": self.packages['pkg0']})
+        with mock.patch.object(
+                CkanCache, 'each_metadata',
+                return_value=iter([])) as each_metadata:
+            self.cache.reindex_site(self.site)
+
+        each_metadata.assert_called_once()
+
+    def test_fill_archive(self):
+        with mock.patch.object(site_config, 'METADATA_ARCHIVE', False):
+            self.assertTrue(self.cache.update_site(self.site))
+
+        # The unchanged packages are archived when fetched again.
+        self.cache.metadata_expiration_days = -1
+        for name in self.packages:
+            self.cache.get_package_metadata(self.site, name)
+
+        archive = self.cache.get_metadata_archive(self.site)
+        self.assertEqual(len(archive), len(self.packages))
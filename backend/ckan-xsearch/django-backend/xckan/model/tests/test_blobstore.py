@@ -0,0 +1,114 @@
+# coding: utf-8
+
+import hashlib
+import os
+
+from xckan.model.blobstore import BlobStore
+from xckan.model.tests.utils import TemporaryDirectoryTestCase
+
+
+class BlobStoreTest(TemporaryDirectoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = BlobStore(os.path.join(self.dir, 'blobs'))
+
+    def write_file(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+        return path, hashlib.sha256(content).hexdigest()
+
+    def read_file(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_add_and_link(self):
+        path, sha256 = self.write_file('a.part', b'content')
+        dest_path = os.path.join(self.dir, 'a.csv')
+        self.assertTrue(self.store.add_and_link(path, sha256, dest_path))
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(self.store.has(sha256))
+        self.assertEqual(self.read_file(dest_path), b'content')
+        self.assertTrue(os.path.samefile(
+            dest_path, self.store.get_blob_path(sha256)))
+
+        # The same content is stored once.
+        path, _ = self.write_file('b.part', b'content')
+        dest_path = os.path.join(self.dir, 'b.csv')
+        self.assertFalse(self.store.add_and_link(path, sha256, dest_path))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(list(self.store.each_blob()),
+                         [self.store.get_blob_path(sha256)])
+        self.assertEqual(
+            os.stat(self.store.get_blob_path(sha256)).st_nlink, 3)
+
+    def test_link_replace(self):
+        path, sha256 = self.write_file('a.part', b'new')
+        dest_path, _ = self.write_file('a.csv', b'old')
+        self.store.add_and_link(path, sha256, dest_path)
+        self.assertEqual(self.read_file(dest_path), b'new')
+        self.assertFalse(os.path.exists(dest_path + '.link'))
+
+    def test_import_file(self):
+        path, sha256 = self.write_file('a.csv', b'content')
+        self.assertEqual(self.store.import_file(path), (sha256, False))
+        self.assertTrue(os.path.samefile(
+            path, self.store.get_blob_path(sha256)))
+
+        # Imported again
+        self.assertEqual(self.store.import_file(path), (sha256, False))
+
+        # Another file with the same content is replaced with the link.
+        other_path, _ = self.write_file('b.csv', b'content')
+        self.assertEqual(
+            self.store.import_file(other_path, sha256), (sha256, True))
+        self.assertTrue(os.path.samefile(path, other_path))
+
+    def test_remove_if_unreferenced(self):
+        path, sha256 = self.write_file('a.part', b'content')
+        dest_path = os.path.join(self.dir, 'a.csv')
+        self.store.add_and_link(path, sha256, dest_path)
+        self.assertFalse(self.store.remove_if_unreferenced(sha256))
+        self.assertTrue(self.store.has(sha256))
+
+        os.remove(dest_path)
+        self.assertTrue(self.store.remove_if_unreferenced(sha256))
+        self.assertFalse(self.store.has(sha256))
+        self.assertFalse(self.store.remove_if_unreferenced(sha256))
+
+    def test_remove_unreferenced(self):
+        sha256_list = []
+        for name in ('a', 'b', 'c'):
+            path, sha256 = self.write_file(name + '.part', name.encode())
+            self.store.add_and_link(
+                path, sha256, os.path.join(self.dir, name + '.csv'))
+            sha256_list.append(sha256)
+
+        self.store.set_url_record(
+            'http://example.com/a.csv', {"sha256": sha256_list[0]})
+        os.remove(os.path.join(self.dir, 'a.csv'))
+        os.remove(os.path.join(self.dir, 'b.csv'))
+        self.assertEqual(self.store.remove_unreferenced(), (2, 2))
+        self.assertEqual([self.store.has(sha256) for sha256 in sha256_list],
+                         [False, False, True])
+
+    def test_url_record(self):
+        url = 'http://example.com/a.csv'
+        self.assertEqual(self.store.get_url_record(url), {})
+
+        path, sha256 = self.write_file('a.part', b'content')
+        validators = {"etag": '"v1"', "sha256": sha256, "content_length": 7}
+        self.store.set_url_record(url, validators)
+        # The file is not stored yet.
+        self.assertEqual(self.store.get_url_record(url), {})
+
+        self.store.add_and_link(
+            path, sha256, os.path.join(self.dir, 'a.csv'))
+        record = self.store.get_url_record(url)
+        self.assertEqual(record['url'], url)
+        self.assertEqual(record['etag'], '"v1"')
+        self.assertIsNone(record['last_modified'])
+        self.assertEqual(record['sha256'], sha256)
+        self.assertEqual(record['content_length'], 7)
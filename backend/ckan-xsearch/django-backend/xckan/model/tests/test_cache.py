@@ -0,0 +1,110 @@
+# coding: utf-8
+
+from unittest import mock
+
+from xckan.model import cache as cache_module
+from xckan.model.checkpoint import HarvestCheckpoint
+from xckan.model.tests.utils import CkanSiteTestCase
+
+
+class PackageValidatorsTest(CkanSiteTestCase):
+
+    def refresh(self):
+        """
+        Fetch all the packages again after they are expired,
+        and return the number of rewritten cache files.
+        """
+        self.requests = []
+        self.cache.metadata_expiration_days = -1
+        with mock.patch.object(
+                cache_module, 'dump_json',
+                wraps=cache_module.dump_json) as dump_json:
+            for name, package in self.packages.items():
+                content = self.cache.get_package_metadata(self.site, name)
+                self.assertEqual(content['result'], package)
+
+        return dump_json.call_count
+
+    def assert_conditional(self):
+        requests = self.get_requests('package_show')
+        self.assertEqual(len(requests), len(self.packages))
+        for request in requests:
+            self.assertIn('If-None-Match', request['headers'])
+
+    def test_serial(self):
+        self.cache.add_new_metadata(self.site, list(self.packages))
+        self.assertEqual(self.refresh(), 0)
+        self.assert_conditional()
+
+    def test_async(self):
+        self.cache.add_new_metadata(
+            self.site, list(self.packages), mode='async')
+        self.assertEqual(self.refresh(), 0)
+        self.assert_conditional()
+
+    def test_bulk(self):
+        self.cache.add_new_metadata(
+            self.site, list(self.packages), mode='bulk')
+        self.assertEqual(len(self.get_requests('package_show')), 0)
+        for name in self.packages:
+            validators = self.cache._CkanCache__read_package_validators(
+                self.site, name)
+            self.assertIn('sha256', validators)
+
+        # No validators for a conditional request in the page,
+        # but the unchanged content is not written again.
+        self.assertEqual(self.refresh(), 0)
+        self.assertEqual(
+            len(self.get_requests('package_show')), len(self.packages))
+
+    def test_modified(self):
+        self.cache.add_new_metadata(
+            self.site, list(self.packages), mode='async')
+        self.packages['pkg0']['title'] = 'Modified'
+        self.assertEqual(self.refresh(), 1)
+        self.assertEqual(
+            self.cache.get_package_metadata(
+                self.site, 'pkg0')['result']['title'], 'Modified')
+
+
+class HarvestCheckpointTest(CkanSiteTestCase):
+
+    def test_retry_failed(self):
+        self.errors['pkg3'] = 500
+        self.assertTrue(self.cache.update_site(self.site))
+        checkpoint = self.cache.get_harvest_checkpoint(self.site)
+        self.assertTrue(checkpoint.load())
+        self.assertIsNone(checkpoint.started_at)
+        self.assertEqual(checkpoint.get_remaining(), ['pkg3'])
+        self.assertEqual(len(self.cache.solr_manager.documents), 4)
+
+        # Only the failed package is fetched in the next update.
+        del self.errors['pkg3']
+        self.requests = []
+        self.assertTrue(self.cache.update_site(self.site))
+        self.assertEqual(
+            [r['path'] for r in self.get_requests('package_show')],
+            ['/api/3/action/package_show?id=pkg3'])
+        self.assertFalse(checkpoint.exists())
+        self.assertEqual(len(self.cache.solr_manager.documents), 5)
+
+    def test_resume_interrupted(self):
+        mark_done = HarvestCheckpoint.mark_done
+
+        def interrupt(checkpoint, package_id):
+            mark_done(checkpoint, package_id)
+            if len(checkpoint.done) == 2:
+                raise KeyboardInterrupt()
+
+        with mock.patch.object(HarvestCheckpoint, 'mark_done', interrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.cache.update_site(self.site)
+
+        checkpoint = self.cache.get_harvest_checkpoint(self.site)
+        self.assertTrue(checkpoint.load())
+        self.assertEqual(len(checkpoint.get_remaining()), 3)
+
+        self.requests = []
+        self.assertTrue(self.cache.update_site(self.site))
+        self.assertEqual(len(self.get_requests('package_show')), 3)
+        self.assertFalse(checkpoint.exists())
@@ -0,0 +1,48 @@
+# coding: utf-8
+
+import gzip
+import json
+import os
+
+from xckan.model import cachefile
+from xckan.model.tests.utils import TemporaryDirectoryTestCase
+
+
+class CacheFileTest(TemporaryDirectoryTestCase):
+
+    content = {"name": "日本語", "resources": [{"id": 1}, {"id": 2}]}
+
+    def test_round_trip(self):
+        path = os.path.join(self.dir, 'catalog.json')
+        for encoding in ('json', 'gzip'):
+            cachefile.dump_json(self.content, path, encoding)
+            self.assertEqual(cachefile.detect_encoding(path), encoding)
+            self.assertTrue(cachefile.is_encoded(path, encoding))
+            self.assertEqual(cachefile.load_json(path), self.content)
+            self.assertFalse(os.path.exists(path + '.tmp'))
+
+        self.assertFalse(cachefile.is_encoded(path, 'json'))
+
+    def test_legacy_pretty_json(self):
+        path = os.path.join(self.dir, 'catalog.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.content, f, indent=2, ensure_ascii=False)
+
+        self.assertEqual(cachefile.detect_encoding(path), 'json')
+        self.assertFalse(cachefile.is_encoded(path, 'json'))
+        self.assertFalse(cachefile.is_encoded(path, 'gzip'))
+        self.assertEqual(cachefile.load_json(path), self.content)
+
+    def test_broken_gzip(self):
+        path = os.path.join(self.dir, 'catalog.json')
+        data = gzip.compress(json.dumps(self.content).encode('utf-8'))
+        with open(path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+
+        with self.assertRaises(cachefile.CacheFileError):
+            cachefile.load_json(path)
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            cachefile.get_cache_encoding('bz2')
+
@@ -0,0 +1,57 @@
+# coding: utf-8
+
+import os
+
+from xckan.model.checkpoint import HarvestCheckpoint
+from xckan.model.tests.utils import TemporaryDirectoryTestCase
+
+
+class HarvestCheckpointTest(TemporaryDirectoryTestCase):
+
+    def test_resume(self):
+        path = os.path.join(self.dir, 'site', 'checkpoint.json')
+        flushed = []
+        checkpoint = HarvestCheckpoint(path, flush=lambda: flushed.append(1))
+        self.assertFalse(checkpoint.load())
+        checkpoint.start(['a', 'b', 'c'], full=True)
+        checkpoint.mark_done('a')
+        checkpoint.mark_failed('b', 'timeout')
+        checkpoint.save()
+        self.assertTrue(flushed)
+
+        resumed = HarvestCheckpoint(path)
+        self.assertTrue(resumed.load())
+        self.assertTrue(resumed.full)
+        self.assertIsNotNone(resumed.started_at)
+        self.assertEqual(resumed.get_remaining(), ['b', 'c'])
+        self.assertFalse(resumed.is_remaining('a'))
+        self.assertTrue(resumed.is_remaining('b'))
+
+    def test_finish(self):
+        path = os.path.join(self.dir, 'checkpoint.json')
+        checkpoint = HarvestCheckpoint(path)
+        checkpoint.start(['a', 'b'])
+        checkpoint.mark_done('a')
+        checkpoint.mark_failed('b', 'error')
+        checkpoint.finish()
+
+        # Only the failed package is retried in the next run.
+        retried = HarvestCheckpoint(path)
+        self.assertTrue(retried.load())
+        self.assertIsNone(retried.started_at)
+        self.assertEqual(retried.get_remaining(), ['b'])
+        retried.start(['c'])
+        self.assertEqual(retried.get_remaining(), ['c'])
+        retried.start(['b', 'c'])
+        retried.mark_done('b')
+        retried.mark_done('c')
+        retried.finish()
+        self.assertFalse(retried.exists())
+
+    def test_broken(self):
+        path = os.path.join(self.dir, 'checkpoint.json')
+        with open(path, 'w') as f:
+            f.write('{"pending": ')
+
+        self.assertFalse(HarvestCheckpoint(path).load())
+
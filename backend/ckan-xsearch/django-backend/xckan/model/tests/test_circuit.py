@@ -0,0 +1,107 @@
+# coding: utf-8
+
+import os
+import time
+from unittest import mock
+
+from xckan.model.circuit import CircuitBreaker, CircuitOpenError
+from xckan.model.tests.utils import CkanSiteTestCase, \
+    TemporaryDirectoryTestCase
+from xckan.siteconf import site_config
+
+
+class CircuitBreakerTest(TemporaryDirectoryTestCase):
+
+    def get_breaker(self, **kwargs):
+        params = dict(failures=3, error_rate=0.5, window=10,
+                      backoff=60, max_backoff=300)
+        params.update(kwargs)
+        return CircuitBreaker(
+            os.path.join(self.dir, 'circuit.json'), 'test', **params)
+
+    def test_consecutive_failures(self):
+        breaker = self.get_breaker()
+        breaker.check()
+        breaker.record_failure('e1')
+        breaker.record_success()
+        breaker.record_failure('e2')
+        breaker.record_failure('e3')
+        with self.assertRaises(CircuitOpenError):
+            breaker.record_failure('e4')
+
+        # The state is shared with the next run.
+        with self.assertRaises(CircuitOpenError):
+            self.get_breaker().check()
+
+    def test_error_rate(self):
+        breaker = self.get_breaker(failures=100, window=4)
+        breaker.record_success()
+        breaker.record_failure('e1')
+        breaker.record_success()
+        with self.assertRaises(CircuitOpenError):
+            breaker.record_failure('e2')
+
+    def test_probe(self):
+        breaker = self.get_breaker(failures=1)
+        with self.assertRaises(CircuitOpenError):
+            breaker.record_failure('e1')
+
+        # The backoff period has elapsed.
+        breaker = self.get_breaker()
+        breaker.retry_at = time.time() - 1
+        breaker.check()
+        self.assertEqual(breaker.state, 'half_open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.record_failure('e2')
+
+        self.assertEqual(breaker.backoff, 120)
+
+        breaker.retry_at = time.time() - 1
+        breaker.check()
+        for _ in range(breaker.probe_requests):
+            breaker.record_success()
+
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(self.get_breaker().state, 'closed')
+
+
+class HarvestCircuitBreakerTest(CkanSiteTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(site_config, 'CIRCUIT_FAILURES', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_not_found(self, mode):
+        for name in self.packages:
+            self.errors[name] = 404
+
+        self.assertTrue(self.cache.update_site(self.site, mode=mode))
+        self.assertEqual(
+            self.cache.get_circuit_breaker(self.site).state, 'closed')
+        checkpoint = self.cache.get_harvest_checkpoint(self.site)
+        self.assertTrue(checkpoint.load())
+        self.assertEqual(set(checkpoint.failed), set(self.packages))
+
+    def assert_server_error(self, mode):
+        for name in self.packages:
+            self.errors[name] = 500
+
+        with self.assertRaises(CircuitOpenError):
+            self.cache.update_site(self.site, mode=mode)
+
+        self.assertEqual(
+            self.cache.get_circuit_breaker(self.site).state, 'open')
+
+    def test_not_found(self):
+        self.assert_not_found('serial')
+
+    def test_not_found_async(self):
+        self.assert_not_found('async')
+
+    def test_server_error(self):
+        self.assert_server_error('serial')
+
+    def test_server_error_async(self):
+        self.assert_server_error('async')
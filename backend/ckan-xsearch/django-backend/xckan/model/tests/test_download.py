@@ -0,0 +1,111 @@
+# coding: utf-8
+
+import json
+import os
+import re
+from unittest import mock
+
+from xckan.model.cache import CkanCache
+from xckan.model.site import Site
+from xckan.model.tests.utils import HttpServerTestCase
+from xckan.siteconf import site_config
+
+
+class DownloadResourceTest(HttpServerTestCase):
+    """
+    The resource is served with an ETag, supporting If-None-Match,
+    Range and If-Range.
+    """
+
+    content = bytes(range(256)) * 1000
+    etag = '"v1"'
+
+    def setUp(self):
+        super().setUp()
+        self.resource = {"id": "r1", "url": self.url + 'data.csv'}
+        with mock.patch.object(site_config, 'CACHEDIR', self.dir):
+            self.cache = CkanCache()
+
+        self.site = Site(
+            'test', self.url + 'dataset/', self.url + 'api/3/action/',
+            rate_limit=1000, rate_burst=100)
+        self.file_path = self.cache.get_resource_file_path(
+            self.site, 'p1', self.resource)
+        os.makedirs(os.path.dirname(self.file_path))
+
+    def respond(self, request):
+        headers = request['headers']
+        if headers.get('If-None-Match') == self.etag:
+            return 304, {'ETag': self.etag}, b''
+
+        content = self.content
+        status = 200
+        range_header = headers.get('Range')
+        if range_header and headers.get('If-Range') == self.etag:
+            start = int(re.match(r'bytes=(\d+)-', range_header).group(1))
+            if start >= len(content):
+                return 416, {}, b''
+
+            status = 206
+            content = content[start:]
+
+        response_headers = {'ETag': self.etag, 'Accept-Ranges': 'bytes'}
+        if status == 206:
+            response_headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, len(self.content) - 1, len(self.content))
+
+        return status, response_headers, content
+
+    def write_part(self, data, etag):
+        with open(self.file_path + '.part', 'wb') as f:
+            f.write(data)
+
+        with open(self.file_path + '.part.json', 'w') as f:
+            json.dump({"etag": etag}, f)
+
+    def download(self):
+        result = {}
+        self.assertTrue(self.cache.save_resource(
+            self.site, 'p1', self.resource, result))
+        with open(self.file_path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+        self.assertFalse(os.path.exists(self.file_path + '.part'))
+        self.assertFalse(os.path.exists(self.file_path + '.part.json'))
+        return result
+
+    def test_download(self):
+        result = self.download()
+        self.assertEqual(result['downloaded_bytes'], 256000)
+        self.assertNotIn('resumed', result)
+        self.assertEqual(
+            self.requests[0]['headers']['Accept-Encoding'], 'identity')
+
+        # The cached file is not downloaded again.
+        result = self.download()
+        self.assertEqual(result.get('not_modified'), 1)
+        self.assertEqual(
+            self.requests[1]['headers']['If-None-Match'], self.etag)
+
+    def test_resume(self):
+        self.write_part(self.content[:1000], self.etag)
+        result = self.download()
+        self.assertEqual(result['resumed'], 1)
+        self.assertEqual(result['downloaded_bytes'], 255000)
+        self.assertEqual(self.requests[0]['headers']['Range'], 'bytes=1000-')
+
+    def test_resume_modified(self):
+        # The content has changed since the partial download.
+        self.write_part(b'x' * 1000, '"v0"')
+        result = self.download()
+        self.assertNotIn('resumed', result)
+        self.assertEqual(result['downloaded_bytes'], 256000)
+
+    def test_range_not_satisfiable(self):
+        # The partial file is longer than the content.
+        self.write_part(b'x' * 300000, self.etag)
+        result = self.download()
+        self.assertNotIn('resumed', result)
+        self.assertEqual(result['downloaded_bytes'], 256000)
+        self.assertEqual(len(self.requests), 2)
+        self.assertNotIn('Range', self.requests[1]['headers'])
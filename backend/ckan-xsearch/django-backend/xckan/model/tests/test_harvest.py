@@ -0,0 +1,85 @@
+# coding: utf-8
+
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from xckan.model.harvest import AsyncHarvester
+from xckan.model.site import Site
+
+
+class AsyncHarvesterTest(SimpleTestCase):
+
+    def get_site(self, host):
+        return Site('test', 'http://{}/dataset/'.format(host),
+                    'http://{}/api/3/action/'.format(host))
+
+    def test_run(self):
+        stored = {}
+        failed = {}
+        threads = set()
+
+        def fetch(package_id):
+            if package_id == 'missing':
+                return False
+            if package_id == 'deleted':
+                return {"success": False}
+            if package_id == 'broken':
+                raise ValueError('broken response')
+
+            return {"success": True, "result": {"id": package_id}}
+
+        def store(package_id, content):
+            threads.add(threading.get_ident())
+            stored[package_id] = content['result']
+
+        def fail(package_id, reason):
+            threads.add(threading.get_ident())
+            failed[package_id] = reason
+
+        id_list = ['p{}'.format(i) for i in range(50)] + \
+            ['missing', 'deleted', 'broken']
+        stats = AsyncHarvester(fetch, store, 4, fail).run(
+            self.get_site('run.example.com'), id_list)
+
+        self.assertEqual(stats, {"success": 50, "fail": 3})
+        self.assertEqual(set(stored), set(id_list[:50]))
+        self.assertEqual(stored['p1'], {"id": "p1"})
+        self.assertEqual(set(failed), {'missing', 'deleted', 'broken'})
+        self.assertEqual(failed['broken'], 'broken response')
+        # store and fail are called from the single writer thread.
+        self.assertEqual(len(threads), 1)
+
+    def test_concurrency(self):
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def fetch(package_id):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+            return {"success": True, "result": {}}
+
+        stats = AsyncHarvester(fetch, lambda *args: None, 3).run(
+            self.get_site('concurrency.example.com'),
+            ['p{}'.format(i) for i in range(30)])
+
+        self.assertEqual(stats['success'], 30)
+        self.assertEqual(peak[0], 3)
+
+    def test_store_error(self):
+        def store(package_id, content):
+            raise OSError('disk full')
+
+        with self.assertRaises(OSError):
+            AsyncHarvester(
+                lambda package_id: {"success": True}, store, 2).run(
+                    self.get_site('error.example.com'),
+                    ['p{}'.format(i) for i in range(20)])
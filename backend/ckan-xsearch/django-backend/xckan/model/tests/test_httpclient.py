@@ -0,0 +1,152 @@
+# coding: utf-8
+
+import gzip
+import socket
+import time
+from unittest import mock
+
+from xckan.model.httpclient import HttpClient, HttpError
+from xckan.model.ratelimit import rate_limiter
+from xckan.model.tests.utils import HttpServerTestCase
+from xckan.siteconf import site_config
+
+
+class HttpClientTest(HttpServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = HttpClient()
+
+    def respond(self, request):
+        if request['path'] == '/missing':
+            return 404, {}, b'not found'
+
+        return 200, {}, b'{"success": true}'
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            response = self.client.get(self.url + 'api')
+            self.assertEqual(response.data, b'{"success": true}')
+
+        # The connection is reused.
+        self.assertEqual(len({r['client'] for r in self.requests}), 1)
+
+    def test_headers(self):
+        self.client.get(self.url, headers={'X-Test': 'yes'})
+        headers = self.requests[0]['headers']
+        self.assertEqual(headers['User-Agent'], site_config.HTTP_USER_AGENT)
+        self.assertEqual(headers['X-Test'], 'yes')
+
+    def test_stream(self):
+        response = self.client.get(self.url, stream=True)
+        try:
+            self.assertEqual(b''.join(response.stream(4)),
+                             b'{"success": true}')
+        finally:
+            response.release_conn()
+
+    def test_error_status(self):
+        with self.assertRaises(HttpError) as cm:
+            self.client.get(self.url + 'missing')
+
+        self.assertEqual(cm.exception.status, 404)
+        self.assertEqual(cm.exception.url, self.url + 'missing')
+
+    def test_error_status_stream(self):
+        for _ in range(2):
+            with self.assertRaises(HttpError):
+                self.client.get(self.url + 'missing', stream=True)
+
+        # The connection is still usable after the error.
+        response = self.client.get(self.url, stream=True)
+        try:
+            self.assertEqual(response.data, b'{"success": true}')
+        finally:
+            response.release_conn()
+
+        self.assertEqual(len({r['client'] for r in self.requests}), 1)
+
+    def test_connection_error(self):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+
+        with self.assertRaises(HttpError) as cm:
+            self.client.get('http://127.0.0.1:{}/'.format(port), timeout=1)
+
+        self.assertIsNone(cm.exception.status)
+
+
+class ThrottledHttpClientTest(HttpServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = HttpClient()
+        self.throttled = 1
+
+    def respond(self, request):
+        if self.throttled > 0:
+            self.throttled -= 1
+            return 429, {'Retry-After': '1'}, b''
+
+        return 200, {}, b'ok'
+
+    def test_retry_after(self):
+        started_at = time.monotonic()
+        self.assertEqual(self.client.get(self.url).data, b'ok')
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.9)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_give_up(self):
+        self.throttled = 10
+        with mock.patch.object(
+                rate_limiter, 'parse_retry_after', return_value=0):
+            with self.assertRaises(HttpError) as cm:
+                self.client.get(self.url)
+
+        self.assertEqual(cm.exception.status, 429)
+        self.assertEqual(
+            len(self.requests), HttpClient.throttle_retries + 1)
+
+
+class CompressedHttpClientTest(HttpServerTestCase):
+
+    body = b'{"result": ["' + b'package,' * 1000 + b'"]}'
+
+    def setUp(self):
+        super().setUp()
+        self.client = HttpClient()
+
+    def respond(self, request):
+        if 'gzip' in request['headers'].get('Accept-Encoding', ''):
+            return 200, {'Content-Encoding': 'gzip'}, \
+                gzip.compress(self.body)
+
+        return 200, {}, self.body
+
+    def test_decode(self):
+        response = self.client.get(self.url, stats_key='site')
+        self.assertEqual(response.data, self.body)
+        stats = self.client.transfer_stats.get('site')
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['uncompressed'], len(self.body))
+        self.assertLess(stats['compressed'], len(self.body) / 10)
+
+    def test_stream(self):
+        since = self.client.transfer_stats.get('site')
+        response = self.client.get(self.url, stream=True, stats_key='site')
+        self.assertEqual(b''.join(response.stream(100)), self.body)
+        response.release_conn()
+        response.release_conn()
+        stats = self.client.transfer_stats.diff('site', since)
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['uncompressed'], len(self.body))
+        self.assertLess(stats['compressed'], len(self.body) / 10)
+
+    def test_identity(self):
+        response = self.client.get(
+            self.url, headers={'Accept-Encoding': 'identity'},
+            stats_key='site')
+        self.assertEqual(response.data, self.body)
+        stats = self.client.transfer_stats.get('site')
+        self.assertEqual(stats['compressed'], len(self.body))
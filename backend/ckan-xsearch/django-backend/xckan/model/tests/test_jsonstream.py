@@ -0,0 +1,104 @@
+# coding: utf-8
+
+import json
+
+from django.test import SimpleTestCase
+
+from xckan.model.jsonstream import JsonArrayStream, JsonStreamError
+
+
+class ChunkedReader:
+    """
+    File-like object returning the data in small chunks.
+    """
+
+    def __init__(self, data, size):
+        self.data = data
+        self.size = size
+        self.pos = 0
+
+    def read(self, size=-1):
+        chunk = self.data[self.pos:self.pos + self.size]
+        self.pos += len(chunk)
+        return chunk
+
+
+
+class JsonArrayStreamTest(SimpleTestCase):
+
+    document = {
+        "help": "https://example.com/\"quoted\"\\",
+        "success": True,
+        "result": {
+            "count": 3,
+            "results": [
+                {"name": "a", "notes": "]}\\\"[{", "num": [1.5e3, -2]},
+                {"name": "日本語", "tags": [{"name": "x"}, {}], "n": None},
+                "string", 12345, True, [],
+            ],
+            "sort": "name asc",
+        },
+    }
+
+    def parse(self, data, size, path=('result', 'results')):
+        stream = JsonArrayStream(ChunkedReader(data, size), path)
+        return list(stream), stream
+
+    def test_chunked(self):
+        text = json.dumps(self.document, ensure_ascii=False, indent=1)
+        for data in (text, text.encode('utf-8')):
+            for size in (1, 2, 3, 7, 64, 65536):
+                elements, stream = self.parse(data, size)
+                self.assertEqual(
+                    elements, self.document['result']['results'], size)
+                self.assertTrue(stream.found)
+                self.assertEqual(stream.fields, {
+                    "help": self.document['help'],
+                    "success": True,
+                    "result.count": 3,
+                    "result.sort": "name asc",
+                })
+
+    def test_numbers_across_chunks(self):
+        values = [123456789, -0.5, 1e-10, 31415926535]
+        elements, _ = self.parse(json.dumps(values), 3, ())
+        self.assertEqual(elements, values)
+
+    def test_not_found(self):
+        elements, stream = self.parse('{"success": false}', 4)
+        self.assertEqual(elements, [])
+        self.assertFalse(stream.found)
+        self.assertEqual(stream.fields, {"success": False})
+
+    def test_malformed(self):
+        for data in [
+                '{"result": {"results": [{"a": 1}, {"b": ]}}',
+                '{"result": {"results": [1, 2',
+                '{"result": {"results": [{"a": "unterminated',
+                '{"result": {"results": [1 2]}}',
+                '{"result": {"results": [1]}} extra',
+                '{"result": {"results": [tru]}}']:
+            with self.assertRaises(JsonStreamError, msg=data):
+                self.parse(data, 5)
+
+    def test_malformed_does_not_buffer_rest(self):
+        data = '[{"a": 1}}' + ' ' * 100000 + ']'
+        reader = ChunkedReader(data, 100)
+        stream = JsonArrayStream(reader, ())
+        with self.assertRaises(JsonStreamError):
+            list(stream)
+
+        self.assertLess(reader.pos, 1000)
+
+    def test_max_value_size(self):
+        data = '[["' + 'x' * 1000 + '"]]'
+        stream = JsonArrayStream(ChunkedReader(data, 10), ())
+        stream.max_value_size = 100
+        with self.assertRaises(JsonStreamError):
+            list(stream)
+
+    def test_deep_nesting(self):
+        data = '[' + '[' * 100000 + ']' * 100000 + ']'
+        with self.assertRaises(JsonStreamError):
+            self.parse(data, 65536, ())
+
@@ -0,0 +1,87 @@
+# coding: utf-8
+
+import os
+
+from xckan.model.manifest import SiteManifest
+from xckan.model.tests.utils import TemporaryDirectoryTestCase
+
+
+class SiteManifestTest(TemporaryDirectoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.manifest = SiteManifest(os.path.join(self.dir, 'manifest.db'))
+        self.addCleanup(self.manifest.close)
+
+    def test_each_resource_by_access(self):
+        self.manifest.batch_size = 3
+        for i in range(10):
+            self.manifest.set_resource(
+                'p{}'.format(i % 3), 'r{}'.format(i), 'path', 100 + i % 4,
+                size=i, sha256='h')
+
+        self.manifest.touch_resource('p0', 'r0', 200)
+        keys = []
+        for entry in self.manifest.each_resource_by_access():
+            keys.append((entry['accessed_at'], entry['package_id'],
+                         entry['id']))
+            # The deleted records are not returned again.
+            self.manifest.delete_resources([(entry['package_id'],
+                                             entry['id'])])
+
+        self.assertEqual(len(keys), 10)
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(keys[-1], (200, 'p0', 'r0'))
+        self.assertEqual(self.manifest.get_resource_package_ids(), set())
+
+    def test_packages(self):
+        self.manifest.set_package('a', 1.0, '2021-01-01', 'hash', 10)
+        self.manifest.set_package('b', 2.0)
+        self.manifest.touch_package('b', 3.0)
+        self.manifest.set_resource('a', 'r1', 'a/r1/f.csv', 1.0, 5, 'h1')
+        self.assertEqual(self.manifest.get_fetched_times(),
+                         {'a': 1.0, 'b': 3.0})
+        self.assertEqual(self.manifest.get_package('a')['hash'], 'hash')
+        self.assertEqual(self.manifest.get_resource('a', 'r1')['size'], 5)
+        self.assertEqual(self.manifest.get_resource_package_ids(), {'a'})
+        self.manifest.delete_packages(['a'])
+        self.assertIsNone(self.manifest.get_package('a'))
+        self.assertIsNone(self.manifest.get_resource('a', 'r1'))
+
+    def test_properties(self):
+        self.assertIsNone(self.manifest.get_property('metadata_class'))
+        self.manifest.set_property('metadata_class', 'CkanMetadata')
+        self.manifest.set_property('metadata_class', 'KagawaMetadata')
+        self.assertEqual(
+            self.manifest.get_property('metadata_class'), 'KagawaMetadata')
+        self.manifest.set_file_time('package_list.json', 5.0)
+        self.assertEqual(
+            self.manifest.get_file_time('package_list.json'), 5.0)
+        self.manifest.delete_file('package_list.json')
+        self.assertIsNone(self.manifest.get_file_time('package_list.json'))
+
+
+    def test_package_resources(self):
+        self.manifest.set_package('a', 1.0, size=10)
+        self.manifest.set_package('b', 2.0, size=20)
+        for package_id, resource_id in (('a', 'r1'), ('a', 'r2'),
+                                        ('b', 'r3')):
+            self.manifest.set_resource(
+                package_id, resource_id, package_id + '/' + resource_id,
+                1.0, 5, 'h')
+
+        self.assertEqual(
+            sorted(entry['id'] for entry
+                   in self.manifest.get_package_resources(['a', 'c'])),
+            ['r1', 'r2'])
+        self.assertEqual(self.manifest.get_stats(), {
+            "packages": 2, "package_bytes": 30, "last_fetched": 2.0,
+            "resources": 3, "resource_bytes": 15})
+
+        # The resources are kept to be collected as orphans.
+        self.manifest.delete_packages(['a'], with_resources=False)
+        self.assertIsNone(self.manifest.get_package('a'))
+        self.assertEqual(
+            len(self.manifest.get_package_resources(['a'])), 2)
+        self.assertEqual(
+            self.manifest.get_resource_package_ids(), {'a', 'b'})
@@ -0,0 +1,165 @@
+# coding: utf-8
+
+import datetime
+from html.parser import HTMLParser
+from io import StringIO
+import random
+import re
+
+from django.test import SimpleTestCase
+
+from xckan.model.metadata import Metadata, strip_tags, unnest
+
+
+# The implementations before the optimizations, to check that
+# the current ones return the same results.
+
+def legacy_unnest(obj, dic, prefix=''):
+    if isinstance(obj, list):
+        for x in obj:
+            legacy_unnest(x, dic, prefix)
+    elif isinstance(obj, dict):
+        for k, v in obj.items():
+            new_prefix = prefix + '.' + k if len(prefix) > 0 else k
+            legacy_unnest(v, dic, new_prefix)
+    elif prefix not in dic:
+        dic[prefix] = obj
+    else:
+        if not isinstance(dic[prefix], list):
+            if dic[prefix] == obj:
+                pass
+            else:
+                dic[prefix] = [dic[prefix], obj]
+        elif obj not in dic[prefix]:
+            dic[prefix].append(obj)
+
+    return dic
+
+
+def legacy_reformat_date_field(dt_str):
+    if dt_str is None or dt_str == '':
+        return None
+
+    m = re.search(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}', dt_str)
+    if not m:
+        return None
+
+    try:
+        dt = datetime.datetime.strptime(m.group(0), '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
+
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class LegacyMLStripper(HTMLParser):
+
+    def __init__(self):
+        super().__init__()
+        self.reset()
+        self.strict = False
+        self.convert_charrefs = True
+        self.text = StringIO()
+        self.tag_started = set()
+        self.is_mltext = False
+
+    def handle_starttag(self, tag, attrs):
+        self.tag_started = self.tag_started | set(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.tag_started:
+            self.is_mltext = True
+            self.tag_started = self.tag_started - set(tag)
+
+    def handle_data(self, d):
+        self.text.write(d)
+
+    def get_data(self, mltext: str):
+        self.feed(mltext)
+        self.close()
+        if self.is_mltext:
+            return self.text.getvalue()
+
+        return mltext
+
+
+def legacy_strip_tags(html):
+    string = LegacyMLStripper().get_data(html)
+    string = re.sub(r'([ \t　])+(?=.)', ' ', string)
+    string = re.sub(r' *([\r\n]|\\n)+ *(?=.)', ' / ', string)
+    string = re.sub(r'\n+$', '', string)
+    return string
+
+
+def random_json(rnd, depth=0):
+    """
+    Generate a random nested value with repeated keys and values.
+    """
+    r = rnd.random()
+    if depth < 4 and r < 0.3:
+        return {rnd.choice('abcd'): random_json(rnd, depth + 1)
+                for _ in range(rnd.randint(0, 4))}
+
+    if depth < 4 and r < 0.5:
+        return [random_json(rnd, depth + 1)
+                for _ in range(rnd.randint(0, 4))]
+
+    return rnd.choice([0, 1, 1.5, True, False, None, '', 'x', 'y', 'あ'])
+
+
+class StripTagsTest(SimpleTestCase):
+
+    def test_strip_tags(self):
+        for value in [
+                '', 'plain text', 'a  b\t\tc　　d',
+                'line1\nline2\r\n\r\nline3\n\n', 'escaped\\nnewline',
+                'a & b', '1 < 2', '<p>para</p>', '<p>a<br>b</p>',
+                '<a href="x">link</a> &amp; text', '<b>bold</b>\n',
+                '<p>one</p>\n<p>two</p>', 'not <closed', '<i>x</i> <u>y</u>',
+                '  leading and trailing  ', '<p>&lt;tag&gt;</p>']:
+            self.assertEqual(
+                strip_tags(value), legacy_strip_tags(value), value)
+
+    def test_strip_tags_matches_tag_names(self):
+        # The old parser compared the characters of the tag names.
+        self.assertEqual(strip_tags('<div>a</div>'), 'a')
+        self.assertEqual(strip_tags('<br>a</b>'), '<br>a</b>')
+
+
+class MetadataEquivalenceTest(SimpleTestCase):
+
+    def test_unnest(self):
+        rnd = random.Random(1)
+        for _ in range(2000):
+            obj = random_json(rnd)
+            self.assertEqual(
+                unnest(obj), legacy_unnest(obj, {}), obj)
+
+    def test_unnest_does_not_share_default(self):
+        unnest({"a": 1})
+        self.assertEqual(unnest({"b": 2}), {"b": 2})
+
+    def test_unnest_keeps_order(self):
+        package = {
+            "resources": [
+                {"name": "b", "format": "CSV"},
+                {"name": "a", "format": "CSV"},
+                {"name": "b", "format": "PDF"},
+            ]
+        }
+        self.assertEqual(unnest(package), {
+            "resources.name": ["b", "a"],
+            "resources.format": ["CSV", "PDF"],
+        })
+
+    def test_reformat_date_field(self):
+        for value in [
+                None, '', 'abc', '2021-03-04T05:06:07',
+                '2021-03-04T05:06:07.123456', 'at 2021-03-04T05:06:07+09:00',
+                '2021-02-30T00:00:00', '2021-13-01T00:00:00',
+                '2021-03-04T24:00:00', '0999-01-01T00:00:00',
+                '0001-01-01T00:00:00', '2021-03-04 05:06:07',
+                '２０２１-03-04T05:06:07', '2021-03-04T05:06:07Z']:
+            self.assertEqual(
+                Metadata.reformat_date_field(value),
+                legacy_reformat_date_field(value), value)
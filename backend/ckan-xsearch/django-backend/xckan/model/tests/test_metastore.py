@@ -0,0 +1,117 @@
+# coding: utf-8
+
+import os
+from unittest import mock
+
+from xckan.model.metastore import MetadataStore
+from xckan.model.tests.utils import CkanSiteTestCase, \
+    TemporaryDirectoryTestCase
+from xckan.siteconf import site_config
+
+
+class MetadataStoreTest(TemporaryDirectoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = MetadataStore(os.path.join(self.dir, 'metadata.db'))
+        self.addCleanup(self.store.close)
+
+    def get_content(self, package_id, title='Title'):
+        return {"success": True, "result": {
+            "id": package_id, "title": title,
+            "metadata_modified": "2021-01-02T00:00:00"}}
+
+    def test_put(self):
+        self.assertIsNone(self.store.get('p1'))
+        self.assertFalse(self.store.has('p1'))
+
+        content = self.get_content('p1')
+        self.store.put('p1', content, fetched_at=100)
+        self.assertEqual(self.store.get('p1'), (content, 100))
+        self.assertTrue(self.store.has('p1'))
+
+        # Replaced
+        content = self.get_content('p1', 'Modified')
+        self.store.put('p1', content, fetched_at=200)
+        self.assertEqual(self.store.get('p1'), (content, 200))
+        self.assertEqual(self.store.count(), 1)
+
+        self.store.touch('p1', fetched_at=300)
+        self.assertEqual(self.store.get('p1'), (content, 300))
+
+    def test_validators(self):
+        self.assertEqual(self.store.get_validators('p1'), {})
+        self.store.put('p1', self.get_content('p1'),
+                       validators={"etag": '"v1"'})
+        self.assertEqual(self.store.get_validators('p1'), {"etag": '"v1"'})
+
+        # Kept if omitted
+        self.store.put('p1', self.get_content('p1', 'Modified'))
+        self.assertEqual(self.store.get_validators('p1'), {"etag": '"v1"'})
+
+        self.store.set_validators('p1', {"etag": '"v2"'})
+        self.assertEqual(self.store.get_validators('p1'), {"etag": '"v2"'})
+
+    def test_delete(self):
+        for i in range(3):
+            package_id = 'p{}'.format(i)
+            self.store.put(package_id, self.get_content(package_id))
+
+        self.store.delete(['p0', 'p2', 'missing'])
+        self.assertEqual(self.store.count(), 1)
+        self.assertTrue(self.store.has('p1'))
+
+    def test_each(self):
+        for i in range(25):
+            package_id = 'p{:02d}'.format(i)
+            self.store.put(package_id, self.get_content(package_id),
+                           fetched_at=i)
+
+        with mock.patch.object(MetadataStore, 'batch_size', 10):
+            package_ids = [package_id for package_id, content
+                           in self.store.each()]
+            self.assertEqual(
+                package_ids, ['p{:02d}'.format(i) for i in range(25)])
+
+            # Expired ones are skipped.
+            package_ids = [package_id for package_id, content
+                           in self.store.each(expire_timestamp=20)]
+            self.assertEqual(
+                package_ids, ['p{:02d}'.format(i) for i in range(20, 25)])
+
+    def test_reopen(self):
+        self.store.put('p1', self.get_content('p1'), fetched_at=100)
+        self.store.close()
+        self.store = MetadataStore(self.store.path)
+        self.assertEqual(
+            self.store.get('p1'), (self.get_content('p1'), 100))
+
+
+class SqliteCacheBackendTest(CkanSiteTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(site_config, 'CACHE_BACKEND', 'sqlite')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_update_site(self):
+        self.assertTrue(self.cache.update_site(self.site))
+        store = self.cache.get_metadata_store(self.site)
+        self.assertEqual(store.count(), len(self.packages))
+        self.assertEqual(len(self.cache.solr_manager.documents),
+                         len(self.packages))
+
+        # Refreshed by the conditional request.
+        self.requests = []
+        self.cache.metadata_expiration_days = -1
+        content = self.cache.get_package_metadata(self.site, 'pkg0')
+        self.assertEqual(content['result'], self.packages['pkg0'])
+        self.assertIn('If-None-Match',
+                      self.get_requests('package_show')[0]['headers'])
+
+        # Removed from the site.
+        del self.packages['pkg0']
+        self.assertTrue(self.cache.update_site(self.site))
+        self.assertEqual(store.count(), len(self.packages))
+        self.assertFalse(store.has('pkg0'))
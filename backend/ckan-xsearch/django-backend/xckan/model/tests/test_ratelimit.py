@@ -0,0 +1,124 @@
+# coding: utf-8
+
+import datetime
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from xckan.model.ratelimit import RateLimiter, TokenBucket
+from xckan.siteconf import site_config
+
+
+class TokenBucketTest(SimpleTestCase):
+
+    def test_unlimited(self):
+        bucket = TokenBucket(0, 1)
+        started_at = time.monotonic()
+        for _ in range(1000):
+            bucket.acquire()
+
+        self.assertLess(time.monotonic() - started_at, 0.5)
+        bucket.feedback(200, 0.1)
+        self.assertEqual(bucket.rate, 0)
+
+    def test_burst(self):
+        bucket = TokenBucket(1, 5)
+        started_at = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+
+        self.assertLess(time.monotonic() - started_at, 0.5)
+
+    def test_wait(self):
+        bucket = TokenBucket(20, 1)
+        started_at = time.monotonic()
+        for _ in range(4):
+            bucket.acquire()
+
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.14)
+
+    def test_aimd(self):
+        bucket = TokenBucket(10, 1)
+        bucket.feedback(429, 0.1)
+        self.assertEqual(bucket.rate, 5)
+        for _ in range(10):
+            bucket.feedback(None, 0.1)
+
+        self.assertEqual(bucket.rate, 10 * bucket.min_rate_factor)
+        for _ in range(100):
+            bucket.feedback(200, 0.1)
+
+        self.assertEqual(bucket.rate, 10)
+
+    def test_slowdown(self):
+        bucket = TokenBucket(10, 1)
+        bucket.feedback(200, 0.1)
+        for _ in range(20):
+            bucket.feedback(200, 10.0)
+
+        self.assertLess(bucket.rate, 10)
+
+    def test_retry_after(self):
+        bucket = TokenBucket(0, 1)
+        bucket.feedback(503, 0.1, retry_after=0.2)
+        started_at = time.monotonic()
+        bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.15)
+
+    def test_configure(self):
+        bucket = TokenBucket(10, 1)
+        bucket.configure(4, 2)
+        self.assertEqual(bucket.rate, 4)
+        self.assertEqual(bucket.burst, 2)
+
+    def test_limiter(self):
+        limiter = RateLimiter()
+        limiter.configure('http://a.example.com/api/', 2, 3)
+        bucket = limiter.get_bucket('http://a.example.com/other')
+        self.assertEqual((bucket.max_rate, bucket.burst), (2, 3))
+        self.assertIsNot(
+            limiter.get_bucket('http://b.example.com/'), bucket)
+
+    def test_parse_retry_after(self):
+        self.assertIsNone(RateLimiter.parse_retry_after(None))
+        self.assertIsNone(RateLimiter.parse_retry_after('soon'))
+        self.assertEqual(RateLimiter.parse_retry_after('120'), 120)
+        self.assertEqual(RateLimiter.parse_retry_after('-1'), 0)
+        self.assertEqual(RateLimiter.parse_retry_after(
+            'Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+        later = datetime.datetime.now(datetime.timezone.utc) + \
+            datetime.timedelta(seconds=100)
+        self.assertAlmostEqual(RateLimiter.parse_retry_after(
+            later.strftime('%a, %d %b %Y %H:%M:%S GMT')), 100, delta=2)
+
+
+    def test_unlimited_overload(self):
+        bucket = TokenBucket(0, 1)
+        bucket.overload_backoff = 0.1
+        bucket.feedback(429, 0.1)
+        started_at = time.monotonic()
+        bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.08)
+
+        # Doubled while the server keeps failing, reset on success.
+        bucket.feedback(None, 0.1)
+        bucket.feedback(503, 0.1)
+        self.assertAlmostEqual(bucket.backoff, 0.4)
+        bucket.feedback(200, 0.1)
+        self.assertEqual(bucket.backoff, 0)
+
+    def test_limiter_defaults(self):
+        limiter = RateLimiter()
+        with mock.patch.object(site_config, 'RATE_LIMIT', 1.0), \
+                mock.patch.object(site_config, 'RATE_BURST', 2):
+            limiter.configure('http://a.example.com/', None, None)
+            limiter.configure('http://b.example.com/', 0, None)
+            self.assertEqual(
+                limiter.get_bucket('http://c.example.com/').max_rate, 1)
+
+        bucket = limiter.get_bucket('http://a.example.com/')
+        self.assertEqual((bucket.max_rate, bucket.burst), (1, 2))
+        # 0 is unlimited, not the default.
+        self.assertEqual(
+            limiter.get_bucket('http://b.example.com/').max_rate, 0)
@@ -0,0 +1,94 @@
+# coding: utf-8
+
+import os
+from unittest import mock
+
+from xckan.model.tests.utils import CkanSiteTestCase
+from xckan.siteconf import site_config
+
+
+class ResourceCacheTest(CkanSiteTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(site_config, 'RESOURCE_PIN_PERIOD', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def download(self):
+        self.assertTrue(self.cache.update_site(self.site))
+        stats = self.cache.get_resources_from_site(self.site)
+        self.assertEqual(stats['fail'], 0)
+
+    def get_blobs(self):
+        return sorted(os.path.basename(path)
+                      for path in self.cache.blob_store.each_blob())
+
+    def get_resource_ids(self):
+        manifest = self.cache.get_manifest(self.site)
+        return sorted(entry['id'] for entry in manifest.get_package_resources(
+            sorted(manifest.get_resource_package_ids())))
+
+    def test_delete_package(self):
+        self.download()
+        self.assertEqual(len(self.get_blobs()), 5)
+        path = self.cache.get_resource_file_path(
+            self.site, 'pkg0', self.packages['pkg0']['resources'][0])
+        self.assertTrue(os.path.isfile(path))
+
+        del self.packages['pkg0']
+        self.assertTrue(self.cache.update_site(self.site))
+        self.assertEqual(len(self.get_blobs()), 4)
+        self.assertEqual(self.get_resource_ids(),
+                         ['pkg1-r0', 'pkg2-r0', 'pkg3-r0', 'pkg4-r0'])
+        self.assertFalse(os.path.exists(path))
+
+    def test_delete_shared(self):
+        # The same file is published by two packages.
+        self.files['pkg1-r0.csv'] = self.files['pkg0-r0.csv']
+        self.download()
+        blobs = self.get_blobs()
+        self.assertEqual(len(blobs), 4)
+
+        del self.packages['pkg0']
+        self.assertTrue(self.cache.update_site(self.site))
+        self.assertEqual(self.get_blobs(), blobs)
+
+        del self.packages['pkg1']
+        self.assertTrue(self.cache.update_site(self.site))
+        self.assertEqual(len(self.get_blobs()), 3)
+
+    def test_collect_orphans(self):
+        self.download()
+        # Deleted without their resources, e.g. by an older version.
+        self.cache.get_manifest(self.site).delete_packages(
+            ['pkg0'], with_resources=False)
+
+        stats = self.cache.collect_resources(quota=0, site_quota=0)
+        self.assertEqual(stats['orphans'], 1)
+        self.assertEqual(stats['removed_blobs'], 1)
+        self.assertEqual(stats['evicted'], 0)
+        self.assertEqual(len(self.get_blobs()), 4)
+        self.assertNotIn('pkg0-r0', self.get_resource_ids())
+
+    def test_collect_quota(self):
+        self.download()
+        manifest = self.cache.get_manifest(self.site)
+        for i, name in enumerate(('pkg3', 'pkg1', 'pkg4', 'pkg0', 'pkg2')):
+            manifest.touch_resource(name, name + '-r0', 1000 + i)
+
+        size = len(self.files['pkg0-r0.csv'])
+        stats = self.cache.collect_resources(quota=size * 3, site_quota=0)
+        self.assertEqual(stats['evicted'], 2)
+        self.assertEqual(stats['evicted_bytes'], size * 2)
+        self.assertEqual(stats['resource_bytes'], size * 3)
+        self.assertEqual(self.get_resource_ids(),
+                         ['pkg0-r0', 'pkg2-r0', 'pkg4-r0'])
+        self.assertEqual(len(self.get_blobs()), 3)
+
+        # The site quota overrides.
+        stats = self.cache.collect_resources(
+            quota=0, site_quota=size * 3,
+            site_quotas={self.site.get_site_id(): size})
+        self.assertEqual(stats['evicted'], 2)
+        self.assertEqual(self.get_resource_ids(), ['pkg2-r0'])
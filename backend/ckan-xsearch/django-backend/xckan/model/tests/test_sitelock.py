@@ -0,0 +1,77 @@
+# coding: utf-8
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+from xckan.model.sitelock import SiteLock
+from xckan.model.tests.utils import CkanSiteTestCase, \
+    TemporaryDirectoryTestCase
+from xckan.siteconf import site_config
+
+
+class SiteLockTest(TemporaryDirectoryTestCase):
+
+    def test_exclusive(self):
+        path = os.path.join(self.dir, 'site.lock')
+        lock = SiteLock(path)
+        other = SiteLock(path)
+        self.assertTrue(lock.acquire())
+        self.assertEqual(lock.get_holder()['pid'], os.getpid())
+        self.assertFalse(other.acquire())
+        self.assertTrue(lock.release())
+        self.assertFalse(lock.release())
+        self.assertIsNone(lock.get_holder())
+        self.assertTrue(other.acquire())
+        other.release()
+
+    def test_legacy_pid(self):
+        path = os.path.join(self.dir, 'site.lock')
+        # Written by an older version and the process is alive.
+        with open(path, 'w') as f:
+            f.write(str(os.getppid()))
+
+        self.assertFalse(SiteLock(path).acquire())
+
+        # The process is dead.
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        with open(path, 'w') as f:
+            f.write(str(process.pid))
+
+        lock = SiteLock(path)
+        self.assertTrue(lock.acquire())
+        lock.release()
+
+    def test_other_host(self):
+        path = os.path.join(self.dir, 'site.lock')
+        with open(path, 'w') as f:
+            json.dump({"pid": 1, "hostname": "other-host",
+                       "acquired_at": time.time()}, f)
+
+        self.assertFalse(SiteLock(path, expire=600).acquire())
+        os.utime(path, (time.time() - 700, time.time() - 700))
+        lock = SiteLock(path, expire=600)
+        self.assertTrue(lock.acquire())
+        lock.release()
+
+
+
+class LockedSiteTest(CkanSiteTestCase):
+
+    def test_update_locked(self):
+        lock = SiteLock(os.path.join(
+            site_config.LOCKDIR, self.site.get_site_id() + '.lock'))
+        self.assertTrue(lock.acquire())
+        try:
+            self.assertFalse(self.cache.update_site(self.site))
+            self.assertEqual(self.requests, [])
+        finally:
+            lock.release()
+
+        self.assertTrue(self.cache.update_site(self.site))
+        # Released after the update.
+        self.assertTrue(lock.acquire())
+        lock.release()
@@ -0,0 +1,49 @@
+# coding: utf-8
+
+import random
+
+from django.test import SimpleTestCase
+
+from xckan.model.vocabulary import VocabularyMatcher, get_vocabulary_matcher
+
+
+class VocabularyMatcherTest(SimpleTestCase):
+
+    @staticmethod
+    def naive_findall(terms, text):
+        found = []
+        for end in range(1, len(text) + 1):
+            for term in sorted(terms, key=len, reverse=True):
+                if term and text[:end].endswith(term) and term not in found:
+                    found.append(term)
+
+        return found
+
+    def test_findall(self):
+        terms = ['he', 'she', 'his', 'hers', 'h', 'ers', '']
+        for text in ['ushers', 'his hers', 'hhh', '', 'xyz', 'shehis']:
+            self.assertEqual(
+                VocabularyMatcher(terms).findall(text),
+                self.naive_findall(terms, text), text)
+
+    def test_findall_random(self):
+        rnd = random.Random(1)
+        for _ in range(200):
+            terms = [''.join(rnd.choice('ab') for _ in range(
+                rnd.randint(1, 4))) for _ in range(rnd.randint(1, 8))]
+            text = ''.join(rnd.choice('abc') for _ in range(20))
+            self.assertEqual(
+                VocabularyMatcher(terms).findall(text),
+                self.naive_findall(terms, text), (terms, text))
+
+    def test_japanese(self):
+        matcher = VocabularyMatcher(['人口', '人口統計', '統計'])
+        self.assertEqual(
+            matcher.findall('市の人口統計データ'), ['人口', '人口統計', '統計'])
+
+    def test_get_vocabulary_matcher(self):
+        self.assertIsNone(get_vocabulary_matcher(''))
+        self.assertIsNone(get_vocabulary_matcher(',,'))
+        matcher = get_vocabulary_matcher('a,b,a')
+        self.assertEqual(len(matcher), 2)
+        self.assertIs(get_vocabulary_matcher('a,b,a'), matcher)
@@ -0,0 +1,247 @@
+# coding: utf-8
+
+import hashlib
+import http.server
+import json
+import tempfile
+import threading
+from unittest import mock
+import urllib.parse
+
+from django.test import SimpleTestCase
+
+from xckan.model.cache import CkanCache
+from xckan.model.ratelimit import rate_limiter
+from xckan.model.site import Site
+from xckan.siteconf import site_config
+
+
+class TemporaryDirectoryTestCase(SimpleTestCase):
+    """
+    Test case with a temporary directory `self.dir`,
+    removed after each test.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.dir = self.tmpdir.name
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Pass the requests to `handle_request` of the test case.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.test_case.handle_request(self)
+
+    do_HEAD = do_GET
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpServerTestCase(TemporaryDirectoryTestCase):
+    """
+    Test case with a local HTTP server at `self.url`.
+
+    The requests are recorded in `self.requests` and
+    answered by `respond`, which the subclasses implement.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), RequestHandler)
+        self.server.test_case = self
+        self.server.daemon_threads = True
+        threading.Thread(
+            target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        self.requests = []
+        self.requests_lock = threading.Lock()
+        # Not to be throttled by the default rate of the host.
+        rate_limiter.configure(self.url, 1000, 100)
+
+    def handle_request(self, handler):
+        length = int(handler.headers.get('Content-Length') or 0)
+        request = {
+            "method": handler.command,
+            "path": handler.path,
+            "headers": dict(handler.headers),
+            "body": handler.rfile.read(length),
+            "client": handler.client_address,
+        }
+        with self.requests_lock:
+            self.requests.append(request)
+
+        status, headers, body = self.respond(request)
+        handler.send_response(status)
+        for key, value in headers.items():
+            handler.send_header(key, value)
+
+        if 'Content-Length' not in headers and status != 304:
+            handler.send_header('Content-Length', str(len(body)))
+
+        handler.end_headers()
+        if handler.command != 'HEAD':
+            handler.wfile.write(body)
+
+    def respond(self, request):
+        """
+        Returns
+        -------
+        (int, dict, bytes)
+            The status, the headers and the body of the response.
+        """
+        raise NotImplementedError
+
+
+class FakeSolrManager(object):
+    """
+    SolrManager keeping the documents in memory.
+    """
+
+    def __init__(self):
+        self.documents = {}
+
+    def search(self, fq='', **kwargs):
+        prefix = fq[len('id:'):].rstrip('*').replace('\\:', ':')
+        return [doc for id, doc in self.documents.items()
+                if id.startswith(prefix)]
+
+    def add_document(self, doc):
+        self.documents[doc['id']] = doc
+
+    def delete_document(self, doc_id):
+        if isinstance(doc_id, str):
+            doc_id = [doc_id]
+
+        for id in doc_id or []:
+            self.documents.pop(id, None)
+
+    def delete_site(self, site):
+        prefix = site.get_site_id() + ':'
+        self.documents = {id: doc for id, doc in self.documents.items()
+                          if not id.startswith(prefix)}
+
+    def flash_buffer(self):
+        pass
+
+
+class CkanSiteTestCase(HttpServerTestCase):
+    """
+    Test case with a fake CKAN site served by the local server,
+    and a CkanCache in the temporary directory with `FakeSolrManager`.
+
+    The packages of the site are in `self.packages`, keyed by the name.
+    'package_show' returns an ETag and answers 304 to 'If-None-Match'.
+    The resource files are served at '/files/<name>'
+    with the content in `self.files`.
+    'package_show' of the packages in `self.errors` returns
+    the status code specified there.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.packages = {}
+        self.files = {}
+        self.errors = {}
+        for i in range(5):
+            self.add_package('pkg{}'.format(i))
+
+        for name in ('CACHEDIR', 'LOCKDIR'):
+            patcher = mock.patch.object(site_config, name, self.dir)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.cache = CkanCache()
+        self.cache.solr_manager = FakeSolrManager()
+        self.site = Site(
+            'test', self.url + 'dataset/', self.url + 'api/3/action/',
+            rate_limit=1000, rate_burst=100)
+
+    def add_package(self, name, resources=1):
+        package = {
+            "id": "id-" + name,
+            "name": name,
+            "title": "Title of " + name,
+            "notes": "Notes of " + name,
+            "metadata_created": "2021-01-01T00:00:00",
+            "metadata_modified": "2021-01-02T00:00:00",
+            "tags": [{"name": "tag"}],
+            "resources": [],
+        }
+        for i in range(resources):
+            resource_id = '{}-r{}'.format(name, i)
+            package['resources'].append({
+                "id": resource_id,
+                "name": "Resource " + resource_id,
+                "format": "CSV",
+                "url": self.url + 'files/{}.csv'.format(resource_id),
+            })
+            self.files['{}.csv'.format(resource_id)] = \
+                '{},a,b\n'.format(resource_id).encode('utf-8') * 100
+
+        self.packages[name] = package
+        return package
+
+    def respond(self, request):
+        url = urllib.parse.urlparse(request['path'])
+        query = dict(urllib.parse.parse_qsl(url.query))
+        action = url.path.rsplit('/', 1)[-1]
+        if url.path.startswith('/files/'):
+            body = self.files.get(action)
+            if body is None:
+                return 404, {}, b''
+
+            return 200, {}, body
+
+        if action == 'package_list':
+            return self.respond_json(
+                {"success": True, "result": list(self.packages)})
+
+        if action == 'package_show':
+            if query.get('id') in self.errors:
+                return self.respond_json(
+                    {"success": False}, self.errors[query['id']])
+
+            package = self.packages.get(query.get('id'))
+            if package is None:
+                return self.respond_json({"success": False}, 404)
+
+            return self.respond_json(
+                {"success": True, "result": package}, request=request)
+
+        if action == 'package_search':
+            start = int(query.get('start', 0))
+            rows = int(query.get('rows', 10))
+            packages = list(self.packages.values())
+            return self.respond_json({"success": True, "result": {
+                "count": len(packages),
+                "results": packages[start:start + rows]}})
+
+        return 404, {}, b''
+
+    @staticmethod
+    def respond_json(content, status=200, request=None):
+        body = json.dumps(content).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if request is not None:
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            headers['ETag'] = etag
+            if request['headers'].get('If-None-Match') == etag:
+                return 304, headers, b''
+
+        return status, headers, body
+
+    def get_requests(self, action):
+        return [r for r in self.requests
+                if urllib.parse.urlparse(r['path']).path.endswith(action)]
@@ -0,0 +1,116 @@
+# coding: utf-8
+
+import functools
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+class VocabularyMatcher(object):
+    """
+    Finds the terms of a controlled vocabulary in a text
+    by the Aho-Corasick algorithm.
+
+    All the terms, including overlapping ones, are found
+    in a single pass over the text, however large the vocabulary is.
+    The terms are matched literally and case-sensitively.
+    """
+
+    def __init__(self, terms):
+        """
+        Parameters
+        ----------
+        terms: iterable of str
+            The terms of the vocabulary. Empty ones are ignored.
+        """
+        # A dict is used as an ordered set.
+        self.terms = list(dict.fromkeys(t for t in terms if t))
+
+        # The trie of the terms. The state 0 is the root.
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [()]
+        for i, term in enumerate(self.terms):
+            state = 0
+            for c in term:
+                next_state = self.goto[state].get(c)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][c] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append(())
+
+                state = next_state
+
+            self.outputs[state] = (i,)
+
+        # Make the failure links in breadth-first order, and
+        # merge the terms ending at the failure states.
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for c, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and c not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+
+                fallback = self.goto[fallback].get(c, 0)
+                self.fail[next_state] = fallback
+                self.outputs[next_state] += self.outputs[fallback]
+
+    def __len__(self):
+        return len(self.terms)
+
+    def findall(self, text):
+        """
+        Find the terms in the text.
+
+        Returns
+        -------
+        list
+            The found terms without duplicates, in the order of
+            the positions where they first end. The longer terms
+            come first among those ending at the same position.
+        """
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        found = {}
+        state = 0
+        for c in text:
+            next_state = goto[state].get(c)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = goto[state].get(c)
+
+            state = next_state or 0
+            for i in outputs[state]:
+                if i not in found:
+                    found[i] = None
+
+        return [self.terms[i] for i in found]
+
+
+@functools.lru_cache(maxsize=256)
+def get_vocabulary_matcher(vocabulary):
+    """
+    Get the VocabularyMatcher of the comma-separated vocabulary.
+
+    The matcher is built once for each version of the vocabulary
+    and shared by the threads, since it is not modified after built.
+
+    Parameters
+    ----------
+    vocabulary: str
+        The terms separated by ','.
+
+    Returns
+    -------
+    VocabularyMatcher or None
+        None if the vocabulary has no terms.
+    """
+    matcher = VocabularyMatcher(vocabulary.split(','))
+    if len(matcher) == 0:
+        return None
+
+    logger.debug("Built a matcher of {} terms".format(len(matcher)))
+    return matcher
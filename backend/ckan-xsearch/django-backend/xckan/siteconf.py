@@ -23,13 +23,69 @@ class BaseConfig(object):
                         os.path.join(BASEDIR, 'logs/xckan.log'))
     CACHEDIR = os.getenv('XCKAN_CACHEDIR',
                          os.path.join(os.getenv('HOME'), 'cache/'))
+    CACHE_BACKEND = os.getenv(
+        'XCKAN_CACHE_BACKEND', 'files')  # 'files' or 'sqlite'
+    CACHE_ENCODING = os.getenv(
+        'XCKAN_CACHE_ENCODING', 'json')  # 'json', 'gzip' or 'zstd'
+    METADATA_ARCHIVE = os.getenv(
+        'XCKAN_METADATA_ARCHIVE', False)  # Keep every version as JSONL
+    METADATA_CACHE_SIZE = int(os.getenv(
+        'XCKAN_METADATA_CACHE_SIZE', 1024))  # Parsed metadata kept in memory
+    DESCRIPTION_MAX_RESOURCES = int(os.getenv(
+        'XCKAN_DESCRIPTION_MAX_RESOURCES', 0))  # 0 to list all resources
     LOCKDIR = os.getenv('XCKAN_LOCKDIR', '/tmp/')
+    SITE_LOCK_EXPIRE = int(os.getenv(
+        'XCKAN_SITE_LOCK_EXPIRE', 600))  # Seconds of a lease by another host
     QUERYLOGDIR = os.getenv(
         'XCKAN_QUERYLOGDIR',
         os.path.join(
             os.getenv('HOME'), 'query_log/'))  # Query log
     ACCEPT_SELF_SIGNED = os.getenv('ACCEPT_SELF_SIGNED', False)
 
+    # HTTP client settings
+    HTTP_POOL_NUM_POOLS = int(os.getenv(
+        'XCKAN_HTTP_NUM_POOLS', 32))  # Number of hosts to keep alive
+    HTTP_POOL_MAXSIZE = int(os.getenv(
+        'XCKAN_HTTP_POOL_MAXSIZE', 4))  # Connections per host
+    HTTP_USER_AGENT = os.getenv('XCKAN_HTTP_USER_AGENT', 'xckan')
+    HTTP_ACCEPT_ENCODING = os.getenv(
+        'XCKAN_HTTP_ACCEPT_ENCODING', 'gzip, deflate')  # Empty to disable
+    RATE_LIMIT = float(os.getenv(
+        'XCKAN_RATE_LIMIT', 1))  # Default requests/sec per host, 0 for none
+    RATE_BURST = int(os.getenv(
+        'XCKAN_RATE_BURST', 1))  # Default burst size per host
+
+    # Harvest settings
+    HARVEST_MODE = os.getenv('XCKAN_HARVEST_MODE', 'serial')
+    HARVEST_CONCURRENCY = int(os.getenv(
+        'XCKAN_HARVEST_CONCURRENCY', 4))  # Concurrent requests per host
+    RESOURCE_WORKERS = int(os.getenv(
+        'XCKAN_RESOURCE_WORKERS', 8))  # Concurrent downloads per site
+    RESOURCE_HOST_CONCURRENCY = int(os.getenv(
+        'XCKAN_RESOURCE_HOST_CONCURRENCY', 2))  # Concurrent downloads per host
+    RESOURCE_PROBE_INTERVAL = int(os.getenv(
+        'XCKAN_RESOURCE_PROBE_INTERVAL', 86400))  # Seconds to reuse probes
+    RESOURCE_CACHE_QUOTA = int(os.getenv(
+        'XCKAN_RESOURCE_CACHE_QUOTA', 0))  # Total bytes, 0 for unlimited
+    RESOURCE_SITE_QUOTA = int(os.getenv(
+        'XCKAN_RESOURCE_SITE_QUOTA', 0))  # Bytes per site, 0 for unlimited
+    RESOURCE_SITE_QUOTAS = json.loads(os.getenv(
+        'XCKAN_RESOURCE_SITE_QUOTAS', '{}'))  # Bytes by site_id
+    RESOURCE_PIN_PERIOD = int(os.getenv(
+        'XCKAN_RESOURCE_PIN_PERIOD', 3600))  # Seconds to keep used files
+
+    # Circuit breaker settings
+    CIRCUIT_FAILURES = int(os.getenv(
+        'XCKAN_CIRCUIT_FAILURES', 10))  # Consecutive failures to open
+    CIRCUIT_ERROR_RATE = float(os.getenv(
+        'XCKAN_CIRCUIT_ERROR_RATE', 0.5))  # Error rate to open
+    CIRCUIT_WINDOW = int(os.getenv(
+        'XCKAN_CIRCUIT_WINDOW', 50))  # Requests to calculate error rate
+    CIRCUIT_BACKOFF = float(os.getenv(
+        'XCKAN_CIRCUIT_BACKOFF', 3600))  # Seconds until the first probe
+    CIRCUIT_MAX_BACKOFF = float(os.getenv(
+        'XCKAN_CIRCUIT_MAX_BACKOFF', 7 * 86400))  # Max seconds between probes
+
     # Django settings
     DJANGO_SETTINGS = {
         'allowed_hosts': os.environ.get(
@@ -0,0 +1,115 @@
+"""
+Micro-benchmark of strip_tags with the package metadata in catalog.json.
+
+Usage
+PYTHONPATH=django-backend python scripts/bench_strip_tags.py [<catalog.json> [<repeat>]]
+
+The descriptions of the packages are generated by `get_description`
+with the current strip_tags and with the previous implementation,
+which parsed every text by HTMLParser and compiled the regexes
+each time, and the elapsed times are compared.
+The packages are also tested with the notes wrapped in HTML tags.
+"""
+import copy
+from html.parser import HTMLParser
+from io import StringIO
+import json
+import os
+import re
+import sys
+import time
+
+import xckan.model.metadata as metadata_module
+from xckan.model.metadata import Metadata
+
+
+class LegacyMLStripper(HTMLParser):
+
+    def __init__(self):
+        super().__init__()
+        self.reset()
+        self.strict = False
+        self.convert_charrefs = True
+        self.text = StringIO()
+        self.tag_started = set()
+        self.is_mltext = False
+
+    def handle_starttag(self, tag, attrs):
+        self.tag_started = self.tag_started | set(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.tag_started:
+            self.is_mltext = True
+            self.tag_started = self.tag_started - set(tag)
+
+    def handle_data(self, d):
+        self.text.write(d)
+
+    def get_data(self, mltext: str):
+        self.feed(mltext)
+        self.close()
+        if self.is_mltext:
+            stripped = self.text.getvalue()
+        else:
+            stripped = mltext
+
+        return stripped
+
+
+def legacy_strip_tags(html):
+    s = LegacyMLStripper()
+    string = s.get_data(html)
+    string = re.sub(r'([ \t　])+(?=.)', ' ', string)
+    string = re.sub(r' *([\r\n]|\\n)+ *(?=.)', ' / ', string)
+    string = re.sub(r'\n+$', '', string)
+    return string
+
+
+def bench(func, instances, repeat):
+    metadata_module.strip_tags = func
+    started_at = time.perf_counter()
+    for i in range(repeat):
+        descriptions = [m.get_description() for m in instances]
+
+    return time.perf_counter() - started_at, descriptions
+
+
+def run(path, repeat):
+    with open(path, 'r', encoding='utf-8') as f:
+        catalog = json.load(f)
+
+    contents = [x['result'] if 'result' in x else x for x in catalog]
+    for content in list(contents):
+        html = copy.deepcopy(content)
+        html['notes'] = '<p>{}</p>'.format(
+            (content.get('notes') or '').replace('\n', '<br>\n'))
+        contents.append(html)
+
+    instances = [Metadata.get_instance(x) for x in contents]
+    current = metadata_module.strip_tags
+    results = {}
+    for name, func in (('legacy', legacy_strip_tags), ('current', current)):
+        results[name] = bench(func, instances, repeat)
+
+    metadata_module.strip_tags = current
+    print("packages: {}, repeat: {}".format(len(instances), repeat))
+    for name, (elapsed, _) in results.items():
+        print("{:8}: {:.3f} sec ({:.1f} us/package)".format(
+            name, elapsed, elapsed / repeat / len(instances) * 1e6))
+
+    print("speedup : {:.2f}x".format(
+        results['legacy'][0] / results['current'][0]))
+    print("same descriptions: {}".format(
+        results['legacy'][1] == results['current'][1]))
+
+
+if __name__ == '__main__':
+    path = os.path.join(os.path.dirname(__file__), 'catalog.json')
+    repeat = 2000
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+
+    if len(sys.argv) > 2:
+        repeat = int(sys.argv[2])
+
+    run(path, repeat)
@@ -18,7 +18,7 @@ setuptools.setup(
         "Operationg System :: Linux",
     },
     install_requires=[
-        'pysolr>=3.9.0', 'requests>=2.24.0',
+        'pysolr>=3.9.0', 'requests>=2.24.0', 'urllib3>=1.26.0',
     ],
     python_requries='>=3.6'
 )